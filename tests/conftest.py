@@ -0,0 +1,45 @@
+"""
+Shared fixtures. Tests need only numpy, h5py and pyyaml: no flystim server, flyrpc or PyQt5
+"""
+import pytest
+
+from visprotocol.protocol import clandinin_protocol
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    # user_name is one with a resources directory, so protocols don't create a parameter_presets directory
+    return {'user_name': 'mht',
+            'rig_name': 'test_rig',
+            'rig_config': {'test_rig': {'data_directory': str(tmp_path), 'rig': 'test_rig'}}}
+
+
+class FlashProtocol(clandinin_protocol.BaseProtocol):
+    """
+    Full-field flashes at an intensity drawn each epoch from the epoch random generator
+    """
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.epoch_parameters = {}
+
+    def getEpochParameters(self):
+        intensity = float(self.getEpochRandomGenerator().choice(self.protocol_parameters['intensities']))
+        self.epoch_parameters = {'name': 'ConstantBackground',
+                                 'color': [intensity, intensity, intensity, 1.0]}
+        self.convenience_parameters = {'current_intensity': intensity}
+
+    def getRunParameterDefaults(self):
+        self.run_parameters = {'protocol_ID': 'FlashProtocol',
+                               'num_epochs': 4,
+                               'pre_time': 0.5,
+                               'stim_time': 1.0,
+                               'tail_time': 0.5,
+                               'idle_color': 0.5}
+
+    def getParameterDefaults(self):
+        self.protocol_parameters = {'intensities': [0.0, 0.25, 0.75, 1.0]}
+
+
+@pytest.fixture
+def protocol_object(cfg):
+    return FlashProtocol(cfg)
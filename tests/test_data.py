@@ -0,0 +1,216 @@
+import gc
+import json
+import os
+import weakref
+
+import h5py
+import numpy as np
+import pytest
+
+from visprotocol import clandinin_data
+
+
+@pytest.fixture
+def series_group(tmp_path):
+    with h5py.File(str(tmp_path / 'series.hdf5'), 'w') as experiment_file:
+        yield clandinin_data.createSeriesGroup(experiment_file, '/Flies/fly_1/epoch_runs/series_001', {'epoch_storage': 'table'})
+
+
+def makeData(cfg, epoch_storage='groups', metadata_journal=False):
+    cfg = dict(cfg, epoch_storage=epoch_storage, metadata_journal=metadata_journal)
+    data = clandinin_data.Data(cfg)
+    data.experiment_file_name = 'experiment'
+    if not data.experimentFileExists():
+        data.initializeExperimentFile()
+        data.createFly({'fly_id': 'fly_1'})
+    data.selectFly('fly_1')
+    return data
+
+
+def writeEpochs(data, protocol_object, num_epochs):
+    protocol_object.startRandomGenerator(seed=1)
+    data.createEpochRun(protocol_object)
+    for epoch in range(num_epochs):
+        protocol_object.num_epochs_completed = epoch
+        protocol_object.getEpochParameters()
+        data.createEpoch(protocol_object)
+        data.endEpoch(protocol_object)
+
+
+def test_table_rows_with_missing_keys(series_group):
+    clandinin_data.writeEpochTableRow(series_group, 0, {'epoch_unix_time': 1.0, 'contrast': 0.5, 'closed_loop': True, 'stim': 'grating'})
+    clandinin_data.writeEpochTableRow(series_group, 1, {'epoch_unix_time': 2.0, 'speed': 40.0})
+    clandinin_data.writeEpochTableRow(series_group, 2, {'epoch_unix_time': 3.0, 'contrast': 0.0, 'stim': 'spot'})
+    clandinin_data.writeEpochTableRow(series_group, 1, {'epoch_end_unix_time': 2.5})  # end of epoch 2, written later
+
+    epoch_attributes = clandinin_data.readEpochAttributes(series_group)
+
+    assert sorted(epoch_attributes.keys()) == ['epoch_001', 'epoch_002', 'epoch_003']
+    assert epoch_attributes['epoch_001'] == {'epoch_unix_time': 1.0, 'contrast': 0.5, 'closed_loop': True, 'stim': 'grating'}
+    # keys an epoch did not set are left out, including column keys that would otherwise read back as NaN/False
+    assert epoch_attributes['epoch_002'] == {'epoch_unix_time': 2.0, 'epoch_end_unix_time': 2.5, 'speed': 40.0}
+    assert epoch_attributes['epoch_003'] == {'epoch_unix_time': 3.0, 'contrast': 0.0, 'stim': 'spot'}
+    assert 'closed_loop' not in epoch_attributes['epoch_003']  # a False column value is not the same as unset
+
+
+def test_table_columns_keep_their_type(series_group):
+    big_int = 2**53 + 1
+    clandinin_data.writeEpochTableRow(series_group, 0, {'closed_loop': True, 'num_dots': 10, 'seed': big_int, 'speed': 40.0})
+    clandinin_data.writeEpochTableRow(series_group, 1, {'closed_loop': 0.5, 'num_dots': 12.5, 'seed': big_int + 2, 'speed': 30})
+    clandinin_data.writeEpochTableRow(series_group, 2, {'closed_loop': False, 'num_dots': 2**64, 'seed': 7, 'speed': big_int})
+
+    parameters = series_group['epoch_table/parameters']
+    assert [parameters.dtype[key] for key in ['closed_loop', 'num_dots', 'seed', 'speed']] == [np.dtype('?'), np.dtype('i8'), np.dtype('i8'), np.dtype('f8')]
+
+    epoch_attributes = clandinin_data.readEpochAttributes(series_group)
+    assert epoch_attributes['epoch_001'] == {'closed_loop': True, 'num_dots': 10, 'seed': big_int, 'speed': 40.0}
+    assert isinstance(epoch_attributes['epoch_001']['num_dots'], np.integer)
+    # values that don't fit their column's type go to the side table instead of being coerced
+    assert epoch_attributes['epoch_002'] == {'closed_loop': 0.5, 'num_dots': 12.5, 'seed': big_int + 2, 'speed': 30.0}
+    assert epoch_attributes['epoch_003'] == {'closed_loop': False, 'num_dots': 2**64, 'seed': 7, 'speed': big_int}
+    assert 'speed' in series_group['epoch_table/side_tables']
+
+
+def test_table_row_past_end_fills_skipped_rows(series_group):
+    clandinin_data.writeEpochTableRow(series_group, 0, {'epoch_unix_time': 1.0, 'contrast': 0.5})
+    clandinin_data.writeEpochTableRow(series_group, 3, {'epoch_unix_time': 4.0, 'contrast': 1.0})
+
+    epoch_attributes = clandinin_data.readEpochAttributes(series_group)
+
+    assert epoch_attributes['epoch_002'] == {}
+    assert epoch_attributes['epoch_004'] == {'epoch_unix_time': 4.0, 'contrast': 1.0}
+
+
+@pytest.mark.parametrize('epoch_storage', ['groups', 'table'])
+def test_spill_and_rehydrate(tmp_path, epoch_storage):
+    trajectory = np.linspace(0, 1, 2000).reshape(2, 1000)
+    stim_params = {'radius': 5.0, 'path': list(range(1000)), 'color': [1, 0, 0]}
+    attrs = {'epoch_unix_time': 1.0, 'trajectory': trajectory, 'stim_params': stim_params,
+             'long_text': 'x' * 5000, 'angle': 45.0, 'small_list': [1, 2, 3]}
+
+    with h5py.File(str(tmp_path / 'spill.hdf5'), 'w') as experiment_file:
+        series_group = clandinin_data.createSeriesGroup(experiment_file, '/series_001', {'epoch_storage': epoch_storage})
+        clandinin_data.writeEpochAttributes(series_group, 'epoch_001', attrs, create_group=True)
+
+    with h5py.File(str(tmp_path / 'spill.hdf5'), 'r') as experiment_file:
+        epoch_attrs = clandinin_data.readEpochAttributes(experiment_file['/series_001'])['epoch_001']
+
+    np.testing.assert_array_equal(epoch_attrs['trajectory'], trajectory)
+    assert epoch_attrs['stim_params']['radius'] == 5.0
+    np.testing.assert_array_equal(epoch_attrs['stim_params']['path'], np.arange(1000))
+    np.testing.assert_array_equal(epoch_attrs['stim_params']['color'], [1, 0, 0])
+    assert epoch_attrs['long_text'] == 'x' * 5000
+    assert epoch_attrs['angle'] == 45.0
+    np.testing.assert_array_equal(epoch_attrs['small_list'], [1, 2, 3])
+
+
+@pytest.mark.parametrize('epoch_storage', ['groups', 'table'])
+def test_spill_dict_with_mixed_entries(tmp_path, epoch_storage):
+    stim_params = {'path': list(range(1000)),
+                   'stims': [{'name': 'spot', 'radius': 5}, {'name': 'bar', 'width': 2}],
+                   'ragged': [[1, 2], [3]],
+                   'angles': [0, None, 90],
+                   'labels': ['a', 'b']}
+
+    with h5py.File(str(tmp_path / 'spill.hdf5'), 'w') as experiment_file:
+        series_group = clandinin_data.createSeriesGroup(experiment_file, '/series_001', {'epoch_storage': epoch_storage})
+        clandinin_data.writeEpochAttributes(series_group, 'epoch_001', {'stim_params': stim_params}, create_group=True)
+
+    with h5py.File(str(tmp_path / 'spill.hdf5'), 'r') as experiment_file:
+        rehydrated = clandinin_data.readEpochAttributes(experiment_file['/series_001'])['epoch_001']['stim_params']
+
+    np.testing.assert_array_equal(rehydrated['path'], np.arange(1000))
+    # entries with no HDF5 type are stored as JSON text
+    assert json.loads(rehydrated['stims']) == stim_params['stims']
+    assert json.loads(rehydrated['ragged']) == [[1, 2], [3]]
+    assert json.loads(rehydrated['angles']) == [0, None, 90]
+    assert [str(x) for x in rehydrated['labels']] == ['a', 'b']
+
+
+def test_small_parameters_are_not_spilled():
+    assert not clandinin_data.shouldSpillParameter([1, 2, 3])
+    assert not clandinin_data.shouldSpillParameter(np.arange(10))
+    assert clandinin_data.shouldSpillParameter(np.zeros((2, 2)))
+    assert clandinin_data.shouldSpillParameter(np.arange(10), spill_bytes=16)
+
+
+@pytest.mark.parametrize('epoch_storage', ['groups', 'table'])
+def test_journal_replay_after_crash(cfg, protocol_object, epoch_storage):
+    data = makeData(cfg, epoch_storage, metadata_journal=True)
+    writeEpochs(data, protocol_object, num_epochs=3)
+    series_path = data.getSeriesPath()
+    experiment_file_path = data.getExperimentFilePath()
+    with data.openExperimentFile('r') as experiment_file:
+        expected_attributes = clandinin_data.readEpochAttributes(experiment_file[series_path])
+
+    # crash: endEpochRun never runs, and the series never made it to disk
+    data.closeSession()
+    data.journal.close()
+    with h5py.File(experiment_file_path, 'r+') as experiment_file:
+        del experiment_file[series_path]
+    journal_path = clandinin_data.getJournalPath(experiment_file_path)
+    with open(journal_path, 'ab') as journal_file:
+        journal_file.write(b'\x40\x00\x00\x00trunc')  # record cut short mid-write
+
+    recovering_data = makeData(cfg, epoch_storage, metadata_journal=True)
+    recovering_data.recoverFromJournal()
+
+    assert not os.path.isfile(journal_path)
+    assert recovering_data.getExistingSeries() == [1]
+    with h5py.File(experiment_file_path, 'r') as experiment_file:
+        series_group = experiment_file[series_path]
+        assert series_group.attrs['random_seed'] == 1
+        assert series_group.attrs['epoch_storage'] == epoch_storage
+        recovered_attributes = clandinin_data.readEpochAttributes(series_group)
+
+    assert sorted(recovered_attributes.keys()) == ['epoch_001', 'epoch_002', 'epoch_003']
+    for epoch_name, attrs in expected_attributes.items():
+        assert recovered_attributes[epoch_name]['current_intensity'] == attrs['current_intensity']
+        assert recovered_attributes[epoch_name]['epoch_end_unix_time'] == attrs['epoch_end_unix_time']
+
+
+def test_journal_replay_skips_records_already_written(cfg, protocol_object):
+    data = makeData(cfg, metadata_journal=True)
+    writeEpochs(data, protocol_object, num_epochs=2)
+    data.closeSession()
+    data.journal.close()
+
+    recovered = clandinin_data.recoverFromJournal(data.getExperimentFilePath())
+
+    assert recovered == {'series': 0, 'epoch': 0, 'dataset': 0}
+
+
+def test_journal_discarded_after_clean_run(cfg, protocol_object):
+    data = makeData(cfg, metadata_journal=True)
+    writeEpochs(data, protocol_object, num_epochs=2)
+    data.endEpochRun()
+
+    assert not os.path.isfile(clandinin_data.getJournalPath(data.getExperimentFilePath()))
+
+
+def test_journal_off_by_default(cfg, protocol_object):
+    data = makeData(cfg)
+    writeEpochs(data, protocol_object, num_epochs=1)
+
+    assert not os.path.isfile(clandinin_data.getJournalPath(data.getExperimentFilePath()))
+
+
+def test_open_sessions_closed_at_exit(cfg):
+    data = makeData(cfg)
+    data.openSession()
+
+    clandinin_data.closeOpenSessions()
+
+    assert data.experiment_file is None
+
+
+def test_data_objects_are_not_kept_alive(cfg):
+    data = makeData(cfg)
+    data.openSession()
+    data.closeSession()
+    data_ref = weakref.ref(data)
+
+    del data
+    gc.collect()
+
+    assert data_ref() is None
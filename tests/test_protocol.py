@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from visprotocol.protocol.clandinin_protocol import buildEpochSchedule
+
+
+def test_epoch_schedule_cycles_through_parameter_sets():
+    np.testing.assert_array_equal(buildEpochSchedule(3, 7), [0, 1, 2, 0, 1, 2, 0])
+
+
+def test_randomized_epoch_schedule_shuffles_each_cycle():
+    schedule = buildEpochSchedule(4, 12, randomize_order=True, rng=np.random.default_rng(0))
+
+    for cycle in schedule.reshape(3, 4):
+        assert sorted(cycle) == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize('randomize_order', [False, True])
+@pytest.mark.parametrize('num_parameter_sets, num_epochs', [(3, 0), (0, 5), (0, 0)])
+def test_empty_epoch_schedule(num_parameter_sets, num_epochs, randomize_order):
+    schedule = buildEpochSchedule(num_parameter_sets, num_epochs, randomize_order=randomize_order)
+
+    assert len(schedule) == 0
+    assert schedule.dtype.kind == 'u'
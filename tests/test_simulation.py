@@ -0,0 +1,123 @@
+import os
+
+import h5py
+import numpy as np
+
+from visprotocol import clandinin_data
+from visprotocol.simulation import Simulation
+
+
+def makeData(cfg):
+    data = clandinin_data.Data(cfg)
+    data.experiment_file_name = 'experiment'
+    data.initializeExperimentFile()
+    data.createFly({'fly_id': 'fly_1'})
+    return data
+
+
+def getEpochCalls(calls, name):
+    return [kwargs for _, call_name, _, kwargs in calls if call_name == name]
+
+
+def test_simulated_run_without_data(cfg, protocol_object):
+    simulation = Simulation(cfg)
+
+    series_counts = simulation.run([protocol_object])
+
+    assert series_counts == [None]
+    assert protocol_object.num_epochs_completed == 4
+    call_names = simulation.client.manager.getCallNames()
+    assert call_names.count('start_stim') == 4
+    assert call_names.count('stop_stim') == 4
+    assert call_names.count('daq_sendTrigger') == 5  # once per series, then once per epoch
+    assert call_names[-1] == 'black_corner_square'
+    # each epoch loads the background and its stimulus, in one multicall
+    load_calls = getEpochCalls(simulation.client.manager.calls, 'load_stim')
+    assert len(load_calls) == 8
+    assert all(kwargs == {'color': [0.5, 0.5, 0.5, 1.0]} for kwargs in load_calls[0::2])
+    for kwargs in load_calls[1::2]:
+        assert kwargs['hold'] and kwargs['color'][0] in protocol_object.protocol_parameters['intensities']
+
+
+def test_simulated_run_timing(cfg, protocol_object):
+    simulation = Simulation(cfg)
+    simulation.run([protocol_object])
+
+    phase_timing = simulation.epoch_run.scheduler.getPhaseTiming()
+    assert len(phase_timing) == 12
+    np.testing.assert_array_equal(phase_timing['planned_ns'][2::3], np.arange(1, 5) * 2 * 1e9)  # epochs of 2 sec, back to back
+    assert np.all(phase_timing['actual_ns'] == phase_timing['planned_ns'])
+    assert simulation.epoch_run.scheduler.overruns == 0
+    start_times = [time_sec for time_sec, name, _, _ in simulation.client.manager.calls if name == 'start_stim']
+    np.testing.assert_allclose(start_times, [0.5, 2.5, 4.5, 6.5])
+
+
+def test_simulated_run_saves_metadata(cfg, protocol_object):
+    data = makeData(cfg)
+    simulation = Simulation(cfg)
+
+    series_counts = simulation.run([protocol_object], data=data)
+
+    assert series_counts == [1]
+    assert not os.path.isfile(clandinin_data.getJournalPath(data.getExperimentFilePath()))
+    with h5py.File(data.getExperimentFilePath(), 'r') as experiment_file:
+        series_group = experiment_file['/Flies/fly_1/epoch_runs/series_001']
+        assert series_group.attrs['random_seed'] == protocol_object.random_seed
+        assert len(series_group['stimulus_timing/phase_timing']) == 12
+        assert len(series_group['stimulus_timing/host_timing']) == 4
+        epoch_attributes = clandinin_data.readEpochAttributes(series_group)
+
+    assert sorted(epoch_attributes.keys()) == ['epoch_001', 'epoch_002', 'epoch_003', 'epoch_004']
+    load_calls = getEpochCalls(simulation.client.manager.calls, 'load_stim')[1::2]
+    assert [attrs['current_intensity'] for attrs in epoch_attributes.values()] == [kwargs['color'][0] for kwargs in load_calls]
+
+
+def test_simulated_run_replays_from_seed(cfg, protocol_object):
+    simulation = Simulation(cfg)
+    simulation.run([protocol_object])
+    first_calls = getEpochCalls(simulation.client.manager.calls, 'load_stim')
+
+    replay_object = type(protocol_object)(cfg)
+    replay_object.run_parameters['random_seed'] = protocol_object.random_seed
+    replay = Simulation(cfg)
+    replay.run([replay_object])
+
+    assert getEpochCalls(replay.client.manager.calls, 'load_stim') == first_calls
+
+
+def test_simulated_queue_allocates_series(cfg, protocol_object):
+    data = makeData(cfg)
+    simulation = Simulation(cfg, use_daq=False)
+
+    series_counts = simulation.run([protocol_object, type(protocol_object)(cfg)], data=data)
+
+    assert series_counts == [1, 2]
+    assert data.getExistingSeries() == [1, 2]
+    assert 'daq_sendTrigger' not in simulation.client.manager.getCallNames()
+
+
+def getLoadTimes(calls):
+    # times of each epoch's stimulus load_stim (the background load has no hold) and of each start_stim
+    return ([time_sec for (time_sec, name, _, kwargs) in calls if name == 'load_stim' and kwargs.get('hold')],
+            [time_sec for (time_sec, name, _, _) in calls if name == 'start_stim'])
+
+
+def test_prefetch_needs_protocol_opt_in(cfg, protocol_object):
+    simulation = Simulation(dict(cfg, prefetch_stimuli=True))
+    simulation.run([protocol_object])
+
+    load_times, start_times = getLoadTimes(simulation.client.manager.calls)
+    np.testing.assert_allclose(load_times, [0.0, 2.0, 4.0, 6.0])  # each epoch loads at its own start, not during the last tail
+
+
+def test_prefetch_loads_next_epoch_during_tail(cfg, protocol_object):
+    protocol_object.allow_prefetch = True
+    simulation = Simulation(dict(cfg, prefetch_stimuli=True))
+    simulation.run([protocol_object])
+
+    load_times, start_times = getLoadTimes(simulation.client.manager.calls)
+    # later epochs load at the start of the previous epoch's tail, after its stop_stim
+    np.testing.assert_allclose(load_times, [0.0, 1.5, 3.5, 5.5])
+    np.testing.assert_allclose(start_times, [0.5, 2.5, 4.5, 6.5])
+    call_names = simulation.client.manager.getCallNames()
+    assert call_names.index('stop_stim') < [ind for ind, name in enumerate(call_names) if name == 'load_stim'][3]
@@ -0,0 +1,109 @@
+import numpy as np
+
+from visprotocol.simulation import VirtualClock
+from visprotocol.timing import EpochScheduler, HOST_TIMING_STAGES, summarizeHostTiming
+
+
+class LateClock(VirtualClock):
+    """
+    Virtual clock that wakes up late_ns after every deadline
+    """
+    def __init__(self, late_ns):
+        super().__init__()
+        self.late_ns = late_ns
+
+    def sleepUntil(self, deadline_ns, spin_time=0):
+        self.now_ns = max(self.now_ns, deadline_ns + self.late_ns)
+
+
+def lateness(phase_timing):
+    return phase_timing['actual_ns'] - phase_timing['planned_ns']
+
+
+def test_phases_end_on_schedule():
+    clock = VirtualClock()
+    scheduler = EpochScheduler(clock=clock)
+    scheduler.start(num_epochs=2)
+    for epoch in range(2):
+        scheduler.wait('pre', 0.5, epoch=epoch)
+        clock.sleep(0.2)  # time spent within a phase, e.g. on RPCs, comes out of that phase
+        scheduler.wait('stim', 1.0, epoch=epoch)
+        scheduler.wait('tail', 0.5, epoch=epoch)
+    phase_timing = scheduler.stop()
+
+    assert list(phase_timing['phase']) == [b'pre', b'stim', b'tail'] * 2
+    assert list(phase_timing['epoch']) == [0, 0, 0, 1, 1, 1]
+    np.testing.assert_array_equal(phase_timing['planned_ns'], np.array([0.5, 1.5, 2.0, 2.5, 3.5, 4.0]) * 1e9)
+    assert np.all(lateness(phase_timing) == 0)
+    assert scheduler.overruns == 0
+    assert not scheduler.isRunning()
+
+
+def test_lateness_does_not_accumulate():
+    scheduler = EpochScheduler(clock=LateClock(late_ns=2000000))
+    scheduler.start()
+    for epoch in range(50):
+        scheduler.wait('pre', 0.1, epoch=epoch)
+        scheduler.wait('stim', 0.1, epoch=epoch)
+    phase_timing = scheduler.stop()
+
+    # each phase is measured from the previous deadline, not from when the previous wait returned
+    assert np.all(lateness(phase_timing) == 2000000)
+    assert phase_timing['planned_ns'][-1] == 100 * 100000000
+    assert scheduler.overruns == 0
+
+
+def test_overrun_continues_schedule_from_now():
+    clock = VirtualClock()
+    scheduler = EpochScheduler(clock=clock)
+    scheduler.start()
+    scheduler.wait('pre', 1.0, epoch=0)
+    clock.sleep(2.5)  # e.g. a very slow stimulus load
+    scheduler.wait('stim', 1.0, epoch=0)
+    scheduler.wait('tail', 1.0, epoch=0)
+    phase_timing = scheduler.stop()
+
+    assert scheduler.overruns == 1
+    # the overrun phase ends now, and later phases keep their full duration rather than catching up
+    np.testing.assert_array_equal(phase_timing['planned_ns'], np.array([1.0, 3.5, 4.5]) * 1e9)
+    assert np.all(lateness(phase_timing) == 0)
+
+
+def test_anchor_restarts_schedule_after_pause():
+    clock = VirtualClock()
+    scheduler = EpochScheduler(clock=clock)
+    scheduler.start()
+    scheduler.wait('pre', 1.0, epoch=0)
+    clock.sleep(10)  # paused
+    scheduler.anchor()
+    scheduler.wait('stim', 1.0, epoch=0)
+
+    assert scheduler.getPhaseTiming()['planned_ns'][-1] == 12 * 1000000000
+    assert scheduler.overruns == 0
+
+
+def test_host_timing_records():
+    clock = VirtualClock()
+    scheduler = EpochScheduler(clock=clock)
+    scheduler.start(num_epochs=1)
+    for epoch in range(3):  # past the preallocated epochs
+        t0 = clock.perf_counter_ns()
+        clock.sleep(0.001 * (epoch + 1))
+        scheduler.recordStage('load_stimuli', t0, epoch)
+
+    host_timing = scheduler.getHostTiming()
+    records = scheduler.getHostTimingRecords()
+
+    assert host_timing.shape == (3, len(HOST_TIMING_STAGES), 2)
+    assert records.dtype.names == HOST_TIMING_STAGES
+    np.testing.assert_array_equal(np.diff(records['load_stimuli'], axis=1)[:, 0], [1000000, 2000000, 3000000])
+    assert np.all(records['create_epoch'] == -1)  # stages that did not run
+    assert summarizeHostTiming(host_timing)['load_stimuli']['n'] == 3
+    assert 'create_epoch' not in summarizeHostTiming(host_timing)
+
+
+def test_stage_not_recorded_outside_run():
+    scheduler = EpochScheduler(clock=VirtualClock())
+    scheduler.recordStage('load_stimuli', 0, 0)
+
+    assert len(scheduler.getHostTiming()) == 0
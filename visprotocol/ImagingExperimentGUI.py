@@ -6,6 +6,7 @@ Created on Thu Jun 21 10:51:42 2018
 @author: mhturner
 """
 import sys
+import copy
 import warnings
 from PyQt5.QtWidgets import (QPushButton, QWidget, QLabel, QTextEdit, QGridLayout, QApplication,
                              QComboBox, QLineEdit, QFormLayout, QDialog, QFileDialog, QInputDialog,
@@ -20,7 +21,8 @@ import os
 from visanalysis.util import h5io
 
 from visprotocol.clandinin_client import Client
-from visprotocol import clandinin_data, util, protocol
+from visprotocol import clandinin_data, util
+from visprotocol.protocol import clandinin_protocol
 from visprotocol.control import EpochRun
 
 
@@ -42,22 +44,16 @@ class ImagingExperimentGUI(QWidget):
 
         # load user and rig configurations
         self.user_configuration = util.getUserConfiguration(self.user_name)
-        self.cfg = self.user_configuration.copy()
-        self.cfg['user_name'] = self.user_name
-        self.cfg['rig_name'] = self.rig_name
-        self.cfg['draw_screens'] = self.draw_screens
-
-        rig_config = self.cfg['rig_config'][self.rig_name]
-        self.cfg['server_data_directory'] = rig_config['server_data_directory'] if 'server_data_directory' in rig_config else None
-        self.cfg['loco_avail'] = 'locomotion' in rig_config and rig_config['locomotion']
+        self.cfg = util.getRunConfiguration(self.user_name, self.rig_name, draw_screens=self.draw_screens)
 
         # start a client
         self.client = Client(self.cfg)
 
-        # get a protocol, just start with the base class until user selects one
-        self.protocol_object = getattr(protocol, self.user_name + '_protocol').BaseProtocol(self.cfg)
-        # get available protocol classes
-        self.available_protocols = getattr(protocol, self.user_name + '_protocol').BaseProtocol.__subclasses__()
+        # get a protocol, just start with the base class until user selects one.
+        # The user's protocol module is only imported once a protocol is selected
+        self.protocol_object = clandinin_protocol.BaseProtocol(self.cfg)
+        # get available protocol names. Protocol classes are looked up when selected
+        self.available_protocols = util.getAvailableProtocolNames(self.user_name)
 
         # start a data object
         if self.protocol_object.rig == 'AODscope':
@@ -120,8 +116,8 @@ class ImagingExperimentGUI(QWidget):
         # Protocol ID drop-down:
         comboBox = QComboBox(self)
         comboBox.addItem("(select a protocol to run)")
-        for sub_class in self.available_protocols:
-            comboBox.addItem(sub_class.__name__)
+        for protocol_name in self.available_protocols:
+            comboBox.addItem(protocol_name)
         protocol_label = QLabel('Protocol:')
         comboBox.activated[str].connect(self.onSelectedProtocolID)
         self.protocol_selector_grid.addWidget(protocol_label, 1, 0)
@@ -203,6 +199,25 @@ class ImagingExperimentGUI(QWidget):
         self.notesEdit.setFixedHeight(30)
         self.protocol_control_grid.addWidget(self.notesEdit, 3, 1, 1, 3)
 
+        # Series queue: add the current protocol and parameters, then record the queue back to back
+        addQueueButton = QPushButton("Add to queue", self)
+        addQueueButton.clicked.connect(self.onPressedButton)
+        self.protocol_control_grid.addWidget(addQueueButton, 4, 0)
+
+        clearQueueButton = QPushButton("Clear queue", self)
+        clearQueueButton.clicked.connect(self.onPressedButton)
+        self.protocol_control_grid.addWidget(clearQueueButton, 4, 1)
+
+        self.recordQueueButton = QPushButton("Record queue", self)
+        self.recordQueueButton.clicked.connect(self.onPressedButton)
+        self.protocol_control_grid.addWidget(self.recordQueueButton, 4, 2)
+
+        self.queue_label = QLabel()
+        self.queue_label.setFrameShadow(QFrame.Shadow(1))
+        self.protocol_control_grid.addWidget(self.queue_label, 5, 0, 1, 4)
+        self.series_queue = []  # (protocol class, run_parameters, protocol_parameters) for each queued series
+        self.updateQueueLabel()
+
         # Imaging type dropdown (if AODscope):
         if self.data.rig == 'AODscope':
             self.imagingTypeComboBox = QComboBox(self)
@@ -396,8 +411,7 @@ class ImagingExperimentGUI(QWidget):
         self.resetLayout()
 
         # initialize the selected protocol object
-        prot_names = [x.__name__ for x in self.available_protocols]
-        self.protocol_object = self.available_protocols[prot_names.index(text)](self.cfg)
+        self.protocol_object = util.getProtocolClass(self.user_name, text)(self.cfg)
 
         # update display lists of run & protocol parameters
         self.protocol_object.loadParameterPresets()
@@ -442,6 +456,28 @@ class ImagingExperimentGUI(QWidget):
             self.epoch_run.stopRun()
             self.pauseButton.setText('Pause')
 
+        elif sender.text() == 'Add to queue':
+            if self.protocol_object.run_parameters['protocol_ID'] == '':
+                self.status_label.setText('Select a protocol')
+            else:
+                self.updateParametersFromFillableFields()
+                self.series_queue.append((type(self.protocol_object),
+                                          copy.deepcopy(self.protocol_object.run_parameters),
+                                          copy.deepcopy(self.protocol_object.protocol_parameters)))
+                self.updateQueueLabel()
+
+        elif sender.text() == 'Clear queue':
+            self.series_queue = []
+            self.updateQueueLabel()
+
+        elif sender.text() == 'Record queue':
+            if len(self.series_queue) == 0:
+                self.status_label.setText('Add series to the queue first')
+            elif (self.data.experimentFileExists() and self.data.currentFlyExists()):
+                self.sendQueue()
+            else:
+                self.status_label.setText('Initialize a data file and fly first')
+
         elif sender.text() == 'Enter note':
             self.noteText = self.notesEdit.toPlainText()
             if self.data.experimentFileExists():
@@ -485,6 +521,8 @@ class ImagingExperimentGUI(QWidget):
 
             if self.data.experiment_file_name != '':
                 self.currentExperimentLabel.setText(self.data.experiment_file_name)
+                # fold in metadata from a previous run that did not finish cleanly
+                self.data.recoverFromJournal()
                 # update series count to reflect already-collected series
                 self.data.reloadSeriesCount()
                 self.series_counter_input.setValue(self.data.getHighestSeriesCount() + 1)
@@ -493,6 +531,7 @@ class ImagingExperimentGUI(QWidget):
 
         elif sender.text() == 'Check epochs:':
             self.epoch_count.setText(str(self.protocol_object.num_epochs_completed))
+            self.updateRpcStatus()
 
     def onCreatedFly(self):
         # Populate fly metadata from fly data fields
@@ -661,10 +700,63 @@ class ImagingExperimentGUI(QWidget):
 
         self.runSeriesThread.start()
 
+    def updateQueueLabel(self):
+        if len(self.series_queue) == 0:
+            self.queue_label.setText('Queue: empty')
+        else:
+            self.queue_label.setText('Queue: ' + ', '.join([x[0].__name__ for x in self.series_queue]))
+
+    def sendQueue(self):
+        # Series numbers are allocated by the epoch run, starting from the series counter
+        self.data.updateSeriesCount(self.series_counter_input.value())
+        if self.cfg['loco_avail']:
+            self.data.cfg['do_loco'] = self.loco_checkbox.isChecked() # loco
+
+        protocol_objects = []
+        for protocol_class, run_parameters, protocol_parameters in self.series_queue:
+            protocol_object = protocol_class(self.cfg)
+            protocol_object.run_parameters = copy.deepcopy(run_parameters)
+            protocol_object.protocol_parameters = copy.deepcopy(protocol_parameters)
+            protocol_objects.append(protocol_object)
+
+        self.runSeriesThread = runSeriesThread(self.epoch_run,
+                                               protocol_objects,
+                                               self.data,
+                                               self.client,
+                                               True)
+
+        self.runSeriesThread.finished.connect(self.queueFinished)
+        self.runSeriesThread.started.connect(lambda: self.runStarted(True))
+
+        self.runSeriesThread.start()
+
+    def queueFinished(self):
+        # re-enable view/record buttons
+        self.viewButton.setEnabled(True)
+        self.recordButton.setEnabled(True)
+        self.recordQueueButton.setEnabled(True)
+
+        self.status_label.setText('Ready')
+        self.pauseButton.setText('Pause')
+        self.updateRpcStatus()
+        self.updateExistingFlyInput()
+        # The epoch run already advanced the series count past each queued series
+        self.series_counter_input.setValue(self.data.getSeriesCount())
+        self.populateGroups()
+        self.series_queue = []
+        self.updateQueueLabel()
+
+    def updateRpcStatus(self):
+        # stim server call latency, shown on the status line
+        if getattr(self.client, 'rpc_monitor', None) is not None:
+            text = self.status_label.text().split(' | ')[0]
+            self.status_label.setText(text + ' | ' + self.client.rpc_monitor.getStatusText())
+
     def runStarted(self, save_metadata_flag):
         # Lock the view and run buttons to prevent spinning up multiple threads
         self.viewButton.setEnabled(False)
         self.recordButton.setEnabled(False)
+        self.recordQueueButton.setEnabled(False)
         if save_metadata_flag:
             self.status_label.setText('Recording series ' + str(self.data.getSeriesCount()))
         else:
@@ -674,9 +766,11 @@ class ImagingExperimentGUI(QWidget):
         # re-enable view/record buttons
         self.viewButton.setEnabled(True)
         self.recordButton.setEnabled(True)
+        self.recordQueueButton.setEnabled(True)
 
         self.status_label.setText('Ready')
         self.pauseButton.setText('Pause')
+        self.updateRpcStatus()
         if save_metadata_flag:
             self.updateExistingFlyInput()
             # Advance the series_count:
@@ -827,6 +921,7 @@ class ImagingExperimentGUI(QWidget):
 
         # update attr in file
         h5io.changeAttribute(file_path, group_path, attr_key, attr_val)
+        self.data.reloadFileIndex()  # fly metadata may have changed
         print('Changed attr {} to = {}'.format(attr_key, attr_val))
 
     def updateWindowWidth(self):
@@ -968,7 +1063,10 @@ class runSeriesThread(QThread):
         self.wait()
 
     def _sendRun(self):
-        self.epoch_run.startRun(self.protocol_object, self.data, self.client, save_metadata_flag=self.save_metadata_flag)
+        if isinstance(self.protocol_object, list):  # queue of series
+            self.epoch_run.startQueue(self.protocol_object, self.data, self.client, save_metadata_flag=self.save_metadata_flag)
+        else:
+            self.epoch_run.startRun(self.protocol_object, self.data, self.client, save_metadata_flag=self.save_metadata_flag)
 
     def run(self):
         self._sendRun()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless (Qt-free) runner for protocols, for scripted and overnight experiments
+
+From a script:
+    batch_run = BatchRun('mht', 'Bruker_LeftScreen')
+    batch_run.openExperimentFile('2026-10-17', data_directory='E:/path/to/FlystimData')
+    batch_run.selectFly({'fly_id': 'fly_1', 'sex': 'Female', 'age': 3})
+    batch_run.runSeries('DriftingSquareGrating', preset_name='default')
+    batch_run.runQueue([{'protocol': 'ExpandingMovingSpot', 'run_parameters': {'num_epochs': 40}},
+                        {'protocol': 'LoomingSpot', 'preset': 'fast'}])
+
+From the command line:
+    python -m visprotocol.batch --user mht --rig Bruker_LeftScreen --experiment_file 2026-10-17 \
+        --fly_id fly_1 --protocol DriftingSquareGrating --preset default
+    python -m visprotocol.batch --user mht --rig Bruker_LeftScreen --experiment_file 2026-10-17 \
+        --fly_metadata fly_1.yaml --queue overnight_queue.yaml
+
+A queue file is a YAML list of entries with keys: protocol, and optionally preset, run_parameters, protocol_parameters
+
+With --server HOST:PORT, the client connects there instead of the rig's stim server (e.g. to visprotocol.server.mock_server).
+The rig's DAQ is still used unless --daq_on_server is given, which sends DAQ calls to that server too (as a mock server expects).
+With simulate=True (--simulate), runs go on a virtual clock without flystim or a DAQ (see visprotocol.simulation)
+"""
+import argparse
+import os
+import yaml
+
+from visprotocol.clandinin_client import Client
+from visprotocol import clandinin_data, util
+from visprotocol.control import EpochRun
+from visprotocol import simulation
+
+
+class BatchRun():
+    def __init__(self, user_name, rig_name, draw_screens=False, client=None, simulate=False, server_options=None, daq=None):
+        self.cfg = util.getRunConfiguration(user_name, rig_name, draw_screens=draw_screens)
+        if server_options is not None:  # e.g. a mock server
+            self.cfg['server_options'] = server_options
+        if daq is not None:  # e.g. {'class': 'DAQonServer'}, for a mock server that also stands in for the DAQ
+            self.cfg['daq'] = daq
+        self.user_name = user_name
+        self.clock = simulation.VirtualClock() if simulate else None
+
+        # start a client
+        if simulate:
+            self.client = simulation.SimulatedClient(self.cfg, self.clock)
+        elif client is None:
+            self.client = Client(self.cfg)
+        else:
+            self.client = client
+
+        # start a data object
+        if self.cfg['rig_config'][rig_name].get('rig', '(rig)') == 'AODscope':
+            self.data = clandinin_data.AODscopeData(self.cfg)
+        else:
+            self.data = clandinin_data.Data(self.cfg)
+
+        self.epoch_run = EpochRun(clock=self.clock)
+        self.available_protocols = util.getAvailableProtocolNames(user_name)
+
+    def openExperimentFile(self, experiment_file_name, data_directory=None, experimenter=None):
+        """
+        Open an existing experiment file, or create it if it does not exist yet
+        """
+        self.data.experiment_file_name = experiment_file_name
+        if data_directory is not None:
+            self.data.data_directory = data_directory
+        if experimenter is not None:
+            self.data.experimenter = experimenter
+
+        if os.path.isfile(self.data.getExperimentFilePath()):
+            # fold in metadata from a previous run that did not finish cleanly
+            self.data.recoverFromJournal()
+            self.data.reloadSeriesCount()
+        else:
+            self.data.initializeExperimentFile()
+            self.data.updateSeriesCount(1)
+
+    def selectFly(self, fly_metadata):
+        """
+        Select the fly with fly_metadata['fly_id'], creating it from fly_metadata if it is new
+        """
+        if fly_metadata.get('fly_id') in [x.get('fly_id') for x in self.data.getExistingFlyData()]:
+            self.data.selectFly(fly_metadata.get('fly_id'))
+        else:
+            self.data.createFly(fly_metadata)
+
+    def getProtocolObject(self, protocol_name, preset_name=None, run_parameters=None, protocol_parameters=None):
+        """
+        Initialize protocol_name, then apply a parameter preset and any parameter overrides
+        """
+        if protocol_name not in self.available_protocols:
+            raise ValueError('Protocol {} not found for user {}'.format(protocol_name, self.user_name))
+
+        protocol_object = util.getProtocolClass(self.user_name, protocol_name)(self.cfg)
+        protocol_object.loadParameterPresets()
+        if preset_name is not None:
+            protocol_object.selectProtocolPreset(preset_name)
+        if run_parameters is not None:
+            protocol_object.run_parameters.update(run_parameters)
+        if protocol_parameters is not None:
+            protocol_object.protocol_parameters.update(protocol_parameters)
+        return protocol_object
+
+    def runSeries(self, protocol_name, preset_name=None, run_parameters=None, protocol_parameters=None, save_metadata_flag=True):
+        """
+        Run one series. Saved series take the next unused series number. Returns the series number, or None if not saved
+        """
+        return self.runQueue([{'protocol': protocol_name, 'preset': preset_name,
+                               'run_parameters': run_parameters, 'protocol_parameters': protocol_parameters}],
+                             save_metadata_flag=save_metadata_flag)[0]
+
+    def runQueue(self, queue_entries, save_metadata_flag=True):
+        """
+        Run a list of series back to back, keeping locomotion and the file session open in between.
+        Each entry is a dict with key 'protocol', and optionally 'preset', 'run_parameters' and 'protocol_parameters'.
+        Saved series take the next unused series numbers. Returns the series numbers
+        """
+        protocol_objects = [self.getProtocolObject(entry['protocol'],
+                                                   preset_name=entry.get('preset'),
+                                                   run_parameters=entry.get('run_parameters'),
+                                                   protocol_parameters=entry.get('protocol_parameters')) for entry in queue_entries]
+
+        if save_metadata_flag and not (self.data.experimentFileExists() and self.data.currentFlyExists()):
+            raise RuntimeError('Open an experiment file and select a fly before recording a series')
+
+        print('Running {} series: {}'.format(len(queue_entries), ', '.join([entry['protocol'] for entry in queue_entries])))
+        if self.clock is None:
+            return self.epoch_run.startQueue(protocol_objects, self.data, self.client, save_metadata_flag=save_metadata_flag)
+        with simulation.virtualSleep(protocol_objects, self.clock):
+            return self.epoch_run.startQueue(protocol_objects, self.data, self.client, save_metadata_flag=save_metadata_flag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run visprotocol protocols without the GUI')
+    parser.add_argument('--user', required=True, help='user name, as in config/USER_config.yaml')
+    parser.add_argument('--rig', required=True, help='rig config name from the user config')
+    parser.add_argument('--experiment_file', help='experiment file name, without .hdf5. Created if it does not exist')
+    parser.add_argument('--data_directory', help='directory of the experiment file. Defaults to the rig data_directory')
+    parser.add_argument('--experimenter', help='experimenter, for new experiment files')
+    parser.add_argument('--fly_id', help='fly to record to. Created if it does not exist')
+    parser.add_argument('--fly_metadata', help='YAML file of fly metadata, including fly_id')
+    parser.add_argument('--protocol', help='protocol class name to run')
+    parser.add_argument('--preset', help='parameter preset for --protocol')
+    parser.add_argument('--queue', help='YAML file with a list of series to run back to back')
+    parser.add_argument('--view', action='store_true', help='show stimuli without saving metadata')
+    parser.add_argument('--draw_screens', action='store_true')
+    parser.add_argument('--server', help='HOST:PORT of the stim server to use instead of the rig default (e.g. a mock server)')
+    parser.add_argument('--daq_on_server', action='store_true', help='send DAQ calls to the stim server (e.g. a mock --server) instead of the rig DAQ')
+    parser.add_argument('--simulate', action='store_true', help='dry run on a virtual clock, without flystim or a DAQ')
+    args = parser.parse_args()
+
+    if args.queue is not None:
+        with open(args.queue, 'r') as ymlfile:
+            queue_entries = yaml.safe_load(ymlfile)
+    elif args.protocol is not None:
+        queue_entries = [{'protocol': args.protocol, 'preset': args.preset}]
+    else:
+        parser.error('Specify a --protocol or a --queue')
+
+    save_metadata_flag = not args.view
+    if save_metadata_flag and (args.experiment_file is None or (args.fly_id is None and args.fly_metadata is None)):
+        parser.error('Recording needs --experiment_file and --fly_id or --fly_metadata (or use --view)')
+
+    server_options = None
+    if args.server is not None:
+        host, port = args.server.rsplit(':', 1)
+        server_options = {'host': host, 'port': int(port), 'use_server': True}
+
+    daq = {'class': 'DAQonServer'} if args.daq_on_server else None
+
+    batch_run = BatchRun(args.user, args.rig, draw_screens=args.draw_screens, simulate=args.simulate, server_options=server_options, daq=daq)
+    if save_metadata_flag:
+        batch_run.openExperimentFile(args.experiment_file, data_directory=args.data_directory, experimenter=args.experimenter)
+        fly_metadata = {'fly_id': args.fly_id}
+        if args.fly_metadata is not None:
+            with open(args.fly_metadata, 'r') as ymlfile:
+                fly_metadata = yaml.safe_load(ymlfile)
+        batch_run.selectFly(fly_metadata)
+
+    batch_run.runQueue(queue_entries, save_metadata_flag=save_metadata_flag)
+    if args.simulate:
+        print('Simulated {:.1f} sec of run time, {} stimulus server calls'.format(batch_run.clock.perf_counter_ns() / 1e9,
+                                                                              len(batch_run.client.manager.calls)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import socket
-from flystim.stim_server import launch_stim_server
 from flyrpc.transceiver import MySocketClient
-from flystim.screen import Screen
 from math import pi
-from flystim.draw import draw_screens
 from visprotocol.device import daq
+from visprotocol.timing import RpcLatencyMonitor
 
 
 class Client():
@@ -15,40 +12,18 @@ class Client():
         self.rig_name = cfg.get('rig_name')
         self.draw_screens = cfg.get('draw_screens')
         self.cfg = cfg
-        self.daq_device = None
+        self.rpc_monitor = RpcLatencyMonitor()
 
         print("IN CLANDININ CLIENT")
 
-        # # # load rig-specific server/client options # #
-        if socket.gethostname() == 'DESKTOP-4Q3O7LU':  # AODscope Karthala
-            self.server_options = {'host': '171.65.17.126',
-                                   'port': 60629,
-                                   'use_server': True}
-            self.daq_device = daq.nidaq.NIUSB6001(dev='Dev1', trigger_channel='port2/line0')
-
-        elif socket.gethostname() == 'USERBRU-I10P5LO':  # Bruker
-            self.server_options = {'host': '171.65.17.246',
-                                   'port': 60629,
-                                   'use_server': True}
-            self.daq_device = daq.nidaq.NIUSB6210(dev='Dev5', trigger_channel='ctr0')
-        elif socket.gethostname() == 'clandinin-ballbehavior':  # 24HrFitness
-            self.server_options = {'host': '0.0.0.0',
-                                   'port': 60629,
-                                   'use_server': True}
-        elif socket.gethostname() == '40hr-assist':  # 40HrAssist, running in conjunction with 40HrFitness
-            self.server_options = {'host': '171.65.18.61',
-                                   'port': 60629,
-                                   'use_server': True}
-            self.daq_device = daq.DAQonServer()
-        elif socket.gethostname() == '40hr-fitness':  # 40HrFitness, running alone without assist
-            self.server_options = {'host': '0.0.0.0',
-                                   'port': 60629,
-                                   'use_server': True}
-            self.daq_device = daq.DAQonServer()
+        # # # load rig-specific server/client options, from the rig registry (config/rigs.yaml) or the rig config # #
+        if cfg.get('server_options') is not None:
+            self.server_options = cfg['server_options']
         else:
             self.server_options = {'host': '0.0.0.0',
                                    'port': 60629,
                                    'use_server': False}
+        self.daq_device = daq.createDAQ(cfg.get('daq'))
 
         # # # Start the stim manager and set the frame tracker square to black # # #
         if self.server_options['use_server']:
@@ -56,10 +31,14 @@ class Client():
             if isinstance(self.daq_device, daq.DAQonServer):
                 self.daq_device.set_manager(self.manager)
         else:
+            from flystim.stim_server import launch_stim_server
+            from flystim.screen import Screen
+            from flystim.draw import draw_screens
             aux_screen = Screen(server_number=1, id=0, fullscreen=False, vsync=True, square_size=(0.25, 0.25))
             if self.draw_screens:
               draw_screens(aux_screen)
             self.manager = launch_stim_server(aux_screen)
+        self.rpc_monitor.attach(self.manager)
 
         self.manager.black_corner_square()
         self.manager.set_idle_background(0)
@@ -73,12 +52,14 @@ class Client_Stim_Regeneration():
         self.rig_name = cfg.get('rig_name')
         self.cfg = cfg
         self.daq_device = None
+        self.rpc_monitor = None
 
         self.server_options = {'host': '0.0.0.0',
                                'port': 60629,
                                'use_server': False}
 
         # # # Start the stim manager # # #
+        from flystim.stim_server import launch_stim_server
         self.manager = launch_stim_server(screen)
 
         self.manager.set_idle_background(0)
@@ -11,16 +11,38 @@ yyyy-mm-dd
             epoch_runs
                 series_00n (attrs = protocol_parameters)
                     acquisition
+                    epoch_schedule (parameter sequence index of each epoch, for protocols using selectParametersFromLists)
                     epochs
                         epoch_001 (attrs = epoch_parameters, convenience_parameters)
+                            <parameter name> (large parameters only, referenced from the attr of the same name)
                         epoch_002
+                    epoch_table (only with epoch_storage: table, replaces the epoch_nnn groups)
+                        parameters (one row per epoch: timestamps and scalar parameters)
+                        parameters_set (same columns as parameters, True where the epoch set that column)
+                        side_tables/<parameter name> (one JSON-encoded entry per epoch)
+                        spilled/epoch_001/<parameter name> (large parameters, referenced from the side table)
                     rois
                     stimulus_timing
+                        epoch_unix_time, epoch_end_unix_time (only with swmr_mode: True, appended live)
+                        phase_timing (planned vs. actual end of each epoch phase, see visprotocol.timing)
+                        host_timing (one row per epoch, with a (start_ns, end_ns) field for each host-side epoch stage)
+                        rpc_timing (time the client blocked on each stim server call during the run)
     Notes
 
+Use readEpochAttributes(series_group) to read epoch attributes from either layout,
+with large parameters rehydrated into numpy arrays / dicts.
 """
 import h5py
 import os
+import copy
+import json
+import pickle
+import queue
+import struct
+import threading
+import atexit
+import weakref
+from contextlib import contextmanager
 from datetime import datetime, timezone
 import numpy as np
 
@@ -49,6 +71,34 @@ class Data():
         self.rig = self.cfg.get('rig_config').get(self.rig_name).get('rig', '(rig)')
         self.screen_center = self.cfg.get('rig_config').get(self.rig_name).get('screen_center', [0, 0])
 
+        # # # Persistent file session, held open for the duration of an epoch run # # #
+        self.experiment_file = None
+        self.series_group = None
+        self.flush_interval = self.cfg.get('hdf5_flush_interval', 10)  # epochs between flushes to disk
+        self.epochs_since_flush = 0
+        self.hold_session = False  # keep the session open after endEpochRun, e.g. across a queue of series
+
+        # # # Background metadata writer, so the epoch loop never blocks on disk I/O # # #
+        self.async_metadata_writes = self.cfg.get('async_metadata_writes', False)
+        self.metadata_writer = MetadataWriter(max_queue_size=self.cfg.get('metadata_queue_size', 256))
+
+        # # # Epoch storage layout: 'groups' (one group per epoch) or 'table' (one row per epoch) # # #
+        self.epoch_storage = self.cfg.get('epoch_storage', 'groups')
+        # epoch parameters bigger than this many bytes are stored as datasets instead of attributes
+        self.parameter_spill_bytes = self.cfg.get('parameter_spill_bytes', PARAMETER_SPILL_BYTES)
+
+        # # # Single-writer/multiple-reader mode, so the file can be read live during a run # # #
+        self.use_swmr = self.cfg.get('swmr_mode', False)
+        self.swmr_active = False
+        self.deferred_writes = []  # (function, series_path, args) writes held back until the SWMR run ends
+
+        # # # Write-ahead journal of series/epoch records, for recovery if the run crashes # # #
+        self.use_journal = self.cfg.get('metadata_journal', False)
+        self.journal = MetadataJournal()
+
+        # # # In-memory index of flies and series in the experiment file, built once per file # # #
+        self.file_index = None
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # # # # # # # # #  Creating experiment file and groups  # # # # # # # # # # # #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -57,7 +107,8 @@ class Data():
         """
         Create HDF5 data file and initialize top-level hierarchy nodes
         """
-        with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'w-') as experiment_file:
+        libver = SWMR_LIBVER if self.use_swmr else None
+        with h5py.File(self.getExperimentFilePath(), 'w-', libver=libver) as experiment_file:
             # Experiment date/time
             init_now = datetime.now()
             date = init_now.isoformat()[:-16]
@@ -77,6 +128,8 @@ class Data():
             experiment_file.create_group('Flies')
             experiment_file.create_group('Notes')
 
+        self.file_index = self.newFileIndex()
+
     def createFly(self, fly_metadata):
         """
         """
@@ -85,7 +138,7 @@ class Data():
             return
 
         if self.experimentFileExists():
-            with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r+') as experiment_file:
+            with self.openExperimentFile('r+') as experiment_file:
                 fly_init_now = datetime.now()
                 fly_init_time = fly_init_now.strftime('%H:%M:%S.%f')[:-4]
                 fly_init_unix_time = fly_init_now.astimezone(timezone.utc).timestamp()
@@ -98,66 +151,101 @@ class Data():
 
                 new_fly.create_group('epoch_runs')
 
+                self.getFileIndex()['flies'][fly_metadata.get('fly_id')] = dict(new_fly.attrs)
+
             self.selectFly(fly_metadata.get('fly_id'))
         else:
             print('Initialize a data file before defining a fly')
 
     def createEpochRun(self, protocol_object):
         """"
+        Create a new series group and open a file session that is held until endEpochRun
         """
         # create a new epoch run group in the data file
         if (self.currentFlyExists() and self.experimentFileExists()):
-            with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r+') as experiment_file:
-                run_start_now = datetime.now()
-                run_start_time = run_start_now.strftime('%H:%M:%S.%f')[:-4]
-                run_start_unix_time = run_start_now.astimezone(timezone.utc).timestamp()
-                fly_group = experiment_file['/Flies/{}/epoch_runs'.format(self.current_fly)]
-                new_epoch_run = fly_group.create_group('series_{}'.format(str(self.series_count).zfill(3)))
-                new_epoch_run.attrs['run_start_time'] = run_start_time
-                new_epoch_run.attrs['run_start_unix_time'] = run_start_unix_time
-                for key in protocol_object.run_parameters:  # add run parameter attributes
-                    new_epoch_run.attrs[key] = protocol_object.run_parameters[key]
-
-                for key in protocol_object.protocol_parameters:  # add user-entered protocol params
-                    new_epoch_run.attrs[key] = protocol_object.protocol_parameters[key]
-
-                # add subgroups:
-                new_epoch_run.create_group('acquisition')
-                new_epoch_run.create_group('epochs')
-                new_epoch_run.create_group('rois')
-                new_epoch_run.create_group('stimulus_timing')
+            self.recoverFromJournal()  # fold in anything left over from a run that crashed
+            self.openSession()
+            run_start_now = datetime.now()
+            run_start_time = run_start_now.strftime('%H:%M:%S.%f')[:-4]
+            run_start_unix_time = run_start_now.astimezone(timezone.utc).timestamp()
+
+            series_attrs = {'run_start_time': run_start_time,
+                            'run_start_unix_time': run_start_unix_time}
+            series_attrs.update(protocol_object.run_parameters)  # add run parameter attributes
+            series_attrs.update(protocol_object.protocol_parameters)  # add user-entered protocol params
+            series_attrs['epoch_storage'] = self.epoch_storage
+            if getattr(protocol_object, 'random_seed', None) is not None:
+                series_attrs['random_seed'] = protocol_object.random_seed  # root seed, to replay the run
+            acquisition_attrs = self.getAcquisitionAttributes()
+
+            if self.use_journal:
+                self.journal.open(getJournalPath(self.getExperimentFilePath()))
+                self.journal.append({'type': 'series', 'series_path': self.getSeriesPath(),
+                                     'attrs': series_attrs, 'acquisition_attrs': acquisition_attrs})
+
+            new_epoch_run = createSeriesGroup(self.experiment_file, self.getSeriesPath(), series_attrs, acquisition_attrs)
+
+            self.series_group = new_epoch_run
+            self.indexSeries(new_epoch_run)
+
+            if self.use_swmr:
+                self.startSwmr()
+            self.experiment_file.flush()
+
+            if self.async_metadata_writes:
+                self.metadata_writer.start()
 
         else:
             print('Create a data file and/or define a fly first')
 
+    def getAcquisitionAttributes(self):
+        """
+        Attributes for the acquisition group of a new series. Overridden by rig-specific Data classes
+        """
+        return {}
+
+    def endEpochRun(self):
+        """
+        Drain any queued metadata writes, then flush and close the file session opened by createEpochRun
+        (or only flush it, with hold_session).
+        Epoch records held back during an SWMR run are written once the file is out of SWMR mode.
+        Once everything is safely in the file, the journal for this run is discarded.
+        Safe to call if no session is open
+        """
+        try:
+            self.metadata_writer.stop()
+        finally:
+            if self.hold_session and not self.swmr_active:
+                self.flushSession()
+            else:
+                self.closeSession()
+
+        if len(self.deferred_writes) > 0:
+            with self.openExperimentFile('r+') as experiment_file:
+                for function, series_path, args in self.deferred_writes:
+                    function(experiment_file[series_path], *args)
+            self.deferred_writes = []
+
+        self.journal.discard()
+
     def createEpoch(self, protocol_object):
         """
         """
         if (self.currentFlyExists() and self.experimentFileExists()):
-            with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r+') as experiment_file:
-                epoch_now = datetime.now()
-                epoch_time = epoch_now.strftime('%H:%M:%S.%f')
-                epoch_unix_time = epoch_now.astimezone(timezone.utc).timestamp()
-                epoch_run_group = experiment_file['/Flies/{}/epoch_runs/series_{}/epochs'.format(self.current_fly, str(self.series_count).zfill(3))]
-                new_epoch = epoch_run_group.create_group('epoch_{}'.format(str(protocol_object.num_epochs_completed+1).zfill(3)))
-                new_epoch.attrs['epoch_time'] = epoch_time
-                new_epoch.attrs['epoch_unix_time'] = epoch_unix_time
-
-                epochParametersGroup = new_epoch
-                if type(protocol_object.epoch_parameters) is tuple:  # stimulus is tuple of multiple stims layered on top of one another
-                    num_stims = len(protocol_object.epoch_parameters)
-                    for stim_ind in range(num_stims):
-                        for key in protocol_object.epoch_parameters[stim_ind]:
-                            prefix = 'stim{}_'.format(str(stim_ind))
-                            epochParametersGroup.attrs[prefix + key] = hdf5ifyParameter(protocol_object.epoch_parameters[stim_ind][key])
-
-                elif type(protocol_object.epoch_parameters) is dict:  # single stim class
-                    for key in protocol_object.epoch_parameters:
-                        epochParametersGroup.attrs[key] = hdf5ifyParameter(protocol_object.epoch_parameters[key])
-
-                convenienceParametersGroup = new_epoch
-                for key in protocol_object.convenience_parameters:  # save out convenience parameters
-                    convenienceParametersGroup.attrs[key] = hdf5ifyParameter(protocol_object.convenience_parameters[key])
+            epoch_now = datetime.now()
+            epoch_time = epoch_now.strftime('%H:%M:%S.%f')
+            epoch_unix_time = epoch_now.astimezone(timezone.utc).timestamp()
+
+            epoch_attrs = {'epoch_time': epoch_time,
+                           'epoch_unix_time': epoch_unix_time}
+            epoch_attrs.update(getEpochAttributes(protocol_object))
+
+            self.writeEpochRecord(self.getEpochName(protocol_object), epoch_attrs, create_group=True)
+
+            # the epoch schedule is built with the first epoch's parameters
+            epoch_schedule = getattr(protocol_object, 'epoch_schedule', None)
+            if protocol_object.num_epochs_completed == 0 and epoch_schedule is not None:
+                self.writeSeriesDataset('epoch_schedule', np.asarray(epoch_schedule))
 
         else:
             print('Create a data file and/or define a fly first')
@@ -166,20 +254,79 @@ class Data():
         """
         Save the timestamp when the epoch ends
         """
-        with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r+') as experiment_file:
-            epoch_end_now = datetime.now()
-            epoch_end_time = epoch_end_now.strftime('%H:%M:%S.%f')
-            epoch_end_unix_time = epoch_end_now.astimezone(timezone.utc).timestamp()
-            epoch_run_group = experiment_file['/Flies/{}/epoch_runs/series_{}/epochs'.format(self.current_fly, str(self.series_count).zfill(3))]
-            epoch_group = epoch_run_group['epoch_{}'.format(str(protocol_object.num_epochs_completed+1).zfill(3))]
-            epoch_group.attrs['epoch_end_time'] = epoch_end_time
-            epoch_group.attrs['epoch_end_unix_time'] = epoch_end_unix_time
+        epoch_end_now = datetime.now()
+        epoch_end_time = epoch_end_now.strftime('%H:%M:%S.%f')
+        epoch_end_unix_time = epoch_end_now.astimezone(timezone.utc).timestamp()
+
+        epoch_end_attrs = {'epoch_end_time': epoch_end_time,
+                           'epoch_end_unix_time': epoch_end_unix_time}
+        self.writeEpochRecord(self.getEpochName(protocol_object), epoch_end_attrs, create_group=False)
+
+        # flush the session file on a fixed schedule, rather than after every epoch
+        self.epochs_since_flush += 1
+        if self.epochs_since_flush >= self.flush_interval:
+            self.epochs_since_flush = 0
+            self.submitWrite(self.flushSession)
+
+    def getEpochName(self, protocol_object):
+        return 'epoch_{}'.format(str(protocol_object.num_epochs_completed+1).zfill(3))
+
+    def writeEpochRecord(self, epoch_name, attrs, create_group=False):
+        """
+        Journal attrs for an epoch in the current series, then write them to the file,
+        either now or via the background writer
+        """
+        if self.journal.isOpen():
+            self.journal.append({'type': 'epoch', 'series_path': self.getSeriesPath(), 'epoch_name': epoch_name,
+                                 'attrs': attrs, 'create_group': create_group})
+        self.submitWrite(self._writeEpochRecord, self.getSeriesPath(), epoch_name, attrs, create_group)
+
+    def _writeEpochRecord(self, series_path, epoch_name, attrs, create_group):
+        with self.openExperimentFile('r+') as experiment_file:
+            series_group = self.getSeriesGroup(experiment_file, series_path)
+            if self.swmr_active:
+                # SWMR writers may only append to existing datasets: publish the timestamp now,
+                # and write the epoch group/row when the run ends
+                appendEpochTime(series_group, attrs)
+                self.deferred_writes.append((writeEpochAttributes, series_path, (epoch_name, attrs, create_group, self.parameter_spill_bytes)))
+            else:
+                writeEpochAttributes(series_group, epoch_name, attrs, create_group, spill_bytes=self.parameter_spill_bytes)
+
+    def writeSeriesDataset(self, name, data):
+        """
+        Journal a dataset for the current series, then write it to the series group
+        """
+        if self.journal.isOpen():
+            self.journal.append({'type': 'dataset', 'series_path': self.getSeriesPath(), 'name': name, 'data': data})
+        self.submitWrite(self._writeSeriesDataset, self.getSeriesPath(), name, data)
+
+    def _writeSeriesDataset(self, series_path, name, data):
+        with self.openExperimentFile('r+') as experiment_file:
+            if self.swmr_active:  # SWMR writers cannot create datasets
+                self.deferred_writes.append((writeSeriesDataset, series_path, (name, data)))
+            else:
+                writeSeriesDataset(self.getSeriesGroup(experiment_file, series_path), name, data)
+
+    def submitWrite(self, function, *args):
+        """
+        Run a write job on the background writer thread if it is running, otherwise run it right away
+        """
+        if self.metadata_writer.isRunning():
+            self.metadata_writer.put(function, *copy.deepcopy(args))
+        else:
+            function(*args)
+
+    def waitForWrites(self):
+        """
+        Block until all queued metadata writes have been written to the file
+        """
+        self.metadata_writer.wait()
 
     def createNote(self, noteText):
         ""
         ""
         if self.experimentFileExists():
-            with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r+') as experiment_file:
+            with self.openExperimentFile('r+') as experiment_file:
                 note_now = datetime.now()
                 note_time = note_now.strftime('%H:%M:%S.%f')[:-4]
                 note_unix_time = note_now.astimezone(timezone.utc).timestamp()
@@ -188,6 +335,89 @@ class Data():
         else:
             print('Initialize a data file before writing a note')
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# # # # # # # # #  Experiment file session  # # # # # # # # # # # # # # # # # # #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+    def getExperimentFilePath(self):
+        return os.path.join(self.data_directory, self.experiment_file_name + '.hdf5')
+
+    @contextmanager
+    def openExperimentFile(self, mode='r'):
+        """
+        Yield the open session file if there is one, otherwise open the file just for this block
+        """
+        if self.experiment_file is not None:
+            yield self.experiment_file
+        else:
+            with h5py.File(self.getExperimentFilePath(), mode) as experiment_file:
+                yield experiment_file
+
+    def openSession(self):
+        if self.experiment_file is None:
+            if self.use_swmr:
+                self.experiment_file = h5py.File(self.getExperimentFilePath(), 'r+', libver=SWMR_LIBVER)
+            else:
+                self.experiment_file = h5py.File(self.getExperimentFilePath(), 'r+')
+            self.epochs_since_flush = 0
+            _open_sessions.add(self)  # closed at exit if still open
+
+    def startSwmr(self):
+        """
+        Create the appendable epoch timestamp datasets for the current series, then switch the
+        session file to single-writer/multiple-reader mode so readers can follow the run live
+        """
+        createEpochTimeDatasets(self.series_group)
+        self.experiment_file.flush()
+        try:
+            self.experiment_file.swmr_mode = True
+            self.swmr_active = True
+        except RuntimeError as e:  # e.g. file was not created with SWMR support
+            print('Could not start SWMR mode, writing this run normally: {}'.format(e))
+
+    def flushSession(self):
+        if self.experiment_file is not None:
+            self.experiment_file.flush()
+
+    def closeSession(self):
+        if self.experiment_file is not None:
+            try:
+                self.experiment_file.flush()
+            finally:
+                self.experiment_file.close()
+                self.experiment_file = None
+                self.series_group = None
+                self.epochs_since_flush = 0
+                self.swmr_active = False
+                _open_sessions.discard(self)
+
+    def recoverFromJournal(self):
+        """
+        If a journal was left behind by a run that did not finish, write any series and epochs
+        it holds that are missing from the experiment file, then discard the journal
+        """
+        if self.experiment_file_name is None or not os.path.isfile(getJournalPath(self.getExperimentFilePath())):
+            return
+        self.metadata_writer.stop()
+        self.closeSession()
+        recovered = recoverFromJournal(self.getExperimentFilePath(), spill_bytes=self.parameter_spill_bytes)
+        print('Recovered {} series and {} epoch records from journal'.format(recovered['series'], recovered['epoch']))
+        self.reloadFileIndex()
+
+    def getSeriesPath(self):
+        return '/Flies/{}/epoch_runs/series_{}'.format(self.current_fly, str(self.series_count).zfill(3))
+
+    def getSeriesGroup(self, experiment_file, series_path=None):
+        """
+        Return the series group at series_path (default: current series),
+        using the cached session handle if it is still valid
+        """
+        if series_path is None:
+            series_path = self.getSeriesPath()
+        if self.series_group is not None and experiment_file is self.experiment_file and self.series_group.name == series_path:
+            return self.series_group
+        return experiment_file[series_path]
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # # # # # # # # #  Retrieve / query data file # # # # # # # # # # # # # # # # #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -206,15 +436,47 @@ class Data():
             tf = True
         return tf
 
+    def newFileIndex(self):
+        return {'file_path': self.getExperimentFilePath(),
+                'flies': {},  # fly_id: fly attrs
+                'series': {}}  # series number: fly_id
+
+    def buildFileIndex(self):
+        """
+        Scan the experiment file once and index its flies and series
+        """
+        self.file_index = self.newFileIndex()
+        with self.openExperimentFile('r') as experiment_file:
+            for fly_id, fly_group in experiment_file['/Flies'].items():
+                self.file_index['flies'][fly_id] = dict(fly_group.attrs)
+                for series_group in fly_group['epoch_runs'].values():
+                    self.indexSeries(series_group)
+        return self.file_index
+
+    def indexSeries(self, series_group):
+        series_number = int(series_group.name.split('_')[-1])
+        self.getFileIndex()['series'][series_number] = series_group.parent.parent.name.split('/')[-1]
+
+    def getFileIndex(self):
+        """
+        Return the index for the current experiment file, building it on first use
+        """
+        if self.file_index is None or self.file_index['file_path'] != self.getExperimentFilePath():
+            if self.experimentFileExists():
+                self.buildFileIndex()
+            else:
+                self.file_index = self.newFileIndex()
+        return self.file_index
+
+    def reloadFileIndex(self):
+        """
+        Discard the index and rebuild it from the file, e.g. after the file was edited elsewhere
+        """
+        self.file_index = None
+        return self.getFileIndex()
+
     def getExistingSeries(self):
-        all_series = []
-        with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r') as experiment_file:
-            for fly_id in list(experiment_file['/Flies'].keys()):
-                new_series = list(experiment_file['/Flies/{}/epoch_runs'.format(fly_id)].keys())
-                all_series.append(new_series)
-        all_series = [val for s in all_series for val in s]
-        series = [int(x.split('_')[-1]) for x in all_series]
-        return series
+        return list(self.getFileIndex()['series'].keys())
 
     def getHighestSeriesCount(self):
         series = self.getExistingSeries()
@@ -225,17 +487,10 @@ class Data():
 
     def getExistingFlyData(self):
         # return list of dicts for fly metadata already present in experiment file
-        fly_data_list = []
         if self.experimentFileExists():
-            with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r') as experiment_file:
-                for fly in experiment_file['/Flies']:
-                    new_fly = experiment_file['/Flies'][fly]
-                    new_dict = {}
-                    for at in new_fly.attrs:
-                        new_dict[at] = new_fly.attrs[at]
-
-                    fly_data_list.append(new_dict)
-        return fly_data_list
+            return [fly_data.copy() for fly_data in self.getFileIndex()['flies'].values()]
+        else:
+            return []
 
     def selectFly(self, fly_id):
         self.current_fly = fly_id
@@ -250,14 +505,7 @@ class Data():
         return self.series_count
 
     def reloadSeriesCount(self):
-        all_series = []
-        with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r') as experiment_file:
-            for fly_id in list(experiment_file['/Flies'].keys()):
-                new_series = list(experiment_file['/Flies/{}/epoch_runs'.format(fly_id)].keys())
-                all_series.append(new_series)
-        all_series = [val for s in all_series for val in s]
-        series = [int(x.split('_')[-1]) for x in all_series]
-
+        series = list(self.reloadFileIndex()['series'].keys())
         if len(series) == 0:
             self.series_count = 0 + 1
         else:
@@ -290,62 +538,567 @@ class AODscopeData(Data):
         else:
             return self.xyt_count
 
+    def newFileIndex(self):
+        file_index = super().newFileIndex()
+        file_index['poi'] = []  # poi_count of each poi series
+        file_index['xyt'] = []  # xyt_count of each xyt series
+        return file_index
+
+    def indexSeries(self, series_group):
+        super().indexSeries(series_group)
+        acq_group = series_group['acquisition']
+        if 'poi_scan' not in acq_group.attrs:  # series not written by an AODscope rig
+            return
+        if acq_group.attrs['poi_scan']:
+            self.getFileIndex()['poi'].append(int(acq_group.attrs['poi_count']))
+        else:
+            self.getFileIndex()['xyt'].append(int(acq_group.attrs['xyt_count']))
+
     def getExistingSeries(self):
-        poi_series = []
-        xyt_series = []
-        with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r') as experiment_file:
-            for fly_id in list(experiment_file['/Flies'].keys()):
-                for series_id in experiment_file['/Flies/{}/epoch_runs'.format(fly_id)]:
-                    acq_group = experiment_file['/Flies/{}/epoch_runs/{}/acquisition'.format(fly_id, series_id)]
-                    if acq_group.attrs['poi_scan']:
-                        poi_series.append(acq_group.attrs['poi_count'])
-                    else:
-                        xyt_series.append(acq_group.attrs['xyt_count'])
-
-        poi_series = [int(x) for x in poi_series]
-        xyt_series = [int(x) for x in xyt_series]
+        if self.poi_scan:
+            return list(self.getFileIndex()['poi'])
+        else:
+            return list(self.getFileIndex()['xyt'])
 
+    def getAcquisitionAttributes(self):
+        # AODscope-specific data stuff:
         if self.poi_scan:
-            return poi_series
+            return {'poi_scan': self.poi_scan, 'poi_count': self.poi_count}
         else:
-            return xyt_series
+            return {'poi_scan': self.poi_scan, 'xyt_count': self.xyt_count}
 
-    def createEpochRun(self, protocol_object):
-        """"
+
+class MetadataWriter():
+    """
+    Drains queued metadata write jobs into the experiment file on a dedicated thread.
+    put() blocks when the queue is full, which applies back-pressure to the epoch loop
+    rather than letting the backlog grow without bound.
+    """
+    def __init__(self, max_queue_size=256):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        self.error = None
+
+    def isRunning(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is None:
+            self.error = None
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def put(self, function, *args):
+        self.queue.put((function, args))
+
+    def wait(self):
         """
-        # create a new epoch run group in the data file
-        if (self.currentFlyExists() and self.experimentFileExists()):
-            with h5py.File(os.path.join(self.data_directory, self.experiment_file_name + '.hdf5'), 'r+') as experiment_file:
-                run_start_now = datetime.now()
-                run_start_time = run_start_now.strftime('%H:%M:%S.%f')[:-4]
-                run_start_unix_time = run_start_now.astimezone(timezone.utc).timestamp()
-                fly_group = experiment_file['/Flies/{}/epoch_runs'.format(self.current_fly)]
-                new_epoch_run = fly_group.create_group('series_{}'.format(str(self.series_count).zfill(3)))
-                new_epoch_run.attrs['run_start_time'] = run_start_time
-                new_epoch_run.attrs['run_start_unix_time'] = run_start_unix_time
-                for key in protocol_object.run_parameters:  # add run parameter attributes
-                    new_epoch_run.attrs[key] = protocol_object.run_parameters[key]
-
-                for key in protocol_object.protocol_parameters:  # add user-entered protocol params
-                    new_epoch_run.attrs[key] = protocol_object.protocol_parameters[key]
-
-                # add subgroups:
-                new_epoch_run.create_group('acquisition')
-                new_epoch_run.create_group('epochs')
-                new_epoch_run.create_group('rois')
-                new_epoch_run.create_group('stimulus_timing')
-
-                # AODscope-specific data stuff:
-                new_epoch_run['acquisition'].attrs['poi_scan'] = self.poi_scan
-                if self.poi_scan:
-                    new_epoch_run['acquisition'].attrs['poi_count'] = self.poi_count
-                else:
-                    new_epoch_run['acquisition'].attrs['xyt_count'] = self.xyt_count
-        else:
-            print('Create a data file and/or define a fly first')
+        Block until every job queued so far has been written
+        """
+        self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def stop(self):
+        """
+        Write out everything left in the queue, then stop the writer thread
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                function, args = item
+                function(*args)
+            except Exception as e:
+                print('Metadata writer error: {}'.format(e))
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+
+class MetadataJournal():
+    """
+    Append-only journal of series/epoch records, written next to the experiment file before the
+    records go to HDF5. Each record is a 4-byte little-endian length followed by a pickled dict,
+    so appending one costs a single buffered write.
+    """
+    def __init__(self):
+        self.file_path = None
+        self.journal_file = None
+
+    def isOpen(self):
+        return self.journal_file is not None
+
+    def open(self, file_path):
+        self.close()
+        self.file_path = file_path
+        self.journal_file = open(file_path, 'ab')
+
+    def append(self, record):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self.journal_file.write(struct.pack('<I', len(payload)) + payload)
+        self.journal_file.flush()
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+    def discard(self):
+        """
+        Close and delete the journal, once its records are known to be in the experiment file
+        """
+        self.close()
+        if self.file_path is not None and os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+        self.file_path = None
+
 
 # %% Useful functions. Outside classes.
 
+_open_sessions = weakref.WeakSet()  # Data objects with an open file session
+
+
+def closeOpenSessions():
+    for data in list(_open_sessions):
+        data.closeSession()
+
+
+atexit.register(closeOpenSessions)
+
+
+def getJournalPath(experiment_file_path):
+    return os.path.splitext(experiment_file_path)[0] + '.journal'
+
+
+def readJournal(journal_path):
+    """
+    Yield records from a journal file. A truncated record at the end (from a crash mid-write) is ignored
+    """
+    with open(journal_path, 'rb') as journal_file:
+        while True:
+            header = journal_file.read(4)
+            if len(header) < 4:
+                return
+            (length,) = struct.unpack('<I', header)
+            payload = journal_file.read(length)
+            if len(payload) < length:
+                return
+            yield pickle.loads(payload)
+
+
+def recoverFromJournal(experiment_file_path, spill_bytes=None):
+    """
+    Replay a journal into the experiment file: create any series and epoch groups (or epoch table rows)
+    that are missing, then delete the journal. Returns counts of replayed records by type
+    """
+    journal_path = getJournalPath(experiment_file_path)
+    recovered = {'series': 0, 'epoch': 0, 'dataset': 0}
+    with h5py.File(experiment_file_path, 'r+') as experiment_file:
+        for record in readJournal(journal_path):
+            if record['type'] == 'series':
+                if record['series_path'] not in experiment_file:
+                    createSeriesGroup(experiment_file, record['series_path'], record['attrs'], record.get('acquisition_attrs'))
+                    recovered['series'] += 1
+
+            elif record['type'] == 'dataset':
+                if record['series_path'] in experiment_file and record['name'] not in experiment_file[record['series_path']]:
+                    writeSeriesDataset(experiment_file[record['series_path']], record['name'], record['data'])
+                    recovered['dataset'] += 1
+
+            elif record['type'] == 'epoch':
+                if record['series_path'] not in experiment_file:
+                    continue
+                series_group = experiment_file[record['series_path']]
+                create_group = record['create_group']
+                if series_group.attrs.get('epoch_storage', 'groups') != 'table':
+                    if create_group and record['epoch_name'] in series_group['epochs']:
+                        continue  # already written
+                    if not create_group and record['epoch_name'] not in series_group['epochs']:
+                        continue  # epoch start never made it to the journal
+                    if not create_group and all(key in series_group['epochs'][record['epoch_name']].attrs for key in record['attrs']):
+                        continue  # already written
+                writeEpochAttributes(series_group, record['epoch_name'], record['attrs'], create_group, spill_bytes=spill_bytes)
+                recovered['epoch'] += 1
+
+    os.remove(journal_path)
+    return recovered
+
+
+def createSeriesGroup(experiment_file, series_path, series_attrs, acquisition_attrs=None):
+    """
+    Create a series group with its attrs and standard subgroups
+    """
+    new_epoch_run = experiment_file.create_group(series_path)
+    for key in series_attrs:
+        new_epoch_run.attrs[key] = series_attrs[key]
+
+    # add subgroups:
+    new_epoch_run.create_group('acquisition')
+    new_epoch_run.create_group('epochs')
+    new_epoch_run.create_group('rois')
+    new_epoch_run.create_group('stimulus_timing')
+
+    if acquisition_attrs is not None:
+        for key in acquisition_attrs:
+            new_epoch_run['acquisition'].attrs[key] = acquisition_attrs[key]
+    return new_epoch_run
+
+
+def writeSeriesDataset(series_group, name, data):
+    """
+    Write a series-level dataset, e.g. the epoch schedule
+    """
+    if name in series_group:
+        del series_group[name]
+    series_group.create_dataset(name, data=data)
+
+
+def createEpochTimeDatasets(series_group):
+    """
+    Create appendable epoch start/end unix time datasets under stimulus_timing
+    """
+    for name in EPOCH_TABLE_TIME_COLUMNS:
+        series_group['stimulus_timing'].create_dataset(name, shape=(0,), maxshape=(None,), dtype='f8',
+                                                       chunks=(EPOCH_TABLE_CHUNK_ROWS,), fillvalue=np.nan)
+
+
+def appendEpochTime(series_group, attrs):
+    """
+    Append an epoch start or end time from attrs to the series' epoch time datasets and flush it for readers
+    """
+    for name in EPOCH_TABLE_TIME_COLUMNS:
+        if name in attrs:
+            dataset = series_group['stimulus_timing'][name]
+            dataset.resize((dataset.shape[0] + 1,))
+            dataset[-1] = attrs[name]
+            dataset.flush()
+
+
+class LiveSeriesReader():
+    """
+    Follow the epoch times of a series while it is being recorded in SWMR mode, without locking the writer.
+    Usage:
+        reader = LiveSeriesReader(experiment_file_path, '/Flies/fly_1/epoch_runs/series_001')
+        epoch_unix_time, epoch_end_unix_time = reader.poll()
+    """
+    def __init__(self, experiment_file_path, series_path):
+        self.experiment_file = h5py.File(experiment_file_path, 'r', libver=SWMR_LIBVER, swmr=True)
+        self.timing_group = self.experiment_file[series_path]['stimulus_timing']
+
+    def poll(self):
+        """
+        Return arrays of (epoch start times, epoch end times) written so far
+        """
+        times = []
+        for name in EPOCH_TABLE_TIME_COLUMNS:
+            dataset = self.timing_group[name]
+            dataset.refresh()
+            times.append(dataset[:])
+        return tuple(times)
+
+    def close(self):
+        self.experiment_file.close()
+
+
+def writeEpochAttributes(series_group, epoch_name, attrs, create_group, spill_bytes=None):
+    """
+    Write attrs for one epoch into series_group, using the series' epoch storage layout
+    """
+    if series_group.attrs.get('epoch_storage', 'groups') == 'table':
+        writeEpochTableRow(series_group, int(epoch_name.split('_')[-1]) - 1, attrs, spill_bytes=spill_bytes)
+        return
+
+    epoch_run_group = series_group['epochs']
+    if create_group:
+        epoch_group = epoch_run_group.create_group(epoch_name)
+    else:
+        epoch_group = epoch_run_group[epoch_name]
+
+    for key in attrs:
+        writeEpochParameter(epoch_group, key, attrs[key], spill_bytes=spill_bytes)
+
+
+
+def getEpochAttributes(protocol_object):
+    """
+    Collect the epoch and convenience parameters of the current epoch as a flat dict.
+    Values are left as-is here; they are converted for HDF5 when written (see writeEpochParameter)
+    """
+    epoch_attrs = {}
+    if type(protocol_object.epoch_parameters) is tuple:  # stimulus is tuple of multiple stims layered on top of one another
+        num_stims = len(protocol_object.epoch_parameters)
+        for stim_ind in range(num_stims):
+            for key in protocol_object.epoch_parameters[stim_ind]:
+                prefix = 'stim{}_'.format(str(stim_ind))
+                epoch_attrs[prefix + key] = protocol_object.epoch_parameters[stim_ind][key]
+
+    elif type(protocol_object.epoch_parameters) is dict:  # single stim class
+        for key in protocol_object.epoch_parameters:
+            epoch_attrs[key] = protocol_object.epoch_parameters[key]
+
+    for key in protocol_object.convenience_parameters:  # save out convenience parameters
+        epoch_attrs[key] = protocol_object.convenience_parameters[key]
+
+    return epoch_attrs
+
+
+SWMR_LIBVER = 'v110'  # lowest file format version that supports SWMR
+PARAMETER_SPILL_BYTES = 4096
+EPOCH_TABLE_CHUNK_ROWS = 256
+EPOCH_TABLE_TIME_COLUMNS = ('epoch_unix_time', 'epoch_end_unix_time')
+
+
+def _getColumnType(value):
+    """
+    Epoch table column type for a scalar value: '?' for bools, 'i8' for ints, 'f8' for floats, None otherwise
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return '?'
+    if isinstance(value, (int, np.integer)):
+        return 'i8'
+    if isinstance(value, (float, np.floating)):
+        return 'f8'
+    return None
+
+
+def _fitsColumn(value, dtype):
+    """
+    True if value can be stored in a column of dtype without changing its type or losing precision
+    """
+    column_type = _getColumnType(value)
+    if column_type is None:
+        return False
+    if dtype.kind == 'b':
+        return column_type == '?'
+    if dtype.kind == 'i':
+        return column_type == 'i8' and -2**63 <= int(value) < 2**63
+    return column_type == 'f8' or (column_type == 'i8' and abs(int(value)) <= 2**53)  # ints that floats hold exactly
+
+
+def _jsonDefault(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def writeEpochTableRow(series_group, row, attrs, spill_bytes=None):
+    """
+    Write epoch attrs into row of the columnar epoch table under series_group.
+
+    Scalar bool/int/float parameters seen on the first epoch become bool, int64 or float64 columns
+    of the compound 'parameters' dataset, and 'parameters_set' marks which columns each epoch actually set.
+    Everything else (strings, lists, parameters that first appear later, or values that don't
+    fit their column type) goes into a per-parameter side table of JSON-encoded strings under
+    epoch_table/side_tables, where '' means not set for that epoch. Large parameters are
+    spilled to datasets under epoch_table/spilled, and the side table holds their path.
+    """
+    table_group = series_group.require_group('epoch_table')
+
+    if 'parameters' not in table_group:
+        fields = [(key, 'f8') for key in EPOCH_TABLE_TIME_COLUMNS]
+        for key, value in attrs.items():
+            if key not in EPOCH_TABLE_TIME_COLUMNS and _getColumnType(value) is not None:
+                fields.append((key, _getColumnType(value)))
+        parameters = table_group.create_dataset('parameters', shape=(0,), maxshape=(None,),
+                                                dtype=np.dtype(fields), chunks=(EPOCH_TABLE_CHUNK_ROWS,))
+        parameters_set = table_group.create_dataset('parameters_set', shape=(0,), maxshape=(None,),
+                                                    dtype=np.dtype([(name, '?') for name, _ in fields]), chunks=(EPOCH_TABLE_CHUNK_ROWS,))
+    else:
+        parameters = table_group['parameters']
+        parameters_set = table_group['parameters_set']
+    side_table_group = table_group.require_group('side_tables')
+
+    num_rows = max(parameters.shape[0], row + 1)
+    if parameters.shape[0] < num_rows:
+        old_rows = parameters.shape[0]
+        parameters.resize((num_rows,))
+        parameters_set.resize((num_rows,))
+        fill = np.zeros(num_rows - old_rows, dtype=parameters.dtype)
+        for name in parameters.dtype.names:
+            if parameters.dtype[name].kind == 'f':
+                fill[name] = np.nan
+        parameters[old_rows:] = fill
+        parameters_set[old_rows:] = np.zeros(num_rows - old_rows, dtype=parameters_set.dtype)
+
+    row_values = parameters[row]
+    row_set = parameters_set[row]
+    for key, value in attrs.items():
+        if key in parameters.dtype.names and _fitsColumn(value, parameters.dtype[key]):
+            row_values[key] = value
+            row_set[key] = True
+        else:
+            if key not in side_table_group:
+                side_table_group.create_dataset(key, shape=(num_rows,), maxshape=(None,),
+                                                dtype=h5py.string_dtype(), chunks=(EPOCH_TABLE_CHUNK_ROWS,))
+            side_table = side_table_group[key]
+            if side_table.shape[0] < num_rows:
+                side_table.resize((num_rows,))
+            if shouldSpillParameter(value, spill_bytes) and '/' not in key:
+                epoch_spill_group = table_group.require_group('spilled/epoch_{}'.format(str(row + 1).zfill(3)))
+                if key in epoch_spill_group:
+                    del epoch_spill_group[key]
+                side_table[row] = json.dumps({'hdf5_path': spillParameter(epoch_spill_group, key, value).name})
+            else:
+                side_table[row] = json.dumps(hdf5ifyParameter(value), default=_jsonDefault)
+    parameters[row] = row_values
+    parameters_set[row] = row_set
+
+
+def readEpochAttributes(series_group):
+    """
+    Return {epoch_name: attrs dict} for a series, for either the group-per-epoch or the table layout.
+    Parameters an epoch did not set are left out of its attrs
+    """
+    epoch_attributes = {}
+    if 'epoch_table' not in series_group:
+        for epoch_name, epoch_group in series_group['epochs'].items():
+            epoch_attributes[epoch_name] = {key: rehydrateParameter(epoch_group, value) for key, value in epoch_group.attrs.items()}
+        return epoch_attributes
+
+    table_group = series_group['epoch_table']
+    parameters = table_group['parameters'][:]
+    parameters_set = table_group['parameters_set'][:]
+    side_tables = {}
+    table_group['side_tables'].visititems(lambda name, item: side_tables.update({name: item.asstr()[:]}) if isinstance(item, h5py.Dataset) else None)
+    for row in range(parameters.shape[0]):
+        attrs = {name: parameters[name][row] for name in parameters.dtype.names if parameters_set[name][row]}
+        for key, values in side_tables.items():
+            if row < len(values) and values[row] != '':
+                value = json.loads(values[row])
+                if isinstance(value, dict) and list(value.keys()) == ['hdf5_path']:
+                    value = rehydrateParameter(table_group, table_group[value['hdf5_path']])
+                attrs[key] = value
+        epoch_attributes['epoch_{}'.format(str(row + 1).zfill(3))] = attrs
+
+    return epoch_attributes
+
+
+def _asNumericArray(value):
+    """
+    Return value as a numeric numpy array, or None if it isn't a (non-ragged) numeric array-like
+    """
+    if isinstance(value, np.ndarray):
+        array = value
+    elif isinstance(value, (list, tuple)):
+        try:
+            array = np.asarray(value)
+        except ValueError:  # ragged nested sequence
+            return None
+    else:
+        return None
+
+    if array.dtype.kind in 'biuf':
+        return array
+    return None
+
+
+def _estimateParameterSize(value):
+    """
+    Rough size in bytes of value once stored, without building its string representation
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k)) + _estimateParameterSize(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_estimateParameterSize(v) for v in value)
+    return 8
+
+
+def shouldSpillParameter(value, spill_bytes=None):
+    """
+    Parameters that are multi-dimensional numeric arrays, or larger than spill_bytes,
+    are stored as datasets rather than attributes
+    """
+    if spill_bytes is None:
+        spill_bytes = PARAMETER_SPILL_BYTES
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf' and value.ndim >= 2:
+        return True
+    return _estimateParameterSize(value) > spill_bytes
+
+
+def spillParameter(parent_group, name, value):
+    """
+    Write value as a compressed dataset (or a group of datasets, for dicts) named name under parent_group.
+    Returns the new dataset/group
+    """
+    if isinstance(value, dict):
+        spill_group = parent_group.create_group(name)
+        for key, entry in value.items():
+            key = str(key)
+            entry_array = _asNumericArray(entry)
+            if '/' not in key and (isinstance(entry, dict) or (entry_array is not None and entry_array.size > 1)):
+                spillParameter(spill_group, key, entry)
+            else:
+                try:
+                    spill_group.attrs[key] = hdf5ifyParameter(entry)
+                except (TypeError, ValueError):  # no HDF5 type, e.g. a list of dicts, a ragged list or a list containing None
+                    spill_group.attrs[key] = json.dumps(entry, default=_jsonDefault)
+        return spill_group
+
+    array = _asNumericArray(value)
+    if array is not None:
+        if array.size > 1:
+            return parent_group.create_dataset(name, data=array, compression='gzip', shuffle=True)
+        return parent_group.create_dataset(name, data=array)
+
+    text = value if isinstance(value, str) else str(value)
+    spill_dataset = parent_group.create_dataset(name, data=np.frombuffer(text.encode('utf-8'), dtype=np.uint8), compression='gzip')
+    spill_dataset.attrs['encoding'] = 'utf-8'
+    return spill_dataset
+
+
+def rehydrateParameter(group, value):
+    """
+    Resolve a parameter stored by spillParameter back into numpy arrays / dicts / str.
+    value is either the attribute value (an object reference) or the spilled dataset/group itself.
+    Any other value is returned unchanged
+    """
+    if isinstance(value, h5py.Reference):
+        value = group.file[value]
+
+    if isinstance(value, h5py.Group):
+        rehydrated = {key: rehydrateParameter(value, entry) for key, entry in value.attrs.items()}
+        for key, entry in value.items():
+            rehydrated[key] = rehydrateParameter(value, entry)
+        return rehydrated
+
+    if isinstance(value, h5py.Dataset):
+        if value.attrs.get('encoding') == 'utf-8':
+            return value[()].tobytes().decode('utf-8')
+        return value[()]
+
+    return value
+
+
+def writeEpochParameter(group, key, value, spill_bytes=None):
+    """
+    Write an epoch parameter as an attribute of group. Large parameters are spilled to a
+    compressed dataset under group, and the attribute holds an object reference to it
+    """
+    if shouldSpillParameter(value, spill_bytes) and '/' not in key:
+        if key in group:
+            del group[key]
+        group.attrs[key] = spillParameter(group, key, value).ref
+    else:
+        group.attrs[key] = hdf5ifyParameter(value)
+
 
 def hdf5ifyParameter(value):
     if value is None:
@@ -356,3 +1109,16 @@ def hdf5ifyParameter(value):
         value = str(value)
 
     return value
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Rebuild series/epochs missing from an experiment file using its metadata journal')
+    parser.add_argument('experiment_file_path', help='path to the .hdf5 experiment file')
+    args = parser.parse_args()
+
+    if os.path.isfile(getJournalPath(args.experiment_file_path)):
+        recovered = recoverFromJournal(args.experiment_file_path)
+        print('Recovered {} series and {} epoch records'.format(recovered['series'], recovered['epoch']))
+    else:
+        print('No journal found for {}'.format(args.experiment_file_path))
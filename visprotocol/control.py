@@ -1,30 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-EpochRun object controls presentation of a sequence of epochs ("epoch run")
+EpochRun object controls presentation of a sequence of epochs ("epoch run"),
+or of a queue of epoch runs presented back to back
 """
 
-from PyQt5.QtWidgets import QApplication
-from time import sleep
 import os
 import posixpath
+import threading
+import time
+
+from visprotocol.timing import EpochScheduler, MonotonicClock, summarizeHostTiming, printHostTimingSummary
 
 class EpochRun():
-    def __init__(self):
-        self.stop = False
-        self.pause = False
+    def __init__(self, clock=None):
+        # all waits go through self.clock, which visprotocol.simulation swaps for a virtual clock
+        self.clock = MonotonicClock() if clock is None else clock
+        # pause/resume/stop are signalled from the GUI thread. A paused run blocks on resume_event
+        self.stop_event = threading.Event()
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+        self.prefetched = False  # next epoch's parameters and stimuli were loaded during the last tail_time
+        self.scheduler = EpochScheduler(clock=self.clock)
+
+    @property
+    def stop(self):
+        return self.stop_event.is_set()
+
+    @property
+    def pause(self):
+        return not self.resume_event.is_set()
 
     def stopRun(self):
-        self.stop = True
-        QApplication.processEvents()
+        self.stop_event.set()
+        self.resume_event.set()  # wake a paused run so it can stop
 
     def pauseRun(self):
-        self.pause = True
-        QApplication.processEvents()
+        self.resume_event.clear()
 
     def resumeRun(self):
-        self.pause = False
-        QApplication.processEvents()
+        self.resume_event.set()
 
     def startRun(self, protocol_object, data, client, save_metadata_flag=True):
         """
@@ -33,33 +48,100 @@ class EpochRun():
             data handles the metadata file
             client sends commands to flystim to control the stimulus
         """
-        self.stop = False
-        self.pause = False
+        self.startQueue([protocol_object], data, client, save_metadata_flag=save_metadata_flag, allocate_series=False)
+
+    def startQueue(self, protocol_objects, data, client, save_metadata_flag=True, allocate_series=True):
+        """
+        Run each protocol object in protocol_objects as its own series, back to back.
+        Locomotion and the experiment file session are set up once and kept for the whole queue.
+        With allocate_series, each saved series takes the next unused series number and the
+        series count is advanced after it. Stopping ends the whole queue.
+        Returns the series number of each series that was run (None if not saved)
+        """
+        self.stop_event.clear()
+        self.resume_event.set()
+        do_loco = 'do_loco' in data.cfg and data.cfg['do_loco']
+
+        if save_metadata_flag:
+            if allocate_series:
+                self.allocateSeries(data)
+            data.hold_session = True  # keep the file session open between series
+
+        if do_loco:
+            if save_metadata_flag:
+                if ('server_data_directory' in data.cfg) and (data.cfg['server_data_directory'] is not None):
+                    # loco data for the whole queue goes with the first series, with series boundaries marked in its log
+                    server_loco_dir = posixpath.join(self.getServerSeriesDirectory(data), 'loco')
+                    client.manager.loco_set_save_directory(server_loco_dir)
+                else:
+                    print("Locomotion data can't be saved on server without server_data_directory specified in config.yaml.")
+            client.manager.loco_start()
+            self.clock.sleep(data.cfg.get('loco_options', {}).get('start_wait', 3)) # Give loco time to load
+
+        series_counts = []
+        try:
+            for queue_ind, protocol_object in enumerate(protocol_objects):
+                if self.stop_event.is_set():
+                    break
+                if save_metadata_flag and allocate_series and queue_ind > 0:
+                    self.allocateSeries(data)
+                series_counts.append(data.getSeriesCount() if save_metadata_flag else None)
+                self.runSeries(protocol_object, data, client, save_metadata_flag=save_metadata_flag, start_loco_loop=(do_loco and queue_ind == 0))
+                if save_metadata_flag and allocate_series:
+                    data.advanceSeriesCount()
+        finally:
+            if save_metadata_flag:
+                data.hold_session = False
+                data.closeSession()
+
+            # Set screens to dark
+            client.manager.black_corner_square()
+            # client.manager.set_idle_background(0)
+
+            if do_loco:
+                client.manager.loco_close()
+                client.manager.loco_set_save_directory(None)
+
+        return series_counts
+
+    def allocateSeries(self, data):
+        """
+        Advance the series count past any series that already exist in the experiment file
+        """
+        while data.getSeriesCount() in data.getExistingSeries():
+            data.advanceSeriesCount()
+
+    def getServerSeriesDirectory(self, data):
+        return posixpath.join(data.cfg['server_data_directory'], data.experiment_file_name, str(data.series_count))
+
+    def runSeries(self, protocol_object, data, client, save_metadata_flag=True, start_loco_loop=False):
+        """
+        Run the epochs of one series. Locomotion, if used, must already be started
+        """
+        self.prefetched = False
+        do_loco = 'do_loco' in data.cfg and data.cfg['do_loco']
         protocol_object.save_metadata_flag = save_metadata_flag
+        protocol_object.scheduler = self.scheduler
+        if data.cfg.get('prefetch_stimuli', False) and getattr(protocol_object, 'allow_prefetch', False):
+            protocol_object.prefetch_next_epoch = lambda: self.prefetchNextEpoch(protocol_object, client)
         client.manager.set_idle_background(protocol_object.run_parameters['idle_color'])
 
+        protocol_object.startRandomGenerator(protocol_object.run_parameters.get('random_seed'))  # fresh seed unless replaying a run
         protocol_object.precomputeEpochParameters()
 
         self.server_series_dir = None
         if save_metadata_flag and ('server_data_directory' in data.cfg) and (data.cfg['server_data_directory'] is not None):
-            self.server_series_dir = posixpath.join(data.cfg['server_data_directory'], data.experiment_file_name, str(data.series_count))
+            self.server_series_dir = self.getServerSeriesDirectory(data)
 
             # set directory in which to save animal positions from each screen.
             server_pos_history_dir = posixpath.join(self.server_series_dir, 'flystim_pos')
             client.manager.set_save_pos_history_dir(server_pos_history_dir)
 
-        if 'do_loco' in data.cfg and data.cfg['do_loco']:
-            if save_metadata_flag:
-                if ('server_data_directory' in data.cfg) and (data.cfg['server_data_directory'] is not None):
-                    server_loco_dir = posixpath.join(self.server_series_dir, 'loco')
-                    client.manager.loco_set_save_directory(server_loco_dir)
-                else:
-                    print("Locomotion data can't be saved on server without server_data_directory specified in config.yaml.")
-            client.manager.loco_start()
-            sleep(3) # Give loco time to load
-
         if save_metadata_flag:
             data.createEpochRun(protocol_object)
+            if do_loco:
+                client.manager.loco_write_to_log(f'Series {data.getSeriesCount()} start')
+                client.manager.loco_sync_clock(time.time())  # frame host_times are on the server's clock, epoch times on this one
         else:
             print('Warning - you are not saving your metadata!')
 
@@ -68,61 +150,137 @@ class EpochRun():
             print("Triggering acquisition devices.")
             client.daq_device.sendTrigger()
 
-        if 'do_loco' in data.cfg and data.cfg['do_loco']:
-            sleep(2) # Give loco time to start acquiring
+        if start_loco_loop:
+            self.clock.sleep(data.cfg.get('loco_options', {}).get('acquire_wait', 2)) # Give loco time to start acquiring
             client.manager.loco_loop_start() # start loop, which is superfluous if closed loop is not needed for the exp.
 
         # # # Pre-run Time # # #
         if 'pre_run_time' in protocol_object.run_parameters:
             client.manager.print_on_server(f'Starting pre-run time of {protocol_object.run_parameters["pre_run_time"]} seconds.')
-            sleep(protocol_object.run_parameters['pre_run_time'])
+            self.clock.sleep(protocol_object.run_parameters['pre_run_time'])
 
         # # # Epoch run loop # # #
         client.manager.print_on_server("Starting run.")
         protocol_object.num_epochs_completed = 0
-        while protocol_object.num_epochs_completed < protocol_object.run_parameters['num_epochs']:
-            QApplication.processEvents()
-            if self.stop is True:
-                self.stop = False
-                break # break out of epoch run loop
-
-            if self.pause is True:
-                pass # do nothing until resumed or stopped
-            else: # start epoch and advance counter
-                self.startEpoch(protocol_object, data, client, save_metadata_flag=save_metadata_flag)
+        self.scheduler.start(num_epochs=protocol_object.run_parameters['num_epochs'])  # epoch phase deadlines count from here
+        rpc_monitor = getattr(client, 'rpc_monitor', None)
+        if rpc_monitor is not None:
+            # warn when a single stim server call eats a sizeable part of pre_time
+            pre_time = protocol_object.run_parameters.get('pre_time')
+            rpc_monitor.startRun(warn_threshold=None if pre_time is None else data.cfg.get('rpc_warn_fraction', 0.1) * pre_time)
+        try:
+            while protocol_object.num_epochs_completed < protocol_object.run_parameters['num_epochs']:
+                if not self.resume_event.is_set():
+                    self.resume_event.wait()  # paused: block until resumed or stopped
+                    self.scheduler.anchor()  # resume the schedule from now
 
-        # Set screens to dark
-        client.manager.black_corner_square()
-        # client.manager.set_idle_background(0)
+                if self.stop_event.is_set():
+                    break # break out of epoch run loop
 
-        if 'do_loco' in data.cfg and data.cfg['do_loco']:
-            client.manager.loco_close()
-            client.manager.loco_set_save_directory(None)
+                # start epoch and advance counter
+                self.startEpoch(protocol_object, data, client, save_metadata_flag=save_metadata_flag)
+        finally:
+            protocol_object.prefetch_next_epoch = None
+            try:
+                if self.prefetched:
+                    # the run ended with the next epoch's stimuli already loaded: clear them from flystim
+                    self.prefetched = False
+                    client.manager.stop_stim()
+                self.saveRunTiming(data, rpc_monitor, save_metadata_flag=save_metadata_flag)
+            except Exception as e:  # don't let run timing keep the series from being written, or mask the error that ended the run
+                print('Error ending run: {}'.format(e))
+            finally:
+                # flush the data file session and write out the series, even if the run was interrupted
+                if save_metadata_flag:
+                    data.endEpochRun()
 
         client.manager.print_on_server('Stopping run.')
         # # # Epoch run loop # # #
 
+    def saveRunTiming(self, data, rpc_monitor, save_metadata_flag=True):
+        """
+        Stop the run schedule, print the run's phase, host stage and rpc timing, and save them with the series
+        """
+        phase_timing = self.scheduler.stop()
+        if len(phase_timing) > 0:
+            print('Epoch timing: {} phases, max lateness {:.2f} ms, {} overruns'.format(len(phase_timing),
+                  (phase_timing['actual_ns'] - phase_timing['planned_ns']).max() / 1e6, self.scheduler.overruns))
+            if save_metadata_flag:
+                data.writeSeriesDataset('stimulus_timing/phase_timing', phase_timing)
+        host_timing = self.scheduler.getHostTiming()
+        if len(host_timing) > 0:
+            printHostTimingSummary(summarizeHostTiming(host_timing))
+            if save_metadata_flag:
+                data.writeSeriesDataset('stimulus_timing/host_timing', self.scheduler.getHostTimingRecords())
+        if rpc_monitor is not None:
+            rpc_timing = rpc_monitor.stopRun()
+            print(rpc_monitor.getStatusText())
+            if save_metadata_flag and len(rpc_timing) > 0:
+                data.writeSeriesDataset('stimulus_timing/rpc_timing', rpc_timing)
+
     def startEpoch(self, protocol_object, data, client, save_metadata_flag=True):
-        #  get stimulus parameters for this epoch
-        protocol_object.getEpochParameters()
+        epoch = protocol_object.num_epochs_completed
+        if getattr(client, 'rpc_monitor', None) is not None:
+            client.rpc_monitor.epoch = epoch
+        #  get stimulus parameters for this epoch, unless they were prefetched during the last tail_time
+        if not self.prefetched:
+            t0 = self.clock.perf_counter_ns()
+            protocol_object.getEpochParameters()
+            self.scheduler.recordStage('get_epoch_parameters', t0, epoch)
 
         if save_metadata_flag:
+            t0 = self.clock.perf_counter_ns()
             data.createEpoch(protocol_object)
+            self.scheduler.recordStage('create_epoch', t0, epoch)
 
         # Send triggering TTL through the DAQ device (if device is set)
         if client.daq_device is not None:
+            t0 = self.clock.perf_counter_ns()
             client.daq_device.sendTrigger()
+            self.scheduler.recordStage('daq_trigger', t0, epoch)
 
         client.manager.print_on_server(f'Epoch {protocol_object.num_epochs_completed}')
 
         # Use the protocol object to send the stimulus to flystim
-        protocol_object.loadStimuli(client)
+        if not self.prefetched:
+            t0 = self.clock.perf_counter_ns()
+            protocol_object.loadStimuli(client)
+            self.scheduler.recordStage('load_stimuli', t0, epoch)
+        self.prefetched = False
 
         protocol_object.startStimuli(client)
 
         client.manager.print_on_server('Epoch completed.')
 
         if save_metadata_flag:
+            t0 = self.clock.perf_counter_ns()
             data.endEpoch(protocol_object)
+            self.scheduler.recordStage('end_epoch', t0, epoch)
 
         protocol_object.advanceEpochCounter()
+
+    def prefetchNextEpoch(self, protocol_object, client):
+        """
+        Get the next epoch's parameters and load its stimuli onto flystim, so the next
+        epoch only has to start them. Called by protocol_object.startStimuli during tail_time
+        """
+        if self.stop or (protocol_object.num_epochs_completed + 1) >= protocol_object.run_parameters['num_epochs']:
+            return
+
+        protocol_object.num_epochs_completed += 1  # parameters are drawn for the next epoch
+        epoch = protocol_object.num_epochs_completed
+        rpc_monitor = getattr(client, 'rpc_monitor', None)
+        if rpc_monitor is not None:
+            rpc_monitor.epoch = epoch
+        try:
+            t0 = self.clock.perf_counter_ns()
+            protocol_object.getEpochParameters()
+            self.scheduler.recordStage('get_epoch_parameters', t0, epoch)
+            t0 = self.clock.perf_counter_ns()
+            protocol_object.loadStimuli(client)
+            self.scheduler.recordStage('load_stimuli', t0, epoch)
+        finally:
+            protocol_object.num_epochs_completed -= 1
+            if rpc_monitor is not None:
+                rpc_monitor.epoch = epoch - 1
+        self.prefetched = True
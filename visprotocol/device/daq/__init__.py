@@ -1,2 +1 @@
-from .daq import DAQ, DAQonServer
-from . import nidaq
+from .daq import DAQ, DAQonServer, createDAQ
@@ -7,6 +7,7 @@ DAQ (data acquisition) device classes
 """
 
 from flyrpc.multicall import MyMultiCall
+import importlib
 import threading
 
 class DAQ():
@@ -66,3 +67,19 @@ class DAQonServer(DAQ):
             return multicall
         if self.manager is not None:
             self.manager.daq_streamWithTiming(**kwargs)
+
+
+def createDAQ(daq_options):
+    '''
+    Make a DAQ device from a rig's daq options: {'class': 'nidaq.NIUSB6210', 'kwargs': {...}}, or {'class': 'DAQonServer'}.
+    Driver modules (nidaq, labjack) are imported here, so they are only needed on rigs that use them.
+    '''
+    if daq_options is None:
+        return None
+    class_path = daq_options['class']
+    if '.' in class_path:
+        module_name, class_name = class_path.rsplit('.', 1)
+        daq_class = getattr(importlib.import_module('visprotocol.device.daq.' + module_name), class_name)
+    else:
+        daq_class = globals()[class_path]
+    return daq_class(**daq_options.get('kwargs', {}))
@@ -1 +1 @@
-from .loco_managers import LocoManager, LocoClosedLoopManager
\ No newline at end of file
+from .loco_managers import LocoManager, LocoSocketManager, LocoClosedLoopManager
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of loco socket framing and FicTrac line parsing, in frames/sec
+
+FicTrac-like lines are streamed through a local socket pair in fragments of random size
+(as TCP may deliver them), and read back with LocoSocketManager.get_line_bytes and
+FtFrameParser.parse_line. The previous str-buffer framing and parser are timed alongside
+for comparison, as is batch parsing of the same lines with FtFrameParser.parse_lines.
+
+    python -m visprotocol.loco_managers.benchmark_loco_socket --frames 200000
+"""
+import argparse
+import random
+import select
+import socket
+import threading
+from time import perf_counter
+
+from visprotocol.loco_managers import LocoSocketManager
+from visprotocol.loco_managers.fictrac_managers import FtFrameParser, FT_FRAME_NUM_IDX, FT_X_IDX, FT_Y_IDX, FT_THETA_IDX, FT_TIMESTAMP_IDX
+
+
+def makeFicTracLines(num_frames):
+    lines = []
+    for frame_num in range(num_frames):
+        fields = ['{:.6f}'.format(random.uniform(-3, 3)) for _ in range(25)]
+        fields[FT_FRAME_NUM_IDX] = str(frame_num)
+        fields[FT_TIMESTAMP_IDX] = '{:.3f}'.format(1.7e12 + frame_num * 2.0)
+        lines.append('FT, ' + ', '.join(fields) + '\n')
+    return ''.join(lines).encode('UTF-8')
+
+
+def sendFragments(sock, data, max_fragment):
+    ind = 0
+    while ind < len(data):
+        fragment_size = random.randint(1, max_fragment)
+        sock.sendall(data[ind:ind + fragment_size])
+        ind += fragment_size
+    sock.shutdown(socket.SHUT_WR)
+
+
+class LegacyLineReader():
+    """
+    The previous LocoSocketManager.get_line: decode each recv to str, append, slice, recurse.
+    It receives before looking for a buffered line, so when data arrives faster than one line
+    per recv the buffer (and the cost of each slice) keeps growing
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock_buffer = ""
+
+    def get_line(self):
+        select.select([self.sock], [], [])
+        new_data = self.sock.recv(4096)
+        if not new_data and "\n" not in self.sock_buffer:
+            return None
+        self.sock_buffer += new_data.decode('UTF-8')
+        endline = self.sock_buffer.find("\n")
+        if endline == -1:
+            return self.get_line()
+        line = self.sock_buffer[:endline]
+        self.sock_buffer = self.sock_buffer[endline+1:]
+        return line
+
+
+def parseLegacy(line):
+    toks = line.split(", ")
+    toks.pop(0)
+    return (int(toks[FT_FRAME_NUM_IDX]), float(toks[FT_TIMESTAMP_IDX]), -float(toks[FT_THETA_IDX]), float(toks[FT_X_IDX]), float(toks[FT_Y_IDX]))
+
+
+def runBenchmark(name, data, num_frames, max_fragment, read_frame):
+    rx, tx = socket.socketpair()
+    sender = threading.Thread(target=sendFragments, args=(tx, data, max_fragment), daemon=True)
+    t0 = perf_counter()
+    sender.start()
+    frames = read_frame(rx, num_frames)
+    elapsed = perf_counter() - t0
+    sender.join()
+    rx.close()
+    tx.close()
+    assert frames == num_frames, '{}: read {} of {} frames'.format(name, frames, num_frames)
+    print('{:<40}{:>12.0f} frames/sec'.format(name, num_frames / elapsed))
+
+
+def readLegacy(rx, num_frames):
+    reader = LegacyLineReader(rx)
+    frames = 0
+    while frames < num_frames:
+        line = reader.get_line()
+        if line is None:
+            break
+        parseLegacy(line)
+        frames += 1
+    return frames
+
+
+def readBuffered(rx, num_frames):
+    socket_manager = LocoSocketManager(host=None, port=None, udp=False)
+    socket_manager.sock = rx
+    parser = FtFrameParser()
+    frames = 0
+    while frames < num_frames:
+        line = socket_manager.get_line_bytes()
+        if line is None:
+            break
+        parser.parse_line(line)
+        frames += 1
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loco socket framing and FicTrac parsing')
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--legacy_frames', type=int, default=5000, help='frames for the legacy reader, whose cost grows with its backlog')
+    parser.add_argument('--max_fragment', type=int, default=1500, help='max bytes per send, to mimic fragmented TCP')
+    args = parser.parse_args()
+
+    print('Fragments of 1-{} bytes'.format(args.max_fragment))
+    for name, num_frames, read_frame in [('legacy str framing', min(args.legacy_frames, args.frames), readLegacy),
+                                         ('bytearray framing', args.frames, readBuffered)]:
+        data = makeFicTracLines(num_frames)
+        runBenchmark('{} ({} frames)'.format(name, num_frames), data, num_frames, args.max_fragment, read_frame)
+
+    lines = makeFicTracLines(args.frames).split(b'\n')[:-1]
+    t0 = perf_counter()
+    frames = FtFrameParser().parse_lines(lines)
+    print('{:<40}{:>12.0f} frames/sec'.format('batch parse ({} frames)'.format(len(frames)), len(frames) / (perf_counter() - t0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ import random
 import shutil
 from time import sleep
 
+import numpy as np
+
 from visprotocol.loco_managers import LocoManager, LocoClosedLoopManager
 
 FT_FRAME_NUM_IDX = 0
@@ -13,6 +15,12 @@ FT_Y_IDX = 15
 FT_THETA_IDX = 16
 FT_TIMESTAMP_IDX = 21
 
+FT_FRAME_DTYPE = np.dtype([('frame_num', 'i8'),
+                           ('ts', 'f8'),
+                           ('theta', 'f8'),
+                           ('x', 'f8'),
+                           ('y', 'f8')])
+
 FICTRAC_HOST = '127.0.0.1'  # The server's hostname or IP address
 FICTRAC_PORT = 33334         # The port used by the server
 FICTRAC_BIN =    os.path.join(os.path.expanduser("~"), "src/fictrac/bin/fictrac")
@@ -62,10 +70,18 @@ class FtManager(LocoManager):
             else:
                 print("Moving Fictrac files then deleting.")
                 os.makedirs(self.save_directory, exist_ok=True)
-                while os.listdir(self.cwd):
-                    for fn in os.listdir(self.cwd):
-                        shutil.move(os.path.join(self.cwd, fn), self.save_directory)
-                shutil.rmtree(self.cwd)
+                # Fictrac has exited, so its files are complete: move each once
+                moved_all = True
+                for fn in os.listdir(self.cwd):
+                    try:
+                        shutil.move(os.path.join(self.cwd, fn), os.path.join(self.save_directory, fn))
+                    except OSError as e:
+                        moved_all = False
+                        print('Could not move Fictrac file {}: {}'.format(fn, e))
+                if moved_all:
+                    shutil.rmtree(self.cwd)
+                else:
+                    print('Leaving unmoved Fictrac files in {}'.format(self.cwd))
 
         else:
             print("Fictrac hasn't been started yet. Cannot be closed.")
@@ -73,15 +89,97 @@ class FtManager(LocoManager):
     def sleep(self, duration):
         sleep(duration)
 
+class FtFrameParser():
+    '''
+    Parses FicTrac frames (lines of ', '-separated values), converting only the columns in FT_FRAME_DTYPE.
+    Lines from the FicTrac socket start with "FT"; lines in FicTrac's .dat output files have no prefix (prefix=None).
+    Column indices count from the first value after the prefix. theta is negated, as in FtClosedLoopManager.
+
+    parse_line(line) -> dict for one frame (or None for a bad line)
+    parse_lines(lines) -> FT_FRAME_DTYPE array for a block of lines, skipping bad lines
+    A bad line has the wrong prefix, too few values, or a value that does not convert
+    '''
+    def __init__(self, frame_num_idx=FT_FRAME_NUM_IDX, ts_idx=FT_TIMESTAMP_IDX, theta_idx=FT_THETA_IDX, x_idx=FT_X_IDX, y_idx=FT_Y_IDX, prefix=b"FT"):
+        self.prefix = prefix
+        offset = 0 if prefix is None else 1
+        self.columns = [('frame_num', frame_num_idx + offset),
+                        ('ts', ts_idx + offset),
+                        ('theta', theta_idx + offset),
+                        ('x', x_idx + offset),
+                        ('y', y_idx + offset)]
+        self.num_tokens = max([idx for _, idx in self.columns]) + 1
+        self.maxsplit = self.num_tokens  # split no further than the last column used
+        self.frame_num_tok, self.ts_tok, self.theta_tok, self.x_tok, self.y_tok = [idx for _, idx in self.columns]
+
+    def parse_line(self, line):
+        if isinstance(line, str):
+            line = line.encode('UTF-8')
+        toks = line.split(b", ", self.maxsplit)
+        if (self.prefix is not None and toks[0] != self.prefix) or len(toks) < self.num_tokens:
+            return None
+        try:
+            return {'theta': -float(toks[self.theta_tok]),
+                    'x': float(toks[self.x_tok]),
+                    'y': float(toks[self.y_tok]),
+                    'z': 0,
+                    'frame_num': int(toks[self.frame_num_tok]),
+                    'ts': float(toks[self.ts_tok])}
+        except ValueError:
+            return None
+
+    def parse_lines(self, lines):
+        rows = [line.split(b", ", self.maxsplit) for line in lines]
+        rows = [toks for toks in rows if len(toks) >= self.num_tokens and (self.prefix is None or toks[0] == self.prefix)]
+        try:
+            return self._convert_rows(rows)
+        except (ValueError, OverflowError):  # a value that does not convert: drop the rows it is in and convert the rest
+            return self._convert_rows([toks for toks in rows if self._row_converts(toks)])
+
+    def _row_converts(self, toks):
+        try:
+            for name, idx in self.columns:
+                np.array((int if name == 'frame_num' else float)(toks[idx]), dtype=FT_FRAME_DTYPE[name])
+        except (ValueError, OverflowError):
+            return False
+        return True
+
+    def _convert_rows(self, rows):
+        frames = np.empty(len(rows), dtype=FT_FRAME_DTYPE)
+        for name, idx in self.columns:
+            convert = int if name == 'frame_num' else float
+            frames[name] = np.fromiter((convert(toks[idx]) for toks in rows), dtype=FT_FRAME_DTYPE[name], count=len(rows))
+        frames['theta'] *= -1
+        return frames
+
+
+def read_fictrac_dat(file_path, block_lines=100000, **parser_kwargs):
+    '''
+    Read a FicTrac .dat output file (e.g. from a series' loco directory) into an FT_FRAME_DTYPE array.
+    parser_kwargs are FtFrameParser column indices, if FicTrac was configured differently
+    '''
+    parser = FtFrameParser(prefix=None, **parser_kwargs)
+    blocks = []
+    with open(file_path, 'rb') as dat_file:
+        while True:
+            lines = dat_file.readlines(block_lines * 256)  # size hint, in bytes
+            if not lines:
+                break
+            blocks.append(parser.parse_lines([line.rstrip(b"\r\n") for line in lines]))
+    if len(blocks) == 0:
+        return np.empty(0, dtype=FT_FRAME_DTYPE)
+    return np.concatenate(blocks)
+
+
 class FtClosedLoopManager(LocoClosedLoopManager):
-    def __init__(self, fs_manager, host=FICTRAC_HOST, port=FICTRAC_PORT, save_directory=None, start_at_init=False, udp=True, ft_bin=FICTRAC_BIN, ft_config=FICTRAC_CONFIG, ft_theta_idx=FT_THETA_IDX, ft_x_idx=FT_X_IDX, ft_y_idx=FT_Y_IDX, ft_frame_num_idx=FT_FRAME_NUM_IDX, ft_timestamp_idx=FT_TIMESTAMP_IDX):
-        super().__init__(fs_manager=fs_manager, host=host, port=port, save_directory=save_directory, start_at_init=False, udp=udp)
+    def __init__(self, fs_manager, host=FICTRAC_HOST, port=FICTRAC_PORT, save_directory=None, start_at_init=False, udp=True, latest_only=False, record_frames=True, max_update_rate=120, ft_bin=FICTRAC_BIN, ft_config=FICTRAC_CONFIG, ft_theta_idx=FT_THETA_IDX, ft_x_idx=FT_X_IDX, ft_y_idx=FT_Y_IDX, ft_frame_num_idx=FT_FRAME_NUM_IDX, ft_timestamp_idx=FT_TIMESTAMP_IDX):
+        super().__init__(fs_manager=fs_manager, host=host, port=port, save_directory=save_directory, start_at_init=False, udp=udp, latest_only=latest_only, record_frames=record_frames, max_update_rate=max_update_rate)
 
         self.ft_frame_num_idx = ft_frame_num_idx
         self.ft_timestamp_idx = ft_timestamp_idx
         self.ft_theta_idx = ft_theta_idx
         self.ft_x_idx = ft_x_idx
         self.ft_y_idx = ft_y_idx
+        self.ft_parser = FtFrameParser(frame_num_idx=ft_frame_num_idx, ts_idx=ft_timestamp_idx, theta_idx=ft_theta_idx, x_idx=ft_x_idx, y_idx=ft_y_idx)
         self.ft_manager = FtManager(ft_bin=ft_bin, ft_config=ft_config, save_directory=save_directory, start_at_init=False)
 
         if start_at_init:    self.start()
@@ -99,20 +197,10 @@ class FtClosedLoopManager(LocoClosedLoopManager):
         self.ft_manager.close()
 
     def _parse_line(self, line):
-        toks = line.split(", ")
-
-        # Fictrac lines always starts with FT
-        if toks.pop(0) != "FT":
+        data = self.ft_parser.parse_line(line)
+        if data is None:
             print('Bad read')
-            return None
-        
-        frame_num = int(toks[self.ft_frame_num_idx])
-        ts = float(toks[self.ft_timestamp_idx])
-
-        theta = -float(toks[self.ft_theta_idx])
-        x = float(toks[self.ft_x_idx])
-        y = float(toks[self.ft_y_idx])
-        z = 0
-        
-        return {'theta': theta, 'x': x, 'y': y, 'z':z, 'frame_num': frame_num, 'ts': ts}
-    
+        return data
+
+    def _parse_lines(self, lines):
+        return self.ft_parser.parse_lines(lines)
@@ -3,20 +3,130 @@ import socket, select
 import threading
 import json
 from math import degrees
-from time import time, sleep
+from time import time, sleep, perf_counter
+
+import numpy as np
+
+LOCO_FRAME_DTYPE = np.dtype([('frame_num', 'i8'),
+                             ('ts', 'f8'),  # loco source (e.g. FicTrac) timestamp
+                             ('theta', 'f8'),
+                             ('x', 'f8'),
+                             ('y', 'f8'),
+                             ('host_time', 'f8')])  # unix time the frame was received, on the loco machine's clock
+
+CLOCK_SYNC_DTYPE = np.dtype([('client_time', 'f8'),  # unix time sent by the client, on its clock
+                             ('host_time', 'f8')])  # unix time it was received, on the loco machine's clock
 
 class LocoManager():
     def __init__(self) -> None:
         pass
 
+class LocoFrameRecorder():
+    '''
+    Records loco frames into a preallocated buffer, appended to the 'frames' dataset
+    (LOCO_FRAME_DTYPE, chunked and resizable) of an HDF5 file when full or every flush_interval sec.
+    Frames for an epoch are the slice of frames['host_time'] between its start and end unix times.
+    host_time is the loco (stim server) machine's clock, and epoch times are the client's, so the
+    'clock_sync' dataset holds (client_time, host_time) pairs, one per series (see sync_clock).
+    Subtract host_time - client_time from frame host_times to compare them with epoch times
+    Frames skipped in latest_only mode arrive in a backlog and have host_time NaN; their time can be
+    interpolated from ts, between the neighbouring frames that have a host_time
+    '''
+    def __init__(self, file_path, buffer_frames=1000, flush_interval=1.0):
+        import h5py
+        self.file_path = file_path
+        self.buffer = np.zeros(buffer_frames, dtype=LOCO_FRAME_DTYPE)
+        self.buffer_count = 0
+        self.flush_interval = flush_interval
+        self.last_flush = time()
+        self.lock = threading.Lock()
+
+        self.file = h5py.File(file_path, 'a')
+        if 'frames' not in self.file:
+            self.file.create_dataset('frames', shape=(0,), maxshape=(None,), dtype=LOCO_FRAME_DTYPE, chunks=(buffer_frames,))
+        self.dataset = self.file['frames']
+
+    def record(self, data, host_time):
+        with self.lock:
+            row = self.buffer[self.buffer_count]
+            row['frame_num'] = data['frame_num']
+            row['ts'] = data['ts']
+            row['theta'] = data['theta']
+            row['x'] = data['x']
+            row['y'] = data['y']
+            row['host_time'] = host_time
+            self.buffer_count += 1
+            if self.buffer_count == len(self.buffer) or (host_time - self.last_flush) > self.flush_interval:
+                self._flush()
+
+    def record_frames(self, frames, host_time=np.nan):
+        '''
+        Record a structured array of frames (e.g. from FtFrameParser.parse_lines), all with host_time
+        '''
+        with self.lock:
+            start = 0
+            while start < len(frames):
+                num_frames = min(len(frames) - start, len(self.buffer) - self.buffer_count)
+                rows = self.buffer[self.buffer_count:self.buffer_count + num_frames]
+                for name in ('frame_num', 'ts', 'theta', 'x', 'y'):
+                    rows[name] = frames[name][start:start + num_frames]
+                rows['host_time'] = host_time
+                self.buffer_count += num_frames
+                start += num_frames
+                if self.buffer_count == len(self.buffer):
+                    self._flush()
+
+    def record_clock_sync(self, client_time, host_time):
+        with self.lock:
+            if 'clock_sync' not in self.file:
+                self.file.create_dataset('clock_sync', shape=(0,), maxshape=(None,), dtype=CLOCK_SYNC_DTYPE, chunks=(64,))
+            clock_sync = self.file['clock_sync']
+            clock_sync.resize((clock_sync.shape[0] + 1,))
+            clock_sync[-1] = (client_time, host_time)
+            self.file.flush()
+
+    def _flush(self):
+        if self.buffer_count > 0:
+            num_frames = self.dataset.shape[0]
+            self.dataset.resize((num_frames + self.buffer_count,))
+            self.dataset[num_frames:] = self.buffer[:self.buffer_count]
+            self.file.flush()
+            self.buffer_count = 0
+        self.last_flush = time()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+
+def read_loco_frames(file_path):
+    '''
+    All frames recorded by a LocoFrameRecorder, as a LOCO_FRAME_DTYPE array
+    '''
+    import h5py
+    with h5py.File(file_path, 'r') as file:
+        return file['frames'][:]
+
+
 class LocoSocketManager():
-    def __init__(self, host, port, udp=True) -> None:
+    def __init__(self, host, port, udp=True, buffer_size=65536, recv_size=4096) -> None:
         self.host = host
         self.port = port
         self.udp = udp
 
         self.sock = None
-        self.sock_buffer = ""
+        # Received bytes are framed in place: sock_buffer[buffer_start:buffer_end] holds data not yet returned as lines.
+        # Consumed bytes are only reclaimed (by moving the remainder to the front) when there is no room to receive.
+        self.recv_size = recv_size
+        self.sock_buffer = bytearray(max(buffer_size, 2 * recv_size))
+        self.buffer_view = memoryview(self.sock_buffer)
+        self.buffer_start = 0
+        self.buffer_end = 0
         self.data_prev = []
 
     def connect(self):
@@ -31,31 +141,32 @@ class LocoSocketManager():
             # TODO: Maybe need to listen for connection? This should be a server, receiving requests from locomotion source (e.g. Fictrac)
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((self.host, self.port))
+        self.buffer_start = 0
+        self.buffer_end = 0
 
     def close(self):
         if self.sock is not None:
             self.sock.close()
 
-    def get_line(self, wait_for=None):
+    def _make_room(self):
         '''
-        Assumes that lines are separated by '\n'
+        Make room for one recv_size read at the end of the buffer
         '''
-        if self.sock is None:
+        if len(self.sock_buffer) - self.buffer_end >= self.recv_size:
             return
-        
-        ##
-        # if wait_for is None:
-        #     ready = select.select([self.sock], [], [])[0]
-        # else:
-        #     ready = select.select([self.sock], [], [], wait_for)[0]
-
-        # if ready:
-        #     new_data = self.sock.recv(4096)
-        # else:
-        #     return self.get_line(wait_for=wait_for)
-        ##
-
-        ##
+        pending = self.buffer_end - self.buffer_start
+        if pending > len(self.sock_buffer) - self.recv_size:  # a "line" longer than the buffer: not line-delimited data
+            print('Loco socket buffer overflow: dropping {} bytes'.format(pending))
+            pending = 0
+        else:
+            self.sock_buffer[:pending] = self.buffer_view[self.buffer_start:self.buffer_end]
+        self.buffer_start = 0
+        self.buffer_end = pending
+
+    def _recv(self, wait_for=None):
+        '''
+        Wait for the socket to be readable, then receive into the buffer. Returns the number of bytes received
+        '''
         ready = []
         while not ready:
             if self.sock == -1:
@@ -65,33 +176,131 @@ class LocoSocketManager():
                 ready = select.select([self.sock], [], [])[0]
             else:
                 ready = select.select([self.sock], [], [], wait_for)[0]
-        new_data = self.sock.recv(4096)
-        ##
 
-        if not new_data and not self.udp: # TCP and blank new_data...
-            print('\nDisconnected from TCP server.')
-            return None
+        return self._recv_into_buffer()
+
+    def _recv_into_buffer(self):
+        self._make_room()
+        num_bytes = self.sock.recv_into(self.buffer_view[self.buffer_end:], self.recv_size)
+        self.buffer_end += num_bytes
+        return num_bytes
+
+    def _drop_complete_lines(self, skipped_lines=None):
+        '''
+        Discard all complete lines but the newest, appending them to skipped_lines if given. Returns the number discarded
+        '''
+        last_end = self.sock_buffer.rfind(b"\n", self.buffer_start, self.buffer_end)
+        if last_end == -1:
+            return 0
+        prev_end = self.sock_buffer.rfind(b"\n", self.buffer_start, last_end)
+        if prev_end == -1:
+            return 0
+        num_dropped = self.sock_buffer.count(b"\n", self.buffer_start, prev_end + 1)
+        if skipped_lines is not None:
+            skipped_lines.extend(bytes(self.buffer_view[self.buffer_start:prev_end]).split(b"\n"))
+        self.buffer_start = prev_end + 1
+        return num_dropped
+
+    def _wait_for_line(self, wait_for=None):
+        '''
+        Receive until the buffer holds a complete line. Returns the index of its '\n', or None if disconnected
+        '''
+        endline = self.sock_buffer.find(b"\n", self.buffer_start, self.buffer_end)
+        while endline == -1:
+            num_bytes = self._recv(wait_for=wait_for)
+            if num_bytes is None:
+                return None
+            if num_bytes == 0 and not self.udp: # TCP and blank new_data...
+                print('\nDisconnected from TCP server.')
+                return None
+            # only the new data can hold the newline
+            search_start = max(self.buffer_end - num_bytes, self.buffer_start)
+            endline = self.sock_buffer.find(b"\n", search_start, self.buffer_end)
+        return endline
 
-        # Decode received data
-        self.sock_buffer += new_data.decode('UTF-8')
+    def _recv_waiting(self, skipped_lines=None):
+        '''
+        Receive everything already waiting on the socket, then discard all complete lines but the newest
+        (see _drop_complete_lines). Returns the number of lines discarded
+        '''
+        num_skipped = 0
+        while select.select([self.sock], [], [], 0)[0]:
+            if len(self.sock_buffer) - self.buffer_end < self.recv_size:
+                num_skipped += self._drop_complete_lines(skipped_lines)  # keep the backlog from overflowing the buffer
+            try:
+                num_bytes = self._recv_into_buffer()
+            except BlockingIOError:
+                break
+            if num_bytes == 0 and not self.udp: # TCP and blank new_data...
+                break
+        num_skipped += self._drop_complete_lines(skipped_lines)
+        return num_skipped
+
+    def get_line_bytes(self, wait_for=None):
+        '''
+        Next line received, as bytes without the '\n'. Assumes that lines are separated by '\n'
+        '''
+        if self.sock is None:
+            return
 
-        # Find the first frame of data
-        endline = self.sock_buffer.find("\n")
-        if endline == -1:
-            return self.get_line(wait_for=wait_for)
-        line = self.sock_buffer[:endline]       # copy first frame
-        self.sock_buffer = self.sock_buffer[endline+1:]     # delete first frame
+        endline = self._wait_for_line(wait_for=wait_for)
+        if endline is None:
+            return None
 
+        line = bytes(self.buffer_view[self.buffer_start:endline])  # copy first frame
+        self.buffer_start = endline + 1                             # consume first frame
+        if self.buffer_start == self.buffer_end:
+            self.buffer_start = self.buffer_end = 0
         return line
 
+    def get_latest_line_bytes(self, wait_for=None, skipped_lines=None):
+        '''
+        Newest complete line, after receiving everything already waiting on the socket. Older lines are discarded
+        (or appended to skipped_lines, if given). Waits for a line if none is complete.
+        Returns (line, num_skipped): the line as bytes without the '\n', and the number of lines discarded
+        '''
+        if self.sock is None:
+            return None, 0
+
+        num_skipped = self._recv_waiting(skipped_lines)
+        if self.sock_buffer.find(b"\n", self.buffer_start, self.buffer_end) == -1:
+            if self._wait_for_line(wait_for=wait_for) is None:
+                return None, num_skipped
+            # the wait may have received several lines (or more may have arrived since): keep only the newest
+            num_skipped += self._recv_waiting(skipped_lines)
+
+        return self.get_line_bytes(), num_skipped
+
+    def data_ready(self, timeout=0):
+        '''
+        True if a complete line is buffered, or the socket becomes readable within timeout sec
+        '''
+        if self.sock is None:
+            return False
+        if self.sock_buffer.find(b"\n", self.buffer_start, self.buffer_end) != -1:
+            return True
+        return len(select.select([self.sock], [], [], max(timeout, 0))[0]) > 0
+
+    def get_line(self, wait_for=None):
+        '''
+        Next line received, as str. Assumes that lines are separated by '\n'
+        '''
+        line = self.get_line_bytes(wait_for=wait_for)
+        if line is None:
+            return None
+        return line.decode('UTF-8')
+
 class LocoClosedLoopManager():
-    def __init__(self, fs_manager, host, port, save_directory=None, start_at_init=False, udp=True) -> None:
+    def __init__(self, fs_manager, host, port, save_directory=None, start_at_init=False, udp=True, latest_only=False, record_frames=True, max_update_rate=120) -> None:
         super().__init__()
         self.fs_manager = fs_manager
         self.socket_manager = LocoSocketManager(host=host, port=port, udp=udp)
         
         self.save_directory = save_directory
         self.log_file = None
+        self.record_frames = record_frames  # record every frame to frames.h5 in save_directory
+        self.frame_recorder = None
+        self.recorder_lock = threading.Lock()  # the loop thread records while close() may run on another thread
 
         self.data_prev = []
         self.pos_0 = {'theta': 0, 'x': 0, 'y': 0, 'z': 0}
@@ -103,8 +312,17 @@ class LocoClosedLoopManager():
             'update_theta': True,
             'update_x': False,
             'update_y': False,
-            'update_z': False
+            'update_z': False,
+            'latest_only': latest_only  # each loop iteration uses only the newest frame, skipping any backlog
         }
+        self.frame_stats = {'frames': 0, 'skipped': 0, 'dropped': 0}  # for latest_only loops
+        self.frame_num_prev = None
+
+        self.max_update_rate = max_update_rate  # Hz. Cap on pose updates sent to flystim, e.g. the display refresh rate. None for no cap
+        self.last_update_time = None
+        self.pending_pose = None  # newest pose held back by the rate cap, sent once the cap allows
+        self.fly_pos = {'x': 0, 'y': 0, 'z': 0}  # last fly position sent to flystim
+        self.pose_stats = {'updates': 0, 'skipped_updates': 0}
 
         if start_at_init:
             self.start()
@@ -119,6 +337,9 @@ class LocoClosedLoopManager():
             os.makedirs(self.save_directory, exist_ok=True)
             log_path = os.path.join(self.save_directory, 'log.txt')
             self.log_file = open(log_path, "a")
+            if self.record_frames:
+                with self.recorder_lock:
+                    self.frame_recorder = LocoFrameRecorder(os.path.join(self.save_directory, 'frames.h5'))
 
         self.started = True
 
@@ -132,21 +353,95 @@ class LocoClosedLoopManager():
             self.log_file.flush()
             self.log_file.close()
             self.log_file = None
+
+        with self.recorder_lock:
+            self._close_frame_recorder()
             
         self.started = False
 
+    def _close_frame_recorder(self):
+        if self.frame_recorder is not None:
+            try:
+                self.frame_recorder.close()
+            except Exception as e:
+                print('Could not close loco frame recorder: {}'.format(e))
+            self.frame_recorder = None
+
+    def _record(self, data, host_time, skipped_lines=None):
+        '''
+        Record data and any skipped lines (parsed in one batch, with host_time NaN) to the frame recorder.
+        A recording error is printed and stops recording, so it never breaks the loop
+        '''
+        with self.recorder_lock:
+            if self.frame_recorder is None:
+                return
+            try:
+                if skipped_lines:
+                    self.frame_recorder.record_frames(self._parse_lines(skipped_lines))
+                if data is not None:
+                    self.frame_recorder.record(data, host_time)
+            except Exception as e:
+                print('Loco frame recording failed, recording stopped: {}'.format(e))
+                self._close_frame_recorder()
+
     def get_data(self, wait_for=None):
-        line = self.socket_manager.get_line(wait_for=wait_for)
+        line = self.socket_manager.get_line_bytes(wait_for=wait_for)
+        host_time = time()
         
         data = self._parse_line(line)
         self.data_prev = data
 
+        self._record(data, host_time)
+
+        return data
+
+    def get_latest_data(self, wait_for=None):
+        '''
+        Data from the newest frame received, discarding older frames. Counts skipped frames (discarded here)
+        and dropped frames (gaps in frame_num, e.g. lost UDP packets) in self.frame_stats
+        '''
+        skipped_lines = [] if self.frame_recorder is not None else None
+        line, num_skipped = self.socket_manager.get_latest_line_bytes(wait_for=wait_for, skipped_lines=skipped_lines)
+        host_time = time()
+
+        data = self._parse_line(line)
+        self.data_prev = data
+
+        self._record(data, host_time, skipped_lines)  # skipped frames are still recorded
+
+        self.frame_stats['frames'] += 1
+        self.frame_stats['skipped'] += num_skipped
+        if data is not None:
+            frame_num = int(data['frame_num'])
+            if self.frame_num_prev is not None:
+                self.frame_stats['dropped'] += max(frame_num - self.frame_num_prev - 1 - num_skipped, 0)
+            self.frame_num_prev = frame_num
+
         return data
+
+    def _parse_lines(self, lines):
+        '''
+        Parse a block of lines into a LOCO_FRAME_DTYPE array, skipping bad lines. Inheriting classes can parse in bulk
+        '''
+        parsed = [self._parse_line(line) for line in lines]
+        parsed = [data for data in parsed if data is not None]
+        frames = np.zeros(len(parsed), dtype=LOCO_FRAME_DTYPE)
+        for name in ('frame_num', 'ts', 'theta', 'x', 'y'):
+            frames[name] = [data[name] for data in parsed]
+        return frames
+
+    def reset_frame_stats(self):
+        self.frame_stats = {'frames': 0, 'skipped': 0, 'dropped': 0}
+        self.frame_num_prev = None
+        self.pose_stats = {'updates': 0, 'skipped_updates': 0}
+
+    def get_frame_stats(self):
+        return dict(self.frame_stats)
     
     def _parse_line(self, line):
         # TODO: Check line and parse line
 
-        toks = line.split(", ")
+        toks = line.split(b", ")
         
         print("Please implement __parse_line in the inheriting class!")
 
@@ -168,6 +463,7 @@ class LocoClosedLoopManager():
         '''
         self.fs_manager.set_global_theta_offset(0) #radians
         self.fs_manager.set_global_fly_pos(0, 0, 0)
+        self.fly_pos = {'x': 0, 'y': 0, 'z': 0}
 
         if None in [theta_0, x_0, y_0, z_0]:
             if use_data_prev and len(self.data_prev)!=0:
@@ -186,6 +482,7 @@ class LocoClosedLoopManager():
             frame_num = -1
             ts = None
 
+        self.pending_pose = None  # relative to the old position 0
         self.pos_0['theta'] = theta_0
         self.pos_0['x']     = x_0
         self.pos_0['y']     = y_0
@@ -197,37 +494,89 @@ class LocoClosedLoopManager():
             log_line = json.dumps({'set_pos_0': {'frame_num': frame_num, 'theta': theta_0, 'x': x_0, 'y': y_0, 'z': z_0}, 'ts': ts})
             self.write_to_log(log_line)
     
+    def sync_clock(self, client_time):
+        '''
+        Record the client's unix time next to this machine's, to relate frame host_times to the
+        client's epoch times. The offset includes the one-way latency of the call that sent client_time
+        '''
+        host_time = time()
+        with self.recorder_lock:
+            if self.frame_recorder is not None:
+                try:
+                    self.frame_recorder.record_clock_sync(client_time, host_time)
+                except Exception as e:
+                    print('Could not record loco clock sync: {}'.format(e))
+        self.write_to_log(json.dumps({'clock_sync': {'client_time': client_time, 'host_time': host_time}}))
+
     def write_to_log(self, string):
         if self.log_file is not None:
             self.log_file.write(str(string) + "\n")
 
-    def update_pos(self, update_theta=True, update_x=False, update_y=False, update_z=False):
-        data = self.get_data()
+    def update_pos(self, update_theta=True, update_x=False, update_y=False, update_z=False, latest_only=False):
+        if self.pending_pose is not None and not self.socket_manager.data_ready(timeout=self._time_until_update_allowed()):
+            self.send_pending_pose()  # no new frame by the time the cap allows an update: send the held-back pose
+
+        data = self.get_latest_data() if latest_only else self.get_data()
 
         data_to_return = {}
         
         if update_theta:
-            theta = float(data['theta']) - self.pos_0['theta']
-            self.fs_manager.set_global_theta_offset(degrees(theta))
-            data_to_return['theta'] = theta #radians
+            data_to_return['theta'] = float(data['theta']) - self.pos_0['theta'] #radians
 
         if update_x:
-            x = float(data['x']) - self.pos_0['x']
-            self.fs_manager.set_global_fly_x(x)
-            data_to_return['x'] = x
+            data_to_return['x'] = float(data['x']) - self.pos_0['x']
 
         if update_y:
-            y = float(data['y']) - self.pos_0['y']
-            self.fs_manager.set_global_fly_y(y)
-            data_to_return['y'] = y
+            data_to_return['y'] = float(data['y']) - self.pos_0['y']
 
         if update_z:
-            z = float(data['z']) - self.pos_0['z']
-            self.fs_manager.set_global_fly_z(z)
-            data_to_return['z'] = z
+            data_to_return['z'] = float(data['z']) - self.pos_0['z']
+
+        if len(data_to_return) == 0:
+            return data_to_return
+
+        # Hold back updates faster than max_update_rate. Each update sets the absolute pose, so only the newest is kept
+        if self._time_until_update_allowed() > 0:
+            if self.pending_pose is not None:
+                self.pose_stats['skipped_updates'] += 1
+            self.pending_pose = data_to_return
+            return data_to_return
+
+        self.pending_pose = None
+        self._send_pose(data_to_return)
 
         return data_to_return
 
+    def _time_until_update_allowed(self):
+        if self.max_update_rate is None or self.last_update_time is None:
+            return 0
+        return self.last_update_time + 1 / self.max_update_rate - perf_counter()
+
+    def _send_pose(self, pose):
+        '''
+        Send pose to flystim in one request list: theta and the fly position, with position axes
+        not in pose kept at their last sent value. fs_manager is the stim server itself, so the
+        list goes to its request handler, which runs root functions and passes the rest to the screens
+        '''
+        request_list = []
+        if 'theta' in pose:
+            request_list.append({'name': 'set_global_theta_offset', 'args': [degrees(pose['theta'])], 'kwargs': {}})
+        if any(axis in pose for axis in ('x', 'y', 'z')):
+            self.fly_pos.update({axis: pose[axis] for axis in ('x', 'y', 'z') if axis in pose})
+            request_list.append({'name': 'set_global_fly_pos', 'args': [self.fly_pos['x'], self.fly_pos['y'], self.fly_pos['z']], 'kwargs': {}})
+        self.fs_manager.handle_request_list(request_list)
+        self.last_update_time = perf_counter()
+        self.pose_stats['updates'] += 1
+
+    def send_pending_pose(self):
+        '''
+        Send the pose held back by the rate cap, if any
+        '''
+        pose = self.pending_pose
+        if pose is not None:
+            self.pending_pose = None
+            self._send_pose(pose)
+
     def is_looping(self):
         return self.loop_attrs['looping']
 
@@ -239,13 +588,19 @@ class LocoClosedLoopManager():
                     _ = self.update_pos(update_theta = self.loop_attrs['update_theta'], 
                                         update_x     = self.loop_attrs['update_x'], 
                                         update_y     = self.loop_attrs['update_y'],
-                                        update_z     = self.loop_attrs['update_z'])
+                                        update_z     = self.loop_attrs['update_z'],
+                                        latest_only  = self.loop_attrs['latest_only'])
                 else:
-                    _ = self.get_data()
+                    self.send_pending_pose()  # closed loop was stopped with a pose held back
+                    if self.loop_attrs['latest_only']:
+                        _ = self.get_latest_data()
+                    else:
+                        _ = self.get_data()
 
         if self.loop_attrs['looping']:
             print("Already looping")
         else:
+            self.reset_frame_stats()
             self.loop_attrs['thread'] = threading.Thread(target=loop_helper, daemon=True)
             self.loop_attrs['thread'].start()
 
@@ -254,7 +609,23 @@ class LocoClosedLoopManager():
         self.loop_attrs['closed_loop'] = False
         if self.loop_attrs['thread'] is not None:
             self.loop_attrs['thread'].join(timeout=5)
+            if self.loop_attrs['thread'].is_alive():
+                print('Loco loop thread did not stop within 5 sec')  # e.g. blocked waiting for a frame
+            else:
+                self.send_pending_pose()
             self.loop_attrs['thread'] = None
+        if self.loop_attrs['latest_only'] and self.frame_stats['frames'] > 0:
+            print('Loco loop: {frames} frames used, {skipped} skipped, {dropped} dropped'.format(**self.frame_stats))
+            self.write_to_log(json.dumps({'frame_stats': self.frame_stats, 'ts': time()}))
+        if self.pose_stats['updates'] > 0:
+            print('Loco loop: {updates} pose updates sent, {skipped_updates} superseded while held back by the rate cap'.format(**self.pose_stats))
+            self.write_to_log(json.dumps({'pose_stats': self.pose_stats, 'ts': time()}))
+
+    def loop_set_latest_only(self, latest_only=True):
+        self.loop_attrs['latest_only'] = latest_only
+
+    def loop_set_max_update_rate(self, max_update_rate=120):
+        self.max_update_rate = max_update_rate
 
     def loop_start_closed_loop(self):
         self.loop_attrs['closed_loop'] = True
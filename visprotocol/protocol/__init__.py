@@ -1,5 +1,74 @@
-from . import (avery_protocol, berger_protocol, clandinin_protocol,
-               ej_protocol, emma_protocol, example_protocol, izs_protocol,
-               jh_protocol, lm_protocol, luke_protocol, mc_protocol,
-               mht_protocol, mmp_protocol, na_protocol, tac_protocol,
-               yw_protocol)
+"""
+Protocol modules, one per user: USER_protocol.py
+
+Modules are imported on first access (e.g. protocol.mht_protocol), so only the selected user's
+module and its dependencies are loaded. getProtocolNames lists a user's protocols from a cached
+index built by parsing the module source, without importing it.
+"""
+import ast
+import glob
+import importlib
+import json
+import os
+
+PROTOCOL_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PROTOCOL_INDEX_PATH = os.path.join(PROTOCOL_DIRECTORY, '__pycache__', 'protocol_index.json')
+
+
+def getProtocolModuleNames():
+    return sorted([os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(PROTOCOL_DIRECTORY, '*_protocol.py'))])
+
+
+def scanProtocolNames(module_path):
+    """
+    Names of the classes in module_path that directly subclass its BaseProtocol, in order of definition
+    """
+    with open(module_path, 'rb') as module_file:
+        tree = ast.parse(module_file.read(), filename=module_path)
+    return [node.name for node in tree.body if isinstance(node, ast.ClassDef)
+            and any(isinstance(base, ast.Name) and base.id == 'BaseProtocol' for base in node.bases)]
+
+
+def loadProtocolIndex():
+    try:
+        with open(PROTOCOL_INDEX_PATH, 'r') as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def saveProtocolIndex(protocol_index):
+    try:
+        os.makedirs(os.path.dirname(PROTOCOL_INDEX_PATH), exist_ok=True)
+        with open(PROTOCOL_INDEX_PATH, 'w') as index_file:
+            json.dump(protocol_index, index_file)
+    except OSError:
+        pass  # e.g. read-only install: the index is rebuilt next time
+
+
+def getProtocolNames(module_name):
+    """
+    Protocol class names in module_name (e.g. 'mht_protocol'), from the index. Modules whose file
+    changed since they were indexed are re-scanned
+    """
+    module_path = os.path.join(PROTOCOL_DIRECTORY, module_name + '.py')
+    module_stat = os.stat(module_path)
+    protocol_index = loadProtocolIndex()
+    entry = protocol_index.get(module_name)
+    if entry is None or entry['mtime_ns'] != module_stat.st_mtime_ns or entry['size'] != module_stat.st_size:
+        entry = {'mtime_ns': module_stat.st_mtime_ns,
+                 'size': module_stat.st_size,
+                 'protocols': scanProtocolNames(module_path)}
+        protocol_index[module_name] = entry
+        saveProtocolIndex(protocol_index)
+    return entry['protocols']
+
+
+def __getattr__(name):
+    if name in getProtocolModuleNames():
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + getProtocolModuleNames())
@@ -751,11 +751,11 @@ class WhiteNoiseWithOpto(BaseProtocol):
 
         if self.protocol_parameters['opto_mode'] == 'on':
             self.convenience_parameters['opto_stim'] = True
-            start_seed = int(np.random.choice(range(int(1e6))))
+            start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
         elif self.protocol_parameters['opto_mode'] == 'off':
             self.convenience_parameters['opto_stim'] = False
-            start_seed = int(np.random.choice(range(int(1e6))))
+            start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
         elif self.protocol_parameters['opto_mode'] == 'alternating':
             if np.mod(self.num_epochs_completed, 2) == 0:
@@ -764,7 +764,7 @@ class WhiteNoiseWithOpto(BaseProtocol):
                 self.convenience_parameters['opto_stim'] = True
             # Find seed s.t. subsequent trials share a seed. Increment seed every 2 trials
             if self.num_epochs_completed == 0:
-                self.fly_start_seed = int(np.random.choice(range(int(1e6))))
+                self.fly_start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
             start_seed = self.fly_start_seed + (self.num_epochs_completed//2)
         else:
@@ -845,11 +845,7 @@ class MedullaTuningSuite(BaseProtocol):
         super().__init__(cfg)
         self.cfg = cfg
         self.stim_list = ['ContrastReversingGrating']
-        n = [16]  # weight each stim draw by how many trial types it has. Total = 16
-        avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
-        all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
-
-        self.stim_order = np.random.permutation(np.hstack(all_stims))
+        self.stim_order = None  # drawn for each run in precomputeEpochParameters
 
         # initialize each component class
         self.initComponentClasses()
@@ -857,6 +853,13 @@ class MedullaTuningSuite(BaseProtocol):
         self.getRunParameterDefaults()
         self.getParameterDefaults()
 
+    def precomputeEpochParameters(self):
+        n = [16]  # weight each stim draw by how many trial types it has. Total = 16
+        avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
+        all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
+
+        self.stim_order = self.shuffleSuiteStims(np.hstack(all_stims))
+
     def initComponentClasses(self):
         # pre-populate dict of component classes. Each with its own num_epochs_completed counter etc
         self.component_classes = {}
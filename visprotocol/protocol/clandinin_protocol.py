@@ -12,17 +12,20 @@ Protocol parent class. Override any methods in here in the user protocol subclas
 """
 import itertools
 import numpy as np
-from time import sleep
+from time import sleep, perf_counter_ns
 
 import os.path
 import os
 import yaml
 import inspect
 import warnings
-import flyrpc.multicall
 
 import visprotocol
 
+# spawn key branches of a run's random seed: per-epoch streams and suite component protocols
+RANDOM_BRANCH_EPOCH = 0
+RANDOM_BRANCH_COMPONENT = 1
+
 
 class BaseProtocol():
     def __init__(self, cfg):
@@ -37,6 +40,14 @@ class BaseProtocol():
         self.rig_name = cfg.get('rig_name')
         self.cfg = cfg
         self.save_metadata_flag = False
+        self.epoch_schedule = None  # parameter sequence index for each epoch, set by selectParametersFromLists
+        self.random_seed = None  # root seed of this run's random generators, saved with the series
+        self.random_spawn_key = ()  # branch of the root seed this protocol draws from (set for suite components)
+        self.rng = None
+        self.epoch_rng = None  # (epoch number, generator) for the current epoch
+        self.prefetch_next_epoch = None  # set by EpochRun in prefetch runs: loads the next epoch's stimuli during tail_time
+        self.allow_prefetch = False  # set True in protocols whose loaded stimuli don't show before start_stim, to allow prefetch_stimuli
+        self.scheduler = None  # visprotocol.timing.EpochScheduler, set by EpochRun
 
         self.parameter_preset_directory = os.path.join(inspect.getfile(visprotocol).split('visprotocol')[0], 'visprotocol', 'resources', self.user_name, 'parameter_presets')
         os.makedirs(self.parameter_preset_directory, exist_ok=True)
@@ -117,9 +128,61 @@ class BaseProtocol():
     def precomputeEpochParameters(self):
         pass
 
+    def startRandomGenerator(self, seed=None, spawn_key=()):
+        """
+        Start the per-run random generator, self.rng. Pass the random_seed of an earlier run to replay it,
+        or None for a fresh seed. spawn_key selects a branch of the seed (see spawnRandomGenerators)
+        """
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1, dtype=np.uint64)[0] >> 1)  # fits in an hdf5 int64 attr
+        self.random_seed = int(seed)
+        self.random_spawn_key = tuple(spawn_key)
+        self.rng = np.random.default_rng(np.random.SeedSequence(self.random_seed, spawn_key=self.random_spawn_key))
+        self.epoch_rng = None
+
+    def spawnRandomGenerators(self, protocol_objects):
+        """
+        Start the generators of a suite's component protocols, each on its own branch of this run's seed,
+        so components draw independent streams and the whole suite replays from its random_seed
+        """
+        if self.rng is None:
+            self.startRandomGenerator()
+        for ind, protocol_object in enumerate(protocol_objects):
+            protocol_object.startRandomGenerator(self.random_seed, spawn_key=self.random_spawn_key + (RANDOM_BRANCH_COMPONENT, ind))
+
+    def shuffleSuiteStims(self, stims):
+        """
+        For suites of component protocols (self.component_classes), in precomputeEpochParameters:
+        start the components' generators (see spawnRandomGenerators) and return stims in an order
+        drawn from this run's generator
+        """
+        self.spawnRandomGenerators(self.component_classes.values())
+        return self.rng.permutation(stims)
+
+    def getEpochRandomGenerator(self):
+        """
+        Random generator for the current epoch, derived from the run seed and the epoch number,
+        so each epoch's draws can be regenerated on their own
+        """
+        if self.rng is None:
+            self.startRandomGenerator()
+        if self.epoch_rng is None or self.epoch_rng[0] != self.num_epochs_completed:
+            seed_sequence = np.random.SeedSequence(self.random_seed, spawn_key=self.random_spawn_key + (RANDOM_BRANCH_EPOCH, self.num_epochs_completed))
+            self.epoch_rng = (self.num_epochs_completed, np.random.default_rng(seed_sequence))
+        return self.epoch_rng[1]
+
+    def newMultiCall(self, client):
+        """
+        Multicall for client.manager. A client that supplies its own (e.g. the simulation's) is used without flyrpc
+        """
+        if hasattr(client, 'newMultiCall'):
+            return client.newMultiCall()
+        import flyrpc.multicall
+        return flyrpc.multicall.MyMultiCall(client.manager)
+
     def loadStimuli(self, client, multicall=None):
         if multicall is None:
-            multicall = flyrpc.multicall.MyMultiCall(client.manager)
+            multicall = self.newMultiCall(client)
 
         bg = self.run_parameters.get('idle_color')
         multicall.load_stim('ConstantBackground', color=[bg, bg, bg, 1.0])
@@ -140,10 +203,10 @@ class BaseProtocol():
         do_closed_loop = do_loco and do_closed_loop_epoch
         save_pos_history = do_closed_loop and self.save_metadata_flag
 
-        sleep(self.run_parameters['pre_time'])
+        self.waitForPhase('pre', self.run_parameters['pre_time'])
         
         if multicall is None:
-            multicall = flyrpc.multicall.MyMultiCall(client.manager)
+            multicall = self.newMultiCall(client)
 
         # stim time
         # Locomotion / closed-loop
@@ -154,11 +217,13 @@ class BaseProtocol():
                 multicall.loco_loop_start_closed_loop()
         multicall.start_stim(save_pos_history=save_pos_history, append_stim_frames=append_stim_frames)
         multicall.start_corner_square()
+        t0 = self.getClockNs()
         multicall()
-        sleep(self.run_parameters['stim_time'])
+        self.recordStage('start_stim', t0)
+        self.waitForPhase('stim', self.run_parameters['stim_time'])
 
         # tail time
-        multicall = flyrpc.multicall.MyMultiCall(client.manager)
+        multicall = self.newMultiCall(client)
         multicall.stop_stim(print_profile=print_profile)
         multicall.black_corner_square()
         # Locomotion / closed-loop
@@ -166,9 +231,39 @@ class BaseProtocol():
             multicall.loco_loop_stop_closed_loop()
         if save_pos_history:
             multicall.save_pos_history_to_file(epoch_id=f'{self.num_epochs_completed:03d}')
+        t0 = self.getClockNs()
         multicall()
+        self.recordStage('stop_stim', t0)
+
+        tail_time = self.run_parameters['tail_time']  # read first: prefetching may set the next epoch's tail_time
+        if self.prefetch_next_epoch is not None:
+            self.prefetch_next_epoch()
+        self.waitForPhase('tail', tail_time)
+
+    def getClockNs(self):
+        """
+        Current time (ns) on the run's clock
+        """
+        if self.scheduler is not None:
+            return self.scheduler.clock.perf_counter_ns()
+        return perf_counter_ns()
+
+    def recordStage(self, stage, start_ns):
+        """
+        Record host timing for a stage of this epoch that started at start_ns (see getClockNs)
+        """
+        if self.scheduler is not None:
+            self.scheduler.recordStage(stage, start_ns, self.num_epochs_completed)
 
-        sleep(self.run_parameters['tail_time'])
+    def waitForPhase(self, phase, duration):
+        """
+        Wait out an epoch phase. With a scheduler, waits until the phase's deadline, measured from the end
+        of the previous phase, so time spent on RPCs within the phase does not accumulate across the run
+        """
+        if self.scheduler is not None and self.scheduler.isRunning():
+            self.scheduler.wait(phase, duration, epoch=self.num_epochs_completed)
+        else:
+            sleep(duration)
 
     # Convenience functions shared across protocols...
     def selectParametersFromLists(self, parameter_list, all_combinations=True, randomize_order=False):
@@ -181,46 +276,24 @@ class BaseProtocol():
                     in this case, all_combinations = True will return all possible combinations of parameters, taking
                     one from each parameter list. If all_combinations = False, keeps params associated across lists
         randomize_order will randomize sequence or sequences at the beginning of each new sequence
-        """
-
-        # parameter_list is a tuple of lists or a single list
-        if type(parameter_list) is list: # single protocol parameter list, choose one from this list
-            parameter_sequence = parameter_list
-
-        elif type(parameter_list) is tuple: # multiple lists of protocol parameters
-            if all_combinations:
-                parameter_list_new = []
-
-                # check for non-list elements of the tuple (int or float user entry)
-                for param in list(parameter_list):
-                    if type(param) is not list:
-                        parameter_list_new.append([param])
-                    else:
-                        parameter_list_new.append(param)
-                parameter_list = tuple(parameter_list_new)
-                
-                # parameter_sequence is num_combinations by num params
-                parameter_sequence = list(itertools.product(*parameter_list))
-            else:
-                # keep params in lists associated with one another
-                # requires param lists of equal length
-                parameter_sequence = np.vstack(parameter_list).T
 
-        else: # user probably entered a single value (int or float), convert to list
-            parameter_sequence = [parameter_list]
+        The full run is scheduled on the first epoch: self.epoch_schedule holds the index into the
+        parameter sequence for every epoch, so later epochs are a lookup
+        """
+        if self.rng is None:
+            self.startRandomGenerator()
 
-        if self.num_epochs_completed == 0: # new run: initialize persistent sequences
+        if self.num_epochs_completed == 0: # new run: build the parameter sequence and epoch schedule once
+            parameter_sequence = getParameterSequence(parameter_list, all_combinations=all_combinations)
+            self.epoch_schedule = buildEpochSchedule(len(parameter_sequence), int(self.run_parameters['num_epochs']),
+                                                     randomize_order=randomize_order, rng=self.rng)
             self.persistent_parameters = {'parameter_sequence': parameter_sequence}
 
-        draw_ind = np.mod(self.num_epochs_completed, len(self.persistent_parameters['parameter_sequence']))
-        if draw_ind == 0 and randomize_order: # randomize sequence
-            rand_inds = np.random.permutation(len(self.persistent_parameters['parameter_sequence']))
-            if len(np.shape(self.persistent_parameters['parameter_sequence'])) == 1:
-                self.persistent_parameters['parameter_sequence'] = list(np.array(self.persistent_parameters['parameter_sequence'], dtype=object)[rand_inds])
-            else:
-                self.persistent_parameters['parameter_sequence'] = list(np.array(self.persistent_parameters['parameter_sequence'], dtype=object)[rand_inds, :])
+        if self.num_epochs_completed >= len(self.epoch_schedule): # run was extended past its schedule
+            self.epoch_schedule = np.concatenate([self.epoch_schedule, buildEpochSchedule(len(self.persistent_parameters['parameter_sequence']),
+                                                                                          max(len(self.epoch_schedule), 1), randomize_order=randomize_order, rng=self.rng)])
 
-        current_parameters = self.persistent_parameters['parameter_sequence'][draw_ind]
+        current_parameters = self.persistent_parameters['parameter_sequence'][self.epoch_schedule[self.num_epochs_completed]]
 
         return current_parameters
     
@@ -314,4 +387,47 @@ class BaseProtocol():
 
     def getMovingSpotParameters(self, center=None, angle=None, speed=None, radius=None, color=None, distance_to_travel=None):
         return self.getMovingPatchParameters(center=center, angle=angle, speed=speed, width=radius*2, height=radius*2, color=color, distance_to_travel=distance_to_travel, ellipse=True, render_on_cylinder=False)
-        
\ No newline at end of file
+        
+
+def getParameterSequence(parameter_list, all_combinations=True):
+    """
+    Expand parameter_list (see BaseProtocol.selectParametersFromLists) into a sequence of parameter sets
+    """
+    # parameter_list is a tuple of lists or a single list
+    if type(parameter_list) is list: # single protocol parameter list, choose one from this list
+        parameter_sequence = parameter_list
+
+    elif type(parameter_list) is tuple: # multiple lists of protocol parameters
+        if all_combinations:
+            # check for non-list elements of the tuple (int or float user entry)
+            parameter_list = tuple(param if type(param) is list else [param] for param in parameter_list)
+
+            # parameter_sequence is num_combinations by num params
+            parameter_sequence = list(itertools.product(*parameter_list))
+        else:
+            # keep params in lists associated with one another
+            # requires param lists of equal length
+            parameter_sequence = np.vstack(parameter_list).T
+
+    else: # user probably entered a single value (int or float), convert to list
+        parameter_sequence = [parameter_list]
+
+    return parameter_sequence
+
+
+def buildEpochSchedule(num_parameter_sets, num_epochs, randomize_order=False, rng=None):
+    """
+    Index into a parameter sequence of length num_parameter_sets for each of num_epochs epochs.
+    Cycles through the sequence; randomize_order shuffles each cycle using rng (a numpy Generator)
+    """
+    num_cycles = int(np.ceil(num_epochs / max(num_parameter_sets, 1)))
+    dtype = np.min_scalar_type(max(num_parameter_sets - 1, 0))
+    if num_cycles <= 0:
+        return np.empty(0, dtype=dtype)
+    if randomize_order:
+        if rng is None:
+            rng = np.random.default_rng()
+        schedule = np.concatenate([rng.permutation(num_parameter_sets) for _ in range(num_cycles)])
+    else:
+        schedule = np.tile(np.arange(num_parameter_sets), num_cycles)
+    return schedule[:num_epochs].astype(dtype)
@@ -670,7 +670,7 @@ class SphericalCheckerboardWhiteNoise(BaseProtocol):
         stimulus_ID = 'RandomGridOnSphericalPatch'
         adj_center = self.adjustCenter(self.protocol_parameters['center'])
 
-        start_seed = int(np.random.choice(range(int(1e6))))
+        start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
         distribution_data = {'name': 'Ternary',
                              'args': [],
@@ -1663,9 +1663,9 @@ class RealWalkThroughFakeForest(BaseProtocol):
 
         z_level = -0.20
         tree_locations = []
-        np.random.seed(int(self.protocol_parameters['rand_seed']))
+        forest_rng = np.random.RandomState(int(self.protocol_parameters['rand_seed']))  # same forest as the global np.random.seed(rand_seed) gave
         for tree in range(int(self.protocol_parameters['n_trees'])):
-            tree_locations.append([np.random.uniform(-0.5, 0.5), np.random.uniform(-0.5, 0.5), z_level+self.protocol_parameters['tree_height']/2])
+            tree_locations.append([forest_rng.uniform(-0.5, 0.5), forest_rng.uniform(-0.5, 0.5), z_level+self.protocol_parameters['tree_height']/2])
 
         self.epoch_parameters = {'name': 'Composite',
                                  'tree_height': self.protocol_parameters['tree_height'],
@@ -1744,14 +1744,14 @@ class ApproachTuning(BaseProtocol):
 
     def getEpochParameters(self):
         if self.protocol_parameters['start_seed'] == -1:
-            current_seed = np.random.randint(0, 10000)
+            current_seed = int(self.getEpochRandomGenerator().integers(0, 10000))
         else:
             current_seed = self.protocol_parameters['start_seed'] + self.num_epochs_completed
 
-        np.random.seed(int(current_seed))
+        velocity_rng = np.random.RandomState(int(current_seed))  # same trajectory as the global np.random.seed(current_seed) gave
 
         n_updates = int(np.ceil(self.run_parameters['stim_time'] * self.protocol_parameters['velocity_update_rate'])/2)
-        velocity = np.random.normal(size=n_updates, scale=self.protocol_parameters['velocity_std']) / self.protocol_parameters['velocity_update_rate'] # m/sec -> m/update
+        velocity = velocity_rng.normal(size=n_updates, scale=self.protocol_parameters['velocity_std']) / self.protocol_parameters['velocity_update_rate'] # m/sec -> m/update
 
         time_steps = np.linspace(0, self.run_parameters['stim_time'], len(velocity))  # time steps of update trajectory
         # distance away from fly
@@ -1967,9 +1967,9 @@ class MovingSpotOnVR(BaseProtocol):
 
         z_level = -0.20
         tree_locations = []
-        np.random.seed(int(self.protocol_parameters['rand_seed']))
+        forest_rng = np.random.RandomState(int(self.protocol_parameters['rand_seed']))  # same forest as the global np.random.seed(rand_seed) gave
         for tree in range(int(self.protocol_parameters['n_trees'])):
-            tree_locations.append([np.random.uniform(-0.5, 0.5), np.random.uniform(-0.5, 0.5), z_level+self.protocol_parameters['tree_height']/2])
+            tree_locations.append([forest_rng.uniform(-0.5, 0.5), forest_rng.uniform(-0.5, 0.5), z_level+self.protocol_parameters['tree_height']/2])
 
         vr_parameters = {'name': 'Composite',
                          'tree_height': self.protocol_parameters['tree_height'],
@@ -2067,11 +2067,7 @@ class PanGlomSuite(BaseProtocol):
         self.cfg = cfg
         self.stim_list = ['FlickeringPatch', 'DriftingSquareGrating', 'LoomingSpot', 'ExpandingMovingSpot', 'MovingSpotOnDriftingGrating',
                           'MovingRectangle', 'UniformFlash']
-        n = [3, 2, 3, 12, 6, 4, 2]  # weight each stim draw by how many trial types it has. Total = 32
-        avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
-        all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
-
-        self.stim_order = np.random.permutation(np.hstack(all_stims))
+        self.stim_order = None  # drawn for each run in precomputeEpochParameters
 
         # initialize each component class
         self.initComponentClasses()
@@ -2079,6 +2075,13 @@ class PanGlomSuite(BaseProtocol):
         self.getRunParameterDefaults()
         self.getParameterDefaults()
 
+    def precomputeEpochParameters(self):
+        n = [3, 2, 3, 12, 6, 4, 2]  # weight each stim draw by how many trial types it has. Total = 32
+        avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
+        all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
+
+        self.stim_order = self.shuffleSuiteStims(np.hstack(all_stims))
+
     def initComponentClasses(self):
         # pre-populate dict of component classes. Each with its own num_epochs_completed counter etc
         self.component_classes = {}
@@ -2191,11 +2194,7 @@ class PanGlomSuite(BaseProtocol):
             super().__init__(cfg)
             self.cfg = cfg
             self.stim_list = ['ExpandingMovingSpot', 'MovingRectangle']
-            n = [12, 4]  # weight each stim draw by how many trial types it has. Total = 20
-            avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
-            all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
-
-            self.stim_order = np.random.permutation(np.hstack(all_stims))
+            self.stim_order = None  # drawn for each run in precomputeEpochParameters
 
             # initialize each component class
             self.initComponentClasses()
@@ -2203,6 +2202,13 @@ class PanGlomSuite(BaseProtocol):
             self.getRunParameterDefaults()
             self.getParameterDefaults()
 
+        def precomputeEpochParameters(self):
+            n = [12, 4]  # weight each stim draw by how many trial types it has. Total = 20
+            avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
+            all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
+
+            self.stim_order = self.shuffleSuiteStims(np.hstack(all_stims))
+
         def initComponentClasses(self):
             # pre-populate dict of component classes. Each with its own num_epochs_completed counter etc
             self.component_classes = {}
@@ -3,7 +3,6 @@
 
 from visprotocol.protocol import clandinin_protocol
 import flyrpc.multicall
-import numpy as np
 
 class BaseProtocol(clandinin_protocol.BaseProtocol):
     def __init__(self, cfg):
@@ -35,7 +34,7 @@ class LoomRandomlySpaced(BaseProtocol):
         avg_iti = (self.run_parameters['run_time'] - total_loom_dur) / num_itis
         iti_lo = max(avg_iti - 1, 0)
         iti_hi = min(avg_iti + 1, self.run_parameters['run_time'])
-        self.itis = np.random.uniform(iti_lo, iti_hi, int(self.run_parameters['num_epochs']))
+        self.itis = self.rng.uniform(iti_lo, iti_hi, int(self.run_parameters['num_epochs']))
 
     def getEpochParameters(self):
         current_color = self.selectParametersFromLists(self.protocol_parameters['color'], randomize_order = self.protocol_parameters['randomize_order'])
@@ -113,7 +112,7 @@ class LoomRandomlySpacedRV(BaseProtocol):
         avg_iti = (self.run_parameters['run_time'] - total_loom_dur) / num_itis
         iti_lo = max(avg_iti - 1, 0)
         iti_hi = min(avg_iti + 1, self.run_parameters['run_time'])
-        self.itis = np.random.uniform(iti_lo, iti_hi, int(self.run_parameters['num_epochs']))
+        self.itis = self.rng.uniform(iti_lo, iti_hi, int(self.run_parameters['num_epochs']))
 
     def getEpochParameters(self):
         current_color = self.selectParametersFromLists(self.protocol_parameters['color'], randomize_order = self.protocol_parameters['randomize_order'])
@@ -213,15 +213,12 @@ class OpticFlowExperiment(BaseProtocol):
         # create a list that contains the correct number of each stim
         stim_per_unit = int(num_epochs_in_cluster / np.sum(stim_weights))
         all_stims = [[self.stim_list[i]] * stim_weights[i] * stim_per_unit for i in range(len(self.stim_list))]
-        self.stim_order = list(np.random.permutation(np.hstack(all_stims))) # Randomize list
+        self.stim_cluster = list(np.hstack(all_stims)) # Randomized for each run in precomputeEpochParameters
 
         #Update num epochs in cluster since could have decreased by a few due to rounding down
         num_epochs_in_cluster = int(stim_per_unit * np.sum(stim_weights))
 
-        ######## CONCATENATE EPOCH CLUSTERS BETWEEN GREY PERIODS ############
-        self.stim_order.insert(0,'ConstantBackground') # Add grey period
-        self.stim_order = self.stim_order + self.stim_order + self.stim_order + self.stim_order
-        self.stim_order.append('ConstantBackground')
+        self.stim_order = self.buildStimOrder(self.stim_cluster)
 
         # update to have the correct number of epochs
         self.run_parameters['num_epochs'] = len(self.stim_order)
@@ -229,6 +226,14 @@ class OpticFlowExperiment(BaseProtocol):
         # initialize each component class
         self.initComponentClasses()
 
+    def buildStimOrder(self, stim_cluster):
+        ######## CONCATENATE EPOCH CLUSTERS BETWEEN GREY PERIODS ############
+        stim_order = ['ConstantBackground'] + list(stim_cluster) # Add grey period
+        return stim_order + stim_order + stim_order + stim_order + ['ConstantBackground']
+
+    def precomputeEpochParameters(self):
+        self.stim_order = self.buildStimOrder(self.shuffleSuiteStims(self.stim_cluster)) # Randomize list
+
     def initComponentClasses(self):
         print('init')
         # pre-populate dict of component classes. Each with its own num_epochs_completed counter etc
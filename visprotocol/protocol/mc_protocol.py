@@ -466,7 +466,7 @@ class PatchFixation(BaseProtocol):
                 ['width', 'height', 'intensity', 'angle', 'closed_loop', 'opto_pre_time', 'opto_stim_time', 'opto_freq', 'opto_amp', 'opto_pulse_width'],
                 randomize_order = self.protocol_parameters['randomize_order'])
 
-            self.convenience_parameters['current_theta'] = np.random.uniform(*self.protocol_parameters['theta_random_range'])
+            self.convenience_parameters['current_theta'] = self.getEpochRandomGenerator().uniform(*self.protocol_parameters['theta_random_range'])
         else:
             self.convenience_parameters = self.selectParametersFromProtocolParameterNames(
                 ['width', 'height', 'intensity', 'angle', 'theta', 'closed_loop', 'opto_pre_time', 'opto_stim_time', 'opto_freq', 'opto_amp', 'opto_pulse_width'],
@@ -756,7 +756,7 @@ class SphericalCheckerboardWhiteNoise(BaseProtocol):
         stimulus_ID = 'RandomGridOnSphericalPatch'
         adj_center = self.adjustCenter(self.protocol_parameters['center'])
 
-        start_seed = int(np.random.choice(range(int(1e6))))
+        start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
         distribution_data = {'name': 'Ternary',
                              'args': [],
@@ -808,7 +808,7 @@ class ExpandingEdges(BaseProtocol):
             self.convenience_parameters = self.selectParametersFromProtocolParameterNames(
                 ['rate', 'expand_dark'],
                 randomize_order = self.protocol_parameters['randomize_order'])
-            self.convenience_parameters['current_theta_offset'] = np.random.uniform(0, 360)
+            self.convenience_parameters['current_theta_offset'] = self.getEpochRandomGenerator().uniform(0, 360)
         else:
             self.convenience_parameters = self.selectParametersFromProtocolParameterNames(
                 ['rate', 'expand_dark', 'theta_offset'],
@@ -883,7 +883,7 @@ class DriftingSquareGrating(BaseProtocol):
                                  'mean': self.protocol_parameters['mean'],
                                  'contrast': self.protocol_parameters['contrast'],
                                  'angle': current_angle,
-                                 'offset': np.rad2deg(np.random.uniform(0, 2*np.pi)) if self.protocol_parameters['random_offset'] else 0,
+                                 'offset': np.rad2deg(self.getEpochRandomGenerator().uniform(0, 2*np.pi)) if self.protocol_parameters['random_offset'] else 0,
                                  'cylinder_radius': radius_in_meters,
                                  'cylinder_height': height_in_meters,
                                  'profile': 'square',
@@ -941,7 +941,7 @@ class SplitDriftingSquareGrating(BaseProtocol):
         # TODO: center size with aperture (center and center_size)
         current_angle = self.selectParametersFromLists(self.protocol_parameters['angle'], randomize_order = self.protocol_parameters['randomize_order'])
 
-        offset = np.rad2deg(np.random.uniform(0, 2*np.pi)) if self.protocol_parameters['random_offset'] else 0
+        offset = np.rad2deg(self.getEpochRandomGenerator().uniform(0, 2*np.pi)) if self.protocol_parameters['random_offset'] else 0
 
         self.epoch_parameters_0 = {'name': 'RotatingGrating',
                                  'period': self.protocol_parameters['period'],
@@ -1374,7 +1374,7 @@ class TernaryBars(BaseProtocol):
 
     def getEpochParameters(self):
         current_period, current_theta_offset, current_angle = self.selectParametersFromLists((self.protocol_parameters['period'], self.protocol_parameters['theta_offset'], self.protocol_parameters['angle']), randomize_order=self.protocol_parameters['randomize_order'])
-        start_seed = int(np.random.choice(range(int(1e6))))
+        start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
         distribution_data = {'name': 'Ternary',
                              'args': [],
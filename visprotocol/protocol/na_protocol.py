@@ -687,7 +687,7 @@ class SwitchingDriftingSquareGrating(BaseProtocol):
                                  'mean': self.protocol_parameters['mean'],
                                  'contrast': self.protocol_parameters['contrast'],
                                  'angle': current_angle,
-                                 'offset': np.rad2deg(np.random.uniform(0, 2*np.pi)) if self.protocol_parameters['random_offset'] else 0,
+                                 'offset': np.rad2deg(self.getEpochRandomGenerator().uniform(0, 2*np.pi)) if self.protocol_parameters['random_offset'] else 0,
                                  'cylinder_radius': radius_in_meters,
                                  'cylinder_height': height_in_meters,
                                  'profile': 'square',
@@ -734,7 +734,7 @@ class SphericalCheckerboardWhiteNoise(BaseProtocol):
         stimulus_ID = 'RandomGridOnSphericalPatch'
         adj_center = self.adjustCenter(self.protocol_parameters['center'])
 
-        start_seed = int(np.random.choice(range(int(1e6))))
+        start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
         distribution_data = {'name': 'Ternary',
                              'args': [],
@@ -1353,7 +1353,7 @@ class TernaryBars(BaseProtocol):
         stimulus_ID = 'RandomBars'
 
         current_period, current_theta_offset, current_angle = self.selectParametersFromLists((self.protocol_parameters['period'], self.protocol_parameters['theta_offset'], self.protocol_parameters['angle']), randomize_order=self.protocol_parameters['randomize_order'])
-        start_seed = int(np.random.choice(range(int(1e6))))
+        start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
         
         distribution_data = {'name': 'Ternary',
                              'args': [],
@@ -192,7 +192,7 @@ class SpatialTernaryNoise(BaseProtocol):
     def getEpochParameters(self):
         stimulus_ID  = 'RandomGrid'
 
-        start_seed = int(np.random.choice(range(int(1e6))))
+        start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
 
         distribution_data = {'name':'Ternary',
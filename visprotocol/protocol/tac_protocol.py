@@ -80,7 +80,7 @@ class SphericalCheckerboardWhiteNoise(BaseProtocol):
         stimulus_ID = 'RandomGridOnSphericalPatch'
         adj_center = self.adjustCenter(self.protocol_parameters['center'])
 
-        start_seed = int(np.random.choice(range(int(1e6))))
+        start_seed = int(self.getEpochRandomGenerator().integers(int(1e6)))
 
         if self.protocol_parameters['rgb_texture']:
             color = [1, 0, 0, 1] # UV only
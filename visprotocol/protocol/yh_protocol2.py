@@ -1063,11 +1063,7 @@ class PanGlomSuite(BaseProtocol):
         self.cfg = cfg
         self.stim_list = ['FlickeringPatch', 'DriftingSquareGrating', 'LoomingSpot', 'ExpandingMovingSpot',
                           'MovingRectangle', 'UniformFlash']
-        n = [3, 2, 3, 12, 6, 4, 2]  # weight each stim draw by how many trial types it has. Total = 32
-        avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
-        all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
-
-        self.stim_order = np.random.permutation(np.hstack(all_stims))
+        self.stim_order = None  # drawn for each run in precomputeEpochParameters
 
         # initialize each component class
         self.initComponentClasses()
@@ -1075,6 +1071,13 @@ class PanGlomSuite(BaseProtocol):
         self.getRunParameterDefaults()
         self.getParameterDefaults()
 
+    def precomputeEpochParameters(self):
+        n = [3, 2, 3, 12, 6, 4, 2]  # weight each stim draw by how many trial types it has. Total = 32
+        avg_per_stim = int(self.run_parameters['num_epochs'] / np.sum(n))
+        all_stims = [[self.stim_list[i]] * n[i] * avg_per_stim for i in range(len(n))]
+
+        self.stim_order = self.shuffleSuiteStims(np.hstack(all_stims))
+
     def initComponentClasses(self):
         # pre-populate dict of component classes. Each with its own num_epochs_completed counter etc
         self.component_classes = {}
@@ -43,11 +43,14 @@ class Server():
         self.manager.register_function_on_root(self.loco_manager.close, "loco_close")
         self.manager.register_function_on_root(self.loco_manager.set_pos_0, "loco_set_pos_0")
         self.manager.register_function_on_root(self.loco_manager.write_to_log, "loco_write_to_log")
+        self.manager.register_function_on_root(self.loco_manager.sync_clock, "loco_sync_clock")
         self.manager.register_function_on_root(self.loco_manager.loop_start, "loco_loop_start")
         self.manager.register_function_on_root(self.loco_manager.loop_stop, "loco_loop_stop")
         self.manager.register_function_on_root(self.loco_manager.loop_start_closed_loop, "loco_loop_start_closed_loop")
         self.manager.register_function_on_root(self.loco_manager.loop_stop_closed_loop, "loco_loop_stop_closed_loop")
         self.manager.register_function_on_root(self.loco_manager.loop_update_closed_loop_vars, "loco_loop_update_closed_loop_vars")
+        self.manager.register_function_on_root(self.loco_manager.loop_set_latest_only, "loco_loop_set_latest_only")
+        self.manager.register_function_on_root(self.loco_manager.loop_set_max_update_rate, "loco_loop_set_max_update_rate")
         # self.manager.register_function_on_root(self.loco_manager.sleep, "loco_sleep")
         # self.manager.register_function_on_root(self.loco_manager.update_pos, "loco_update_pos")
         # self.manager.register_function_on_root(self.loco_manager.update_pos_for, "loco_update_pos_for")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the flystim stim server, for testing and profiling the client and data path on a headless machine
+
+Listens on a local socket and speaks the flyrpc wire protocol (newline-delimited JSON request lists,
+as written by MySocketClient and MyMultiCall), without drawing anything. Every request is recorded
+with its arrival time, and each request can be delayed by an injected latency to mimic a slow
+or congested server.
+
+In a script:
+    server = MockStimServer(port=0, latency={'load_stim': 0.005})  # port=0: any free port
+    cfg['server_options'] = {'host': '127.0.0.1', 'port': server.port, 'use_server': True}
+    cfg['daq'] = {'class': 'DAQonServer'}  # daq_* calls go to the server too
+    client = Client(cfg)
+    ...
+    server.waitForCalls(n)
+    server.calls  # [(arrival_sec, name, args, kwargs), ...]
+    server.close()
+
+From the command line (point a rig's server_options at it):
+    python -m visprotocol.server.mock_server --port 60629 --latency 0.002 --latency load_stim=0.01
+"""
+import argparse
+import json
+import socket
+import threading
+from collections import Counter
+from time import perf_counter, sleep
+
+
+class MockStimServer():
+    def __init__(self, host='127.0.0.1', port=60629, latency=0, start=True):
+        """
+        latency: sec to hold each request before the next is handled. A number for all requests,
+            or a dict of request name: latency, with key 'default' for the rest
+        """
+        self.latency = latency if isinstance(latency, dict) else {'default': latency}
+        self.calls = []  # (arrival_sec, name, args, kwargs). arrival_sec is time.perf_counter()
+        self.functions = {}
+        self.calls_lock = threading.Condition()
+        self.shutdown_flag = threading.Event()
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen()
+        self.server_socket.settimeout(0.1)
+        self.host, self.port = self.server_socket.getsockname()[:2]
+
+        self.threads = []
+        if start:
+            self.start()
+
+    def start(self):
+        thread = threading.Thread(target=self.acceptLoop, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def register_function(self, function, name=None):
+        """
+        Run function when a request called name arrives (e.g. to mimic a return value or side effect)
+        """
+        self.functions[function.__name__ if name is None else name] = function
+
+    def acceptLoop(self):
+        while not self.shutdown_flag.is_set():
+            try:
+                conn, _ = self.server_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            thread = threading.Thread(target=self.connectionLoop, args=(conn,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def connectionLoop(self, conn):
+        conn.settimeout(0.1)
+        buffer = b''
+        with conn:
+            while not self.shutdown_flag.is_set():
+                try:
+                    chunk = conn.recv(65536)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                if not chunk:  # client closed the connection
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if line.strip():
+                        self.handleLine(line, perf_counter())
+
+    def handleLine(self, line, arrival_sec):
+        try:
+            request_list = json.loads(line.decode('utf-8'))
+        except ValueError:
+            print('Mock stim server: could not parse request {}'.format(line[:100]))
+            return
+        if isinstance(request_list, dict):
+            request_list = [request_list]
+
+        for request in request_list:
+            name = request.get('name')
+            args = request.get('args', [])
+            kwargs = request.get('kwargs', {})
+            with self.calls_lock:
+                self.calls.append((arrival_sec, name, args, kwargs))
+                self.calls_lock.notify_all()
+
+            latency = self.latency.get(name, self.latency.get('default', 0))
+            if latency > 0:
+                sleep(latency)
+            if name in self.functions:
+                self.functions[name](*args, **kwargs)
+
+    def waitForCalls(self, num_calls, timeout=5):
+        """
+        Block until num_calls requests have arrived in total. Returns False on timeout
+        """
+        with self.calls_lock:
+            return self.calls_lock.wait_for(lambda: len(self.calls) >= num_calls, timeout=timeout)
+
+    def getCallNames(self):
+        with self.calls_lock:
+            return [x[1] for x in self.calls]
+
+    def clearCalls(self):
+        with self.calls_lock:
+            self.calls = []
+
+    def close(self):
+        self.shutdown_flag.set()
+        self.server_socket.close()
+        for thread in self.threads:
+            thread.join(timeout=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parseLatency(latency_args):
+    latency = {'default': 0}
+    for latency_arg in latency_args:
+        if '=' in latency_arg:
+            name, value = latency_arg.split('=')
+            latency[name] = float(value)
+        else:
+            latency['default'] = float(latency_arg)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock flystim stim server: records requests without drawing stimuli')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=60629)
+    parser.add_argument('--latency', action='append', default=[], help='sec per request, or NAME=sec for one request type')
+    args = parser.parse_args()
+
+    server = MockStimServer(host=args.host, port=args.port, latency=parseLatency(args.latency))
+    print('Mock stim server listening on {}:{}. Ctrl+C to stop'.format(server.host, server.port))
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+    calls = server.calls
+    print('{} requests'.format(len(calls)))
+    for name, count in Counter([x[1] for x in calls]).most_common():
+        print('{:<36}{:>8}'.format(name, count))
+
+
+if __name__ == '__main__':
+    main()
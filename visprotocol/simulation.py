@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulation mode: dry-run whole protocols on a virtual clock, against a recording stand-in for flystim
+
+Runs finish in about the time it takes to compute epoch parameters and write metadata, and
+produce the full sequence of flystim/loco/daq calls, each epoch's parameters, the expected
+phase timing and (with a Data object) the same HDF5 output as a real run.
+Timestamps in the HDF5 file (epoch_time etc.) are still wall-clock times.
+
+Usage:
+    simulation = Simulation(cfg)
+    series_counts = simulation.run([protocol_object], data=data)  # data=None to skip saving metadata
+    simulation.client.manager.calls  # [(time_sec, name, args, kwargs), ...]
+    simulation.epoch_run.scheduler.getPhaseTiming()
+"""
+import sys
+from contextlib import contextmanager
+
+from visprotocol.control import EpochRun
+from visprotocol.timing import SPIN_TIME
+
+
+class VirtualClock():
+    """
+    Clock whose time only moves when something sleeps on it. Same interface as timing.MonotonicClock
+    """
+    def __init__(self):
+        self.now_ns = 0
+
+    def perf_counter_ns(self):
+        return self.now_ns
+
+    def sleep(self, seconds):
+        self.now_ns += max(int(round(seconds * 1e9)), 0)
+
+    def sleepUntil(self, deadline_ns, spin_time=SPIN_TIME):
+        self.now_ns = max(self.now_ns, deadline_ns)
+
+
+class RecordingManager():
+    """
+    Stand-in for the flystim manager (flyrpc MySocketClient): records every call, including those
+    sent in a multicall, with the virtual time it was made. Calls do nothing and return None
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = []  # (time_sec, name, args, kwargs)
+
+    def write_request_list(self, request_list):
+        for request in request_list:
+            self.calls.append((self.clock.perf_counter_ns() / 1e9, request['name'], request.get('args', ()), request.get('kwargs', {})))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def recordCall(*args, **kwargs):
+            self.calls.append((self.clock.perf_counter_ns() / 1e9, name, args, kwargs))
+        return recordCall
+
+    def getCallNames(self):
+        return [x[1] for x in self.calls]
+
+
+class RecordingMultiCall():
+    """
+    Stand-in for flyrpc's MyMultiCall: collects calls and sends them to the manager's write_request_list
+    together, so simulations run without flyrpc
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self.request_list = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def addRequest(*args, **kwargs):
+            self.request_list.append({'name': name, 'args': args, 'kwargs': kwargs})
+        return addRequest
+
+    def __call__(self):
+        self.manager.write_request_list(self.request_list)
+        self.request_list = []
+
+
+class RecordingDAQ():
+    """
+    Stand-in for a DAQ device, recording its calls on the flystim RecordingManager (as 'daq_<method>')
+    """
+    def __init__(self, manager):
+        self.manager = manager
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.manager, 'daq_' + name)
+
+
+class SimulatedClient():
+    """
+    Stand-in for clandinin_client.Client, with no flystim server, screens or hardware
+    """
+    def __init__(self, cfg, clock, use_daq=True):
+        self.user_name = cfg.get('user_name')
+        self.rig_name = cfg.get('rig_name')
+        self.cfg = cfg
+        self.server_options = {'host': None,
+                               'port': None,
+                               'use_server': False}
+        self.manager = RecordingManager(clock)
+        self.daq_device = RecordingDAQ(self.manager) if use_daq else None
+        self.rpc_monitor = None
+
+    def newMultiCall(self):
+        return RecordingMultiCall(self.manager)
+
+
+@contextmanager
+def virtualSleep(protocol_objects, clock):
+    """
+    Point the time.sleep used by each protocol's module (and its parent classes' modules) at clock, for protocols
+    that override startStimuli with their own sleep() calls. Restored on exit
+    """
+    modules = set()
+    for protocol_object in protocol_objects:
+        for cls in type(protocol_object).__mro__:
+            module = sys.modules.get(cls.__module__)
+            if module is not None and hasattr(module, 'sleep'):
+                modules.add(module)
+
+    original_sleeps = {module: module.sleep for module in modules}
+    try:
+        for module in modules:
+            module.sleep = clock.sleep
+        yield
+    finally:
+        for module, original_sleep in original_sleeps.items():
+            module.sleep = original_sleep
+
+
+class Simulation():
+    def __init__(self, cfg, use_daq=True):
+        self.clock = VirtualClock()
+        self.client = SimulatedClient(cfg, self.clock, use_daq=use_daq)
+        self.epoch_run = EpochRun(clock=self.clock)
+
+    def run(self, protocol_objects, data=None):
+        """
+        Run a list of protocol objects as a queue of series on the virtual clock. With data (a Data object
+        with an experiment file and fly selected), metadata is saved just as in a real run.
+        Returns the series numbers (None if not saved)
+        """
+        with virtualSleep(protocol_objects, self.clock):
+            if data is None:
+                # EpochRun reads run settings (do_loco, prefetch_stimuli) from data.cfg
+                data = _ConfigOnly(self.client.cfg)
+                return self.epoch_run.startQueue(protocol_objects, data, self.client, save_metadata_flag=False)
+            else:
+                return self.epoch_run.startQueue(protocol_objects, data, self.client, save_metadata_flag=True)
+
+
+class _ConfigOnly():
+    def __init__(self, cfg):
+        self.cfg = cfg
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deadline-based timing for epoch runs, on the monotonic perf_counter_ns clock
+
+Every phase boundary (end of pre_time, stim_time, tail_time) gets an absolute target time,
+counted from the run start. Time spent on RPCs and file writes within a phase is absorbed
+by that phase's wait instead of adding up across the run.
+"""
+from collections import deque
+from time import perf_counter_ns, sleep
+import threading
+import numpy as np
+
+SPIN_TIME = 0.002  # sec. Busy-wait this long at the end of each wait, to hit the deadline precisely
+
+# Host-side stages of each epoch, timed by EpochRun.startEpoch and BaseProtocol.startStimuli
+HOST_TIMING_STAGES = ('get_epoch_parameters', 'create_epoch', 'daq_trigger', 'load_stimuli', 'start_stim', 'stop_stim', 'end_epoch')
+HOST_TIMING_DTYPE = np.dtype([(stage, 'i8', (2,)) for stage in HOST_TIMING_STAGES])  # one row per epoch: (start_ns, end_ns) of each stage
+
+PHASE_TIMING_DTYPE = np.dtype([('epoch', 'i4'),
+                               ('phase', 'S8'),
+                               ('planned_ns', 'i8'),  # phase end, relative to run start
+                               ('actual_ns', 'i8')])
+
+
+def sleepUntil(deadline_ns, spin_time=SPIN_TIME):
+    """
+    Sleep until perf_counter_ns() reaches deadline_ns, spinning for the last spin_time sec
+    """
+    spin_ns = int(spin_time * 1e9)
+    remaining_ns = deadline_ns - perf_counter_ns()
+    if remaining_ns > spin_ns:
+        sleep((remaining_ns - spin_ns) / 1e9)
+    while perf_counter_ns() < deadline_ns:
+        pass
+
+
+class MonotonicClock():
+    """
+    The clock used by EpochRun and EpochScheduler. See visprotocol.simulation.VirtualClock for a stand-in
+    """
+    def perf_counter_ns(self):
+        return perf_counter_ns()
+
+    def sleep(self, seconds):
+        sleep(seconds)
+
+    def sleepUntil(self, deadline_ns, spin_time=SPIN_TIME):
+        sleepUntil(deadline_ns, spin_time=spin_time)
+
+
+class EpochScheduler():
+    """
+    Usage:
+        scheduler.start()  # at the start of the epoch loop
+        scheduler.wait('pre', pre_time, epoch=0)  # returns at run start + pre_time
+        scheduler.wait('stim', stim_time, epoch=0)  # returns at run start + pre_time + stim_time
+        ...
+    If a phase's deadline has already passed when its wait starts (e.g. after a very slow stimulus load),
+    the schedule continues from now rather than shortening later phases to catch up. After a pause, call anchor()
+    """
+    def __init__(self, spin_time=SPIN_TIME, clock=None):
+        self.spin_time = spin_time
+        self.clock = MonotonicClock() if clock is None else clock
+        self.run_start_ns = None
+        self.deadline_ns = None
+        self.phase_timing = []  # (epoch, phase, planned_ns, actual_ns) per phase
+        self.overruns = 0
+        self.host_timing = np.full((0, len(HOST_TIMING_STAGES), 2), -1, dtype='i8')
+        self.host_epochs = 0  # number of epochs with host timing recorded
+
+    def start(self, num_epochs=0):
+        """
+        Start the run schedule, preallocating host timing for num_epochs epochs
+        """
+        self.run_start_ns = self.clock.perf_counter_ns()
+        self.deadline_ns = self.run_start_ns
+        self.phase_timing = []
+        self.overruns = 0
+        self.host_timing = np.full((max(int(num_epochs), 1), len(HOST_TIMING_STAGES), 2), -1, dtype='i8')
+        self.host_epochs = 0
+
+    def anchor(self):
+        """
+        Start the next phase from now, e.g. after the run was paused
+        """
+        self.deadline_ns = self.clock.perf_counter_ns()
+
+    def stop(self):
+        """
+        End the run and return its phase timing (see getPhaseTiming)
+        """
+        self.run_start_ns = None
+        return self.getPhaseTiming()
+
+    def isRunning(self):
+        return self.run_start_ns is not None
+
+    def wait(self, phase, duration, epoch=-1):
+        """
+        Wait until the end of a phase lasting duration (sec), measured from the end of the previous phase
+        """
+        self.deadline_ns += int(round(duration * 1e9))
+        now_ns = self.clock.perf_counter_ns()
+        if now_ns > self.deadline_ns:  # phase is already over: continue the schedule from here
+            self.overruns += 1
+            self.deadline_ns = now_ns
+
+        self.clock.sleepUntil(self.deadline_ns, spin_time=self.spin_time)
+        self.phase_timing.append((epoch, phase, self.deadline_ns - self.run_start_ns, self.clock.perf_counter_ns() - self.run_start_ns))
+
+    def recordStage(self, stage, start_ns, epoch):
+        """
+        Record that host stage (one of HOST_TIMING_STAGES) ran from start_ns (perf_counter_ns) until now
+        """
+        if self.run_start_ns is None:
+            return
+        end_ns = self.clock.perf_counter_ns()
+        if epoch >= self.host_timing.shape[0]:  # run was extended past its preallocation
+            grown = np.full((2 * (epoch + 1),) + self.host_timing.shape[1:], -1, dtype='i8')
+            grown[:self.host_timing.shape[0]] = self.host_timing
+            self.host_timing = grown
+        self.host_timing[epoch, HOST_TIMING_STAGES.index(stage)] = (start_ns - self.run_start_ns, end_ns - self.run_start_ns)
+        self.host_epochs = max(self.host_epochs, epoch + 1)
+
+    def getHostTiming(self):
+        """
+        Host stage timing for the run: (epochs x HOST_TIMING_STAGES x (start_ns, end_ns)) array,
+        relative to the run start. -1 where a stage did not run
+        """
+        return self.host_timing[:self.host_epochs].copy()
+
+    def getHostTimingRecords(self):
+        """
+        Host stage timing for the run as a HOST_TIMING_DTYPE structured array, with a field named
+        for each stage, so it can be read back without HOST_TIMING_STAGES
+        """
+        return self.host_timing[:self.host_epochs].reshape(-1, len(HOST_TIMING_STAGES) * 2).copy().view(HOST_TIMING_DTYPE)[:, 0]
+
+    def getPhaseTiming(self):
+        """
+        Planned vs. actual phase end times for the run, as a PHASE_TIMING_DTYPE structured array
+        """
+        return np.array(self.phase_timing, dtype=PHASE_TIMING_DTYPE)
+
+
+RPC_TIMING_DTYPE = np.dtype([('epoch', 'i4'),
+                             ('start_ns', 'i8'),  # relative to run start
+                             ('duration_ns', 'i8'),
+                             ('num_requests', 'i4'),
+                             ('name', 'S32')])  # first request in the request list
+
+RPC_HISTOGRAM_BINS_MS = np.concatenate([[0], np.logspace(-2, 3, 21)])  # 10 us to 1 sec, log spaced
+
+
+class RpcLatencyMonitor():
+    """
+    Times every request list sent by the flystim manager (single calls and multicalls alike).
+
+    flyrpc's MySocketClient is one-way, so this is the time the client blocks sending each request
+    list, not a round trip: it grows when the socket backs up because the server or network is
+    not keeping up. Recent calls are kept in a rolling window for stats, and calls during a run
+    are recorded for the run's timing data.
+
+    Usage:
+        rpc_monitor.attach(client.manager)
+        rpc_monitor.startRun(warn_threshold=0.1 * pre_time)
+        rpc_monitor.epoch = epoch  # tag calls with the current epoch
+        rpc_timing = rpc_monitor.stopRun()
+    """
+    def __init__(self, window_size=1000, clock=None):
+        self.clock = MonotonicClock() if clock is None else clock
+        self.window = deque(maxlen=window_size)  # durations (ns) of the most recent calls
+        self.lock = threading.Lock()
+        self.epoch = -1
+        self.run_start_ns = None
+        self.run_calls = []  # RPC_TIMING_DTYPE rows for calls during the run
+        self.warn_threshold_ns = None
+        self.warned_epoch = None  # only warn once per epoch
+
+    def attach(self, manager):
+        """
+        Wrap manager.write_request_list, which every manager call and multicall goes through
+        """
+        write_request_list = manager.write_request_list
+
+        def timedWriteRequestList(request_list):
+            t0 = self.clock.perf_counter_ns()
+            try:
+                return write_request_list(request_list)
+            finally:
+                self.record(request_list, t0, self.clock.perf_counter_ns())
+
+        manager.write_request_list = timedWriteRequestList
+
+    def record(self, request_list, start_ns, end_ns):
+        duration_ns = end_ns - start_ns
+        name = request_list[0].get('name', '') if len(request_list) > 0 else ''
+        with self.lock:
+            self.window.append(duration_ns)
+            if self.run_start_ns is not None:
+                self.run_calls.append((self.epoch, start_ns - self.run_start_ns, duration_ns, len(request_list), name[:32]))
+
+        if self.warn_threshold_ns is not None and duration_ns > self.warn_threshold_ns and self.warned_epoch != self.epoch:
+            self.warned_epoch = self.epoch
+            print('Warning - stim server call {} took {:.1f} ms (epoch {})'.format(name, duration_ns / 1e6, self.epoch))
+
+    def startRun(self, warn_threshold=None):
+        """
+        Start recording calls for a run. Warn when a call blocks longer than warn_threshold (sec)
+        """
+        with self.lock:
+            self.run_start_ns = self.clock.perf_counter_ns()
+            self.run_calls = []
+        self.epoch = -1
+        self.warned_epoch = None
+        self.warn_threshold_ns = None if warn_threshold is None else int(warn_threshold * 1e9)
+
+    def stopRun(self):
+        """
+        Stop recording and return the run's calls as an RPC_TIMING_DTYPE structured array
+        """
+        with self.lock:
+            self.run_start_ns = None
+            rpc_timing = np.array(self.run_calls, dtype=RPC_TIMING_DTYPE)
+            self.run_calls = []
+        self.warn_threshold_ns = None
+        return rpc_timing
+
+    def getStats(self):
+        """
+        Duration percentiles (ms) and histogram (counts in RPC_HISTOGRAM_BINS_MS) over the rolling window
+        """
+        with self.lock:
+            durations = np.array(self.window) / 1e6
+        if len(durations) == 0:
+            return {'n': 0}
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        histogram, _ = np.histogram(np.clip(durations, 0, RPC_HISTOGRAM_BINS_MS[-1]), bins=RPC_HISTOGRAM_BINS_MS)
+        return {'n': len(durations), 'p50': p50, 'p90': p90, 'p99': p99, 'max': durations.max(), 'histogram': histogram}
+
+    def getStatusText(self):
+        stats = self.getStats()
+        if stats['n'] == 0:
+            return 'RPC: no calls'
+        return 'RPC ms: p50 {:.2f}, p99 {:.2f}, max {:.1f}'.format(stats['p50'], stats['p99'], stats['max'])
+
+
+def summarizeHostTiming(host_timing):
+    """
+    Per-stage duration percentiles (ms) and drift (change in duration, ms per 100 epochs) for a
+    host timing array from EpochScheduler.getHostTiming
+    """
+    summary = {}
+    for stage_ind, stage in enumerate(HOST_TIMING_STAGES):
+        ran = host_timing[:, stage_ind, 0] >= 0
+        if not np.any(ran):
+            continue
+        durations = (host_timing[ran, stage_ind, 1] - host_timing[ran, stage_ind, 0]) / 1e6
+        epochs = np.flatnonzero(ran)
+        drift = np.polyfit(epochs, durations, 1)[0] * 100 if len(epochs) > 1 else 0.0
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        summary[stage] = {'n': len(durations), 'p50': p50, 'p90': p90, 'p99': p99, 'max': durations.max(), 'drift': drift}
+    return summary
+
+
+def printHostTimingSummary(summary):
+    print('{:<22}{:>6}{:>10}{:>10}{:>10}{:>10}{:>14}'.format('stage (ms)', 'n', 'p50', 'p90', 'p99', 'max', 'drift/100ep'))
+    for stage, stats in summary.items():
+        print('{:<22}{:>6}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>14.3f}'.format(stage, stats['n'], stats['p50'], stats['p90'],
+                                                                         stats['p99'], stats['max'], stats['drift']))
@@ -9,7 +9,7 @@ def getAvailableUserNames():
     # looks for user names based on .yaml config files in visprotocol/config directory
     # Filenames should be: USER_config.yaml
     config_dir = os.path.join(os.path.abspath(os.path.join(os.path.split(__file__)[0], os.pardir)), 'config')
-    user_config_files = [os.path.split(f)[1] for f in glob.glob(os.path.join(config_dir,'*.yaml'))]
+    user_config_files = [os.path.split(f)[1] for f in glob.glob(os.path.join(config_dir,'*_config.yaml'))]
 
     user_names = [f.split('_config')[0] for f in user_config_files]
     return user_names
@@ -39,3 +39,60 @@ def getRigConfiguration(user_name, rig_name):
     rig_cfg = cfg.get('rig_config').get(rig_name)
 
     return rig_cfg
+
+
+def getRigRegistry():
+    # server, DAQ and loco options for each rig config (rig_name), from config/rigs.yaml
+    path_to_registry = os.path.join(os.path.abspath(os.path.join(os.path.split(__file__)[0], os.pardir)), 'config', 'rigs.yaml')
+    if not os.path.isfile(path_to_registry):
+        raise FileNotFoundError('Rig registry not found at {}'.format(path_to_registry))
+    with open(path_to_registry, 'r') as ymlfile:
+        registry = yaml.safe_load(ymlfile)
+    return registry if registry is not None else {}
+
+
+def getRigOptions(rig_name, rig_config):
+    # rig registry entry for rig_name, overridden by keys set in rig_config itself
+    registry = getRigRegistry()
+    if rig_name not in registry and 'server_options' not in rig_config:
+        print('!!! WARNING: no entry for rig {} in config/rigs.yaml and no server_options in its rig_config. '
+              'Using a local stim server and no DAQ: acquisition will not be triggered !!!'.format(rig_name))
+    rig_options = dict(registry.get(rig_name, {}))
+    for key in ('server_options', 'daq', 'loco_options'):
+        if key in rig_config:
+            rig_options[key] = rig_config[key]
+    return rig_options
+
+
+def getRunConfiguration(user_name, rig_name, draw_screens=False):
+    # user config plus the run settings derived from the selected rig, as used by the GUI and batch runs
+    cfg = getUserConfiguration(user_name).copy()
+    cfg['user_name'] = user_name
+    cfg['rig_name'] = rig_name
+    cfg['draw_screens'] = draw_screens
+
+    rig_config = cfg['rig_config'][rig_name]
+    cfg['server_data_directory'] = rig_config['server_data_directory'] if 'server_data_directory' in rig_config else None
+    cfg['loco_avail'] = 'locomotion' in rig_config and rig_config['locomotion']
+    rig_options = getRigOptions(rig_name, rig_config)
+    cfg['server_options'] = rig_options.get('server_options')
+    cfg['daq'] = rig_options.get('daq')
+    cfg['loco_options'] = rig_options.get('loco_options', {})
+    return cfg
+
+
+def getAvailableProtocols(user_name):
+    # protocol classes defined in visprotocol/protocol/USER_protocol.py. Imports that module
+    from visprotocol import protocol
+    return getattr(protocol, user_name + '_protocol').BaseProtocol.__subclasses__()
+
+
+def getAvailableProtocolNames(user_name):
+    # names of the protocols in visprotocol/protocol/USER_protocol.py, without importing it
+    from visprotocol import protocol
+    return protocol.getProtocolNames(user_name + '_protocol')
+
+
+def getProtocolClass(user_name, protocol_name):
+    from visprotocol import protocol
+    return getattr(getattr(protocol, user_name + '_protocol'), protocol_name)